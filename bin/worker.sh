@@ -1,6 +1,44 @@
 #!/usr/bin/env bash
 set -eux
 
+# pre-merge the PDF templates used to build request packages
+python manage.py build_packages
+
+# schedule (or unschedule) delivering packages in bundles
+python manage.py schedule_bundles
+
+# schedule (or unschedule) packaging requests in batches
+python manage.py schedule_package_batches
+
+# deliver queued emails apart from the cluster workers
+if [[ "${VITAL_RECORDS_EMAIL_DISPATCHER:-false}" == [Tt]rue ]]; then
+    python manage.py dispatch_emails &
+fi
+
+# queue submitted requests from the outbox
+if [[ "${VITAL_RECORDS_SUBMIT_OUTBOX:-false}" == [Tt]rue ]]; then
+    python manage.py drain_outbox &
+fi
+
+# run a DjangoQ cluster for each named queue, with its own workers
+queues="${Q_QUEUES:-}"
+for queue in ${queues//,/ }; do
+    Q_CLUSTER_NAME="$queue" python manage.py qcluster &
+done
+
 # run DjangoQ cluster worker
+python manage.py qcluster &
+
+# pass a stop signal on to every process
+stop() {
+    kill -TERM $(jobs -p) 2>/dev/null || true
+}
+trap stop TERM INT
 
-python manage.py qcluster
+# wait until a process exits, or a stop signal comes in; then stop the rest, so the container exits and is restarted
+# rather than running on without the process
+status=0
+wait -n || status=$?
+stop
+wait || true
+exit "$status"
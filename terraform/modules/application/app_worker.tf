@@ -108,6 +108,14 @@ resource "azurerm_container_app" "worker" {
         name  = "POSTGRES_HOSTNAME"
         value = var.database_fqdn
       }
+      # Task queue
+      env {
+        # no named queues: one cluster takes every task, see bin/worker.sh
+        name  = "Q_QUEUES"
+        value = ""
+      }
+      # The other Q_* and VITAL_RECORDS_* settings are left at their defaults in web/settings.py (listed in .env.sample),
+      # which package and email each request in its own task, without bundles, batches or the email dispatcher
 
       volume_mounts {
         name = var.storage_share_names.requests
@@ -0,0 +1,262 @@
+"""
+Benchmarks for building vital records request packages.
+
+For each record type, creates synthetic `VitalRecordsRequest` rows in a throwaway test database and times:
+
+- application: filling the application fields from the request, with the record type's schema
+- sworn_statement: filling the sworn statement fields from the request, with the record type's schema
+- handler: the full `PackageTask.handler`, from loading the request to storing the package file
+
+Along with the peak RSS of the process benchmarking the record type, the peak bytes allocated by a single handler
+call, and the size of the package file it writes. Each record type is benchmarked in a fresh process, so its peak RSS
+isn't inflated by the others.
+
+Usage:
+
+    # run the benchmarks and save the results as a JSON baseline
+    python -m tests.benchmarks.package run --output tests/benchmarks/baselines/package.json
+
+    # run again, e.g. on a branch, and flag metrics more than 10% worse than the baseline
+    python -m tests.benchmarks.package run --output /tmp/package.json
+    python -m tests.benchmarks.package compare tests/benchmarks/baselines/package.json /tmp/package.json --threshold 0.1
+
+`compare` exits with a non-zero status when any metric regressed. Timings are only comparable between runs on the same
+machine, so compare against a baseline produced there. Run the benchmarks again, and commit the new baseline, along with
+any change to how packages are filled, rendered or written, so later comparisons measure against current numbers.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+PACKAGE_TYPES = ("birth", "death", "marriage")
+STAGES = ("application", "sworn_statement", "handler")
+# metrics that are compared against a baseline, all lower is better
+METRICS = ("p50_ms", "p95_ms", "peak_rss_kb", "allocated_kb", "output_bytes")
+
+REQUEST_FIELDS = {
+    "fire": "palisades",
+    "relationship": "self",
+    "legal_attestation": "Jane Anne Doe",
+    "first_name": "Jane",
+    "middle_name": "Anne",
+    "last_name": "Doe",
+    "county_of_event": "Los Angeles",
+    "date_of_birth": datetime.date(1990, 9, 22),
+    "date_of_event": datetime.date(2025, 1, 7),
+    "person_1_first_name": "Jane",
+    "person_1_middle_name": "Anne",
+    "person_1_last_name": "Doe",
+    "person_1_birth_last_name": "Smith",
+    "person_2_first_name": "John",
+    "person_2_middle_name": "Adam",
+    "person_2_last_name": "Doe",
+    "person_2_birth_last_name": "Doe",
+    "number_of_records": 2,
+    "order_first_name": "Jane",
+    "order_last_name": "Doe",
+    "address": "1234 Main Street",
+    "address_2": "Apt 5",
+    "city": "Los Angeles",
+    "state": "CA",
+    "zip_code": "90001",
+    "email_address": "jane.doe@example.com",
+    "phone_number": "5555555555",
+}
+
+
+def percentile(samples: list[float], percent: int) -> float:
+    """The `percent` percentile of samples, interpolating between the closest ranks."""
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[percent - 1]
+
+
+def summarize(samples: list[float]) -> dict:
+    """p50 and p95 of samples, given in seconds, in milliseconds."""
+    return {
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+    }
+
+
+def _setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.web.settings")
+    import django
+
+    django.setup()
+
+
+def _timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def benchmark(request_type: str, iterations: int, warmup: int = 2) -> dict:
+    """Benchmark packaging requests of request_type, in a new test database. Returns the results for this type."""
+    _setup_django()
+
+    from django.db import connection
+    from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+    from web.vital_records.models import VitalRecordsRequest
+    from web.vital_records.tasks import package, store
+
+    create_application = package.APPLICATIONS[request_type].fill
+    create_sworn_statement = package.SWORN_STATEMENTS[request_type].fill
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with (
+            tempfile.TemporaryDirectory() as storage_dir,
+            override_settings(STORAGE_DIR=storage_dir, VITAL_RECORDS_PACKAGE_STORE_DIR=storage_dir),
+        ):
+            now = datetime.datetime.now(datetime.UTC)
+            request = VitalRecordsRequest.objects.create(
+                type=request_type, status="enqueued", started_at=now, submitted_at=now, enqueued_at=now, **REQUEST_FIELDS
+            )
+            task = package.PackageTask(request.id)
+
+            def handle():
+                VitalRecordsRequest.objects.filter(pk=request.id).update(status="enqueued")
+                # otherwise the package is already stored, and isn't rendered again
+                for stored in os.listdir(storage_dir):
+                    os.remove(os.path.join(storage_dir, stored))
+                return task.handler(request.id)
+
+            # parse templates, start the render engine, etc. before measuring
+            for _ in range(warmup):
+                handle()
+
+            samples = {stage: [] for stage in STAGES}
+            for _ in range(iterations):
+                samples["application"].append(_timed(create_application, request))
+                samples["sworn_statement"].append(_timed(create_sworn_statement, request))
+                samples["handler"].append(_timed(handle))
+
+            tracemalloc.start()
+            package = handle()
+            _, allocated = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            output_bytes = os.path.getsize(store.get_package_store().path(package))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    results = {stage: summarize(samples[stage]) for stage in STAGES}
+    results["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["allocated_kb"] = round(allocated / 1024)
+    results["output_bytes"] = output_bytes
+    return results
+
+
+def run(request_types: list[str], iterations: int) -> dict:
+    """Benchmark each record type in its own process."""
+    results = {}
+    for request_type in request_types:
+        # spawn, not fork: a fresh interpreter, so peak RSS only covers this record type
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results[request_type] = pool.submit(benchmark, request_type, iterations).result()
+
+    from importlib.metadata import version
+
+    return {
+        "created_at": datetime.datetime.now(datetime.UTC).isoformat(timespec="seconds"),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "pypdf": version("pypdf"),
+        "iterations": iterations,
+        "results": results,
+    }
+
+
+def _metrics(results: dict):
+    """(name, value) for each compared metric of a record type's results, e.g. ("handler.p95_ms", 12.3)."""
+    for stage in STAGES:
+        for metric, value in results.get(stage, {}).items():
+            yield f"{stage}.{metric}", value
+    for metric in METRICS:
+        if metric in results:
+            yield metric, results[metric]
+
+
+def compare(baseline: dict, current: dict, threshold: float, min_ms: float = 0.5) -> list[str]:
+    """Return a description of each metric in current that is worse than baseline by more than threshold (a ratio).
+
+    Timings must also be worse by more than min_ms, so noise in sub-millisecond stages isn't flagged.
+    """
+    regressions = []
+    for request_type, results in current["results"].items():
+        baseline_metrics = dict(_metrics(baseline["results"].get(request_type, {})))
+        for name, value in _metrics(results):
+            expected = baseline_metrics.get(name)
+            if not expected:
+                continue
+            change = (value - expected) / expected
+            if change > threshold and not (name.endswith("_ms") and value - expected <= min_ms):
+                regressions.append(f"{request_type} {name}: {expected} -> {value} (+{change:.0%})")
+    return regressions
+
+
+def _print_results(report: dict):
+    for request_type, results in report["results"].items():
+        print(f"{request_type}:")
+        for name, value in _metrics(results):
+            print(f"  {name}: {value}")
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m tests.benchmarks.package", description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--types", nargs="+", choices=PACKAGE_TYPES, default=list(PACKAGE_TYPES))
+    run_parser.add_argument("--iterations", type=int, default=50)
+    run_parser.add_argument("--output", help="Save the results as JSON to this file")
+
+    compare_parser = commands.add_parser("compare", help="Flag regressions against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Allowed increase, e.g. 0.1 for 10%%")
+    compare_parser.add_argument("--min-ms", type=float, default=0.5, help="Allowed increase of timings, regardless of ratio")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        report = run(args.types, args.iterations)
+        _print_results(report)
+        if args.output:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+                f.write("\n")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    regressions = compare(baseline, current, args.threshold, args.min_ms)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regressions over {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
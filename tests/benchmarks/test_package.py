@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from tests.benchmarks.package import compare, main, percentile, summarize
+
+
+def _report(handler_p95_ms=100.0, application_p95_ms=0.05, output_bytes=400000):
+    return {
+        "results": {
+            "birth": {
+                "application": {"p50_ms": 0.04, "p95_ms": application_p95_ms},
+                "handler": {"p50_ms": 90.0, "p95_ms": handler_p95_ms},
+                "output_bytes": output_bytes,
+            }
+        }
+    }
+
+
+def test_percentile():
+    samples = [float(n) for n in range(1, 101)]
+
+    assert percentile(samples, 50) == pytest.approx(50.5)
+    assert percentile(samples, 95) == pytest.approx(95.05)
+    assert percentile([3.0], 95) == 3.0
+
+
+def test_summarize():
+    assert summarize([0.001, 0.002, 0.003]) == {"p50_ms": 2.0, "p95_ms": 2.9}
+
+
+def test_compare__no_regressions():
+    assert compare(_report(), _report(handler_p95_ms=105.0, output_bytes=390000), threshold=0.1) == []
+
+
+def test_compare__regressions():
+    regressions = compare(_report(), _report(handler_p95_ms=150.0, output_bytes=500000), threshold=0.1)
+
+    assert regressions == ["birth handler.p95_ms: 100.0 -> 150.0 (+50%)", "birth output_bytes: 400000 -> 500000 (+25%)"]
+
+
+def test_compare__sub_millisecond_noise():
+    assert compare(_report(), _report(application_p95_ms=0.1), threshold=0.1) == []
+
+
+def test_compare__new_type():
+    current = _report()
+    current["results"]["death"] = current["results"]["birth"]
+
+    assert compare(_report(), current, threshold=0.1) == []
+
+
+def test_main__compare(tmp_path, capsys):
+    baseline, current = tmp_path / "baseline.json", tmp_path / "current.json"
+    baseline.write_text(json.dumps(_report()))
+    current.write_text(json.dumps(_report(handler_p95_ms=150.0)))
+
+    assert main(["compare", str(baseline), str(baseline)]) == 0
+    assert main(["compare", str(baseline), str(current)]) == 1
+    assert "REGRESSION birth handler.p95_ms" in capsys.readouterr().out
@@ -0,0 +1,153 @@
+import pickle
+
+from django_q.conf import Conf
+from django_q.models import OrmQ
+import psycopg
+import pytest
+
+from web.core.broker import PostgresBroker
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def broker() -> PostgresBroker:
+    return PostgresBroker("test-queue")
+
+
+@pytest.fixture
+def listening(mocker):
+    """The broker's database is Postgres."""
+    return mocker.patch.object(PostgresBroker, "listening", new_callable=mocker.PropertyMock, return_value=True)
+
+
+@pytest.fixture
+def mock_connect(mocker):
+    return mocker.patch("web.core.broker.psycopg.connect")
+
+
+@pytest.fixture
+def mock_sleep(mocker):
+    return mocker.patch("web.core.broker.sleep")
+
+
+def test_channel(broker):
+    assert broker.channel == "django_q:test-queue"
+
+
+def test_listening(broker):
+    # the test database is SQLite
+    assert broker.listening is False
+
+
+def test_pickle(broker, listening, mock_connect):
+    broker._listen()
+
+    unpickled = pickle.loads(pickle.dumps(broker))
+
+    assert unpickled.list_key == "test-queue"
+    assert unpickled._listener is None
+
+
+def test_enqueue(broker, mocker):
+    mock_connections = mocker.patch("web.core.broker.connections")
+
+    task_id = broker.enqueue("payload")
+
+    assert OrmQ.objects.get(pk=task_id).payload == "payload"
+    mock_connections[Conf.ORM].cursor.assert_not_called()
+
+
+def test_enqueue__listening(broker, listening, mocker):
+    mock_connections = mocker.patch("web.core.broker.connections")
+    mock_cursor = mock_connections[Conf.ORM].cursor.return_value.__enter__.return_value
+
+    broker.enqueue("payload")
+
+    mock_cursor.execute.assert_called_once_with("SELECT pg_notify(%s, '')", ["django_q:test-queue"])
+
+
+def test_dequeue(broker, mocker):
+    mock_wait = mocker.patch.object(broker, "wait")
+    task_id = broker.enqueue("payload")
+
+    assert broker.dequeue() == [(task_id, "payload")]
+    mock_wait.assert_not_called()
+    # claimed, so not dequeued again
+    assert broker.dequeue() is None
+
+
+def test_dequeue__empty(broker, mocker):
+    mock_wait = mocker.patch.object(broker, "wait")
+
+    assert broker.dequeue() is None
+    mock_wait.assert_called_once_with(Conf.POLL)
+
+
+def test_dequeue__listening(broker, listening, mock_connect, mocker):
+    mocker.patch.object(broker, "wait")
+
+    broker.dequeue()
+
+    # listening before the queue is checked
+    mock_connect.assert_called_once()
+
+
+def test_wait(broker, mock_connect, mock_sleep):
+    broker.wait(5)
+
+    mock_sleep.assert_called_once_with(5)
+    mock_connect.assert_not_called()
+
+
+def test_wait__listening(mocker, broker, listening, mock_connect, mock_sleep):
+    mock_listener = mock_connect.return_value
+    mock_listener.closed = False
+    mock_listener.notifies.side_effect = [iter(["notify"]), iter(["notify", "notify"]), iter([])]
+
+    broker.wait(5)
+
+    assert mock_connect.call_args.kwargs["autocommit"] is True
+    mock_listener.execute.assert_called_once()
+    assert "test-queue" in mock_listener.execute.call_args.args[0].as_string(None)
+    # woken, then draining the notifications already there
+    assert mock_listener.notifies.call_args_list == [mocker.call(timeout=5, stop_after=1), mocker.call(timeout=0)]
+    mock_sleep.assert_not_called()
+
+    broker.wait(5)
+
+    # on the same connection
+    mock_connect.assert_called_once()
+
+
+def test_wait__timeout(broker, listening, mock_connect, mock_sleep):
+    mock_listener = mock_connect.return_value
+    mock_listener.closed = False
+    mock_listener.notifies.return_value = iter([])
+
+    broker.wait(5)
+
+    # not woken, so there's nothing to drain
+    mock_listener.notifies.assert_called_once_with(timeout=5, stop_after=1)
+    mock_sleep.assert_not_called()
+
+
+def test_wait__listen_error(broker, listening, mock_connect, mock_sleep):
+    mock_connect.side_effect = psycopg.OperationalError("connection refused")
+
+    broker.wait(5)
+
+    mock_sleep.assert_called_once_with(5)
+    assert broker._listener is None
+
+
+def test_wait__lost_connection(broker, listening, mock_connect, mock_sleep):
+    mock_listener = mock_connect.return_value
+    mock_listener.closed = False
+    mock_listener.notifies.side_effect = psycopg.OperationalError("connection lost")
+
+    broker.wait(5)
+
+    mock_listener.close.assert_called_once()
+    mock_sleep.assert_called_once_with(5)
+    assert broker._listener is None
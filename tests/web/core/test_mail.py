@@ -0,0 +1,279 @@
+import base64
+import io
+import json
+import os
+import tracemalloc
+
+from azure.communication.email import EmailClient
+from azure.core.credentials import AccessToken
+from azure.core.pipeline.transport import HttpTransport
+from django.core.mail import EmailMultiAlternatives
+import pytest
+from requests.utils import super_len
+
+from web.core.mail import CHUNK_SIZE, EmailBackend, FileAttachment, JsonStream
+
+
+@pytest.fixture
+def package_file(tmp_path) -> str:
+    package_file = tmp_path / "package.pdf"
+    # a few chunks, and a bit, so the last chunk is padded
+    package_file.write_bytes(os.urandom(CHUNK_SIZE * 3 + 1))
+    return str(package_file)
+
+
+@pytest.fixture
+def attachment(package_file) -> FileAttachment:
+    return FileAttachment(package_file, "request.pdf", "application/pdf")
+
+
+def _content(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class TestFileAttachment:
+    def test_init(self, attachment, package_file):
+        assert attachment.path == package_file
+        assert attachment.size == os.path.getsize(package_file)
+        assert attachment.get_filename() == "request.pdf"
+        assert attachment.get_content_type() == "application/pdf"
+
+    def test_init__missing(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            FileAttachment(str(tmp_path / "missing.pdf"), "request.pdf", "application/pdf")
+
+    def test_get_payload(self, attachment, package_file):
+        assert attachment.get_payload(decode=True) == _content(package_file)
+
+    def test_iter_base64(self, attachment, package_file):
+        chunks = list(attachment.iter_base64())
+
+        assert len(chunks) == 4
+        assert b"".join(chunks) == base64.b64encode(_content(package_file))
+
+    def test_read_base64(self, attachment, package_file):
+        assert attachment.read_base64() == base64.b64encode(_content(package_file)).decode()
+
+    @pytest.mark.parametrize("size", [0, 1, 2, 3, 4])
+    def test_base64_size(self, tmp_path, size):
+        package_file = tmp_path / "package.pdf"
+        package_file.write_bytes(b"x" * size)
+
+        attachment = FileAttachment(str(package_file), "request.pdf", "application/pdf")
+
+        assert attachment.base64_size() == len(base64.b64encode(b"x" * size))
+
+    def test_message(self, attachment, package_file):
+        message = EmailMultiAlternatives(subject="Subject", body="text", to=["office@example.com"])
+        message.attach(attachment)
+
+        # serialized by backends that send the whole message, e.g. SMTP
+        mime = message.message()
+        (_, part) = mime.get_payload()
+        assert part.get_filename() == "request.pdf"
+        assert part.get_payload(decode=True) == _content(package_file)
+        assert b"request.pdf" in mime.as_bytes()
+
+
+class TestJsonStream:
+    @pytest.fixture
+    def obj(self, attachment) -> dict:
+        return {"content": {"subject": "Subject"}, "attachments": [{"name": "request.pdf", "contentInBase64": attachment}]}
+
+    def _expected(self, obj: dict, package_file: str) -> bytes:
+        obj["attachments"][0]["contentInBase64"] = base64.b64encode(_content(package_file)).decode()
+        return json.dumps(obj).encode()
+
+    def test_from_json(self, obj, package_file):
+        stream = JsonStream.from_json(obj)
+
+        expected = self._expected(obj, package_file)
+        assert len(stream) == len(expected)
+        assert stream.read() == expected
+
+    def test_from_json__no_attachments(self):
+        stream = JsonStream.from_json({"content": {"subject": "Subject"}})
+
+        assert stream.read() == b'{"content": {"subject": "Subject"}}'
+
+    def test_from_json__not_serializable(self):
+        with pytest.raises(TypeError):
+            JsonStream.from_json({"content": object()})
+
+    def test_read__chunks(self, obj, package_file):
+        stream = JsonStream.from_json(obj)
+
+        chunks = []
+        while chunk := stream.read(8192):
+            assert len(chunk) <= 8192
+            chunks.append(chunk)
+
+        assert b"".join(chunks) == self._expected(obj, package_file)
+        assert stream.tell() == len(stream)
+
+    def test_seek__rewind(self, obj):
+        stream = JsonStream.from_json(obj)
+        first = stream.read(100)
+        stream.read(1000)
+
+        assert stream.seek(0) == 0
+        assert stream.tell() == 0
+        assert stream.read(100) == first
+
+    def test_seek__current(self, obj):
+        stream = JsonStream.from_json(obj)
+        chunk = stream.read(100)
+
+        assert stream.seek(0, io.SEEK_CUR) == len(chunk)
+
+    def test_seek__unsupported(self, obj):
+        stream = JsonStream.from_json(obj)
+
+        with pytest.raises(io.UnsupportedOperation):
+            stream.seek(10)
+        with pytest.raises(io.UnsupportedOperation):
+            stream.seek(0, io.SEEK_END)
+
+    def test_read__memory(self, tmp_path):
+        package_file = tmp_path / "package.pdf"
+        package_file.write_bytes(os.urandom(CHUNK_SIZE * 40))
+        stream = JsonStream.from_json({"contentInBase64": FileAttachment(str(package_file), "p.pdf", "application/pdf")})
+
+        tracemalloc.start()
+        while stream.read(8192):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # about a chunk and its encoding, rather than the whole file
+        assert peak < CHUNK_SIZE * 4
+        assert peak < package_file.stat().st_size / 10
+
+
+class TestEmailBackend:
+    @pytest.fixture
+    def message(self, attachment) -> EmailMultiAlternatives:
+        message = EmailMultiAlternatives(subject="Subject", body="text", to=["office@example.com"])
+        message.attach_alternative("<p>html</p>", "text/html")
+        message.attach("notes.txt", "some notes", "text/plain")
+        message.attach(attachment)
+        return message
+
+    def test_streaming(self):
+        assert not EmailBackend(connection_string="endpoint=https://example.com/;accesskey=a2V5").streaming
+        assert not EmailBackend(endpoint="https://example.com/", key_credential="a2V5").streaming
+        assert EmailBackend(endpoint="https://example.com/", tenant_id="tenant").streaming
+
+    def test_convert_message__key(self, message, package_file):
+        backend = EmailBackend(connection_string="endpoint=https://example.com/;accesskey=a2V5")
+
+        payload = backend.convert_message(message)
+
+        assert payload["content"] == {"subject": "Subject", "plainText": "text", "html": "<p>html</p>"}
+        notes, package = payload["attachments"]
+        assert notes == {"name": "notes.txt", "contentType": "text/plain", "contentInBase64": "c29tZSBub3Rlcw=="}
+        assert package == {
+            "name": "request.pdf",
+            "contentType": "application/pdf",
+            "contentInBase64": base64.b64encode(_content(package_file)).decode(),
+        }
+
+    def test_convert_message__token(self, message, package_file):
+        backend = EmailBackend(endpoint="https://example.com/", tenant_id="tenant")
+
+        payload = backend.convert_message(message)
+
+        assert isinstance(payload, JsonStream)
+        body = json.loads(payload.read())
+        assert body["content"]["subject"] == "Subject"
+        assert body["attachments"][1]["contentInBase64"] == base64.b64encode(_content(package_file)).decode()
+
+    def test_convert_message__token_request(self, message, package_file):
+        """The streamed body makes it through the provider's client to the transport, with its length."""
+
+        class Credential:
+            def get_token(self, *scopes, **kwargs):
+                return AccessToken("token", 2**31)
+
+        class Transport(HttpTransport):
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def open(self):
+                pass
+
+            def close(self):
+                pass
+
+            def send(self, request, **kwargs):
+                self.request = request
+                raise RuntimeError("sent")
+
+        transport = Transport()
+        client = EmailClient("https://example.com/", Credential(), transport=transport)
+        payload = EmailBackend(endpoint="https://example.com/", tenant_id="tenant").convert_message(message)
+
+        with pytest.raises(RuntimeError, match="sent"):
+            client.begin_send(payload, polling=False)
+
+        assert transport.request.body is payload
+        # the Content-Length the requests transport sends, rather than a chunked body
+        assert super_len(payload) == len(payload)
+        body = json.loads(payload.read())
+        assert body["attachments"][1]["contentInBase64"] == base64.b64encode(_content(package_file)).decode()
+
+    @pytest.fixture
+    def mock_EmailClient(self, mocker):
+        return mocker.patch("django_azure_communication_email.backend.EmailClient")
+
+    @pytest.fixture
+    def backend(self, mock_EmailClient) -> EmailBackend:
+        return EmailBackend(endpoint="https://example.com/", key_credential="a2V5")
+
+    def test_send_messages(self, backend, mock_EmailClient, message):
+        assert backend.send_messages([message]) == 1
+
+        mock_client = mock_EmailClient.return_value
+        mock_client.begin_send.assert_called_once()
+        # a client opened for the call is closed after it
+        mock_client.close.assert_called_once()
+        assert backend._client is None
+
+    def test_send_messages__connection(self, backend, mock_EmailClient, message):
+        with backend as connection:
+            assert connection.send_messages([message]) == 1
+            assert connection.send_messages([message, message]) == 2
+            # the same client, still open, across calls
+            mock_client = mock_EmailClient.return_value
+            mock_client.close.assert_not_called()
+
+        mock_EmailClient.assert_called_once()
+        assert mock_client.begin_send.call_count == 3
+        mock_client.close.assert_called_once()
+
+    def test_send_messages__failed(self, backend, mock_EmailClient, message):
+        mock_client = mock_EmailClient.return_value
+        mock_client.begin_send.side_effect = [ConnectionError(), None]
+
+        with backend as connection:
+            with pytest.raises(ConnectionError):
+                connection.send_messages([message])
+            # the client stays open for the next message
+            assert connection.send_messages([message]) == 1
+
+        mock_EmailClient.assert_called_once()
+        mock_client.close.assert_called_once()
+
+    def test_send_messages__fail_silently(self, mock_EmailClient, message):
+        backend = EmailBackend(endpoint="https://example.com/", key_credential="a2V5", fail_silently=True)
+        mock_EmailClient.return_value.begin_send.side_effect = [ConnectionError(), None]
+
+        assert backend.send_messages([message, message]) == 1
+
+    def test_send_messages__empty(self, backend, mock_EmailClient):
+        assert backend.send_messages([]) == 0
+        mock_EmailClient.assert_not_called()
@@ -0,0 +1,368 @@
+import pickle
+from uuid import uuid4
+
+from django.core.cache import cache
+from django_q.brokers.orm import ORM
+from django_q.conf import Conf
+from django_q.models import OrmQ, Task as TaskResult
+from django_q.signing import SignedPackage
+import pytest
+
+from web.core.tasks import EXECUTE, EXECUTE_HOOK, Pipeline, Task, check_argument, execute, execute_hook
+
+
+@pytest.fixture(autouse=True)
+def locmem_cache(settings):
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    cache.clear()
+
+
+class EchoTask(Task):
+    group = "test"
+    name = "echo"
+    hooked = []
+
+    def __init__(self, item_id, count=1):
+        super().__init__(item_id=item_id, count=count)
+
+    def handler(self, item_id, count=1):
+        return [str(item_id)] * count
+
+    def post_handler(self, task):
+        EchoTask.hooked.append(task.result)
+
+
+class DedupTask(EchoTask):
+    name = "dedup"
+    dedup_key = "echo:{item_id}"
+
+
+@pytest.fixture
+def echo_task():
+    EchoTask.hooked.clear()
+    return EchoTask("item", count=2)
+
+
+def test_task(echo_task):
+    assert echo_task.func == EXECUTE
+    assert echo_task.args == ("tests.web.core.test_tasks.EchoTask",)
+    assert echo_task.kwargs == {
+        "item_id": "item",
+        "count": 2,
+        "group": "test",
+        "task_name": "echo",
+        "hook": EXECUTE_HOOK,
+        "cluster": Conf.PREFIX,
+    }
+
+
+class QueuedTask(EchoTask):
+    name = "queued"
+    queue = "maintenance"
+
+
+def test_task__queue(settings):
+    settings.Q_QUEUES = ["maintenance"]
+
+    assert QueuedTask.get_cluster() == "maintenance"
+    assert QueuedTask("item").kwargs["cluster"] == "maintenance"
+
+
+def test_task__queue_disabled(settings):
+    settings.Q_QUEUES = []
+
+    # consumed by the default cluster
+    assert QueuedTask.get_cluster() == Conf.PREFIX
+    assert EchoTask.get_cluster() == Conf.PREFIX
+
+
+def test_task__envelope(echo_task):
+    # just the class path and arguments, rather than the task instance
+    assert b"EchoTask" in pickle.dumps(echo_task.args)
+    assert len(pickle.dumps((echo_task.func, echo_task.args, echo_task.kwargs))) < 300
+
+
+def test_task__arguments():
+    EchoTask(uuid4(), count=1)
+    EchoTask(item_id=["a", {"b": None}])
+
+    with pytest.raises(TypeError, match="object"):
+        EchoTask(object())
+
+
+@pytest.mark.parametrize("value", ["text", 1, 1.5, True, None, uuid4(), ["a", 1], {"a": [1, 2]}])
+def test_check_argument(value):
+    check_argument(value)
+
+
+@pytest.mark.parametrize("value", [object(), b"bytes", {1, 2}, ["a", object()], {"a": object()}])
+def test_check_argument__invalid(value):
+    with pytest.raises(TypeError):
+        check_argument(value)
+
+
+def test_execute():
+    assert execute("tests.web.core.test_tasks.EchoTask", item_id="item", count=2) == ["item", "item"]
+
+
+def test_execute__not_task():
+    with pytest.raises(TypeError, match="Not a Task"):
+        execute("web.core.tasks.check_argument", "item")
+
+
+def test_execute__missing():
+    with pytest.raises(ImportError):
+        execute("tests.web.core.test_tasks.MissingTask")
+
+
+def test_execute_hook(mocker, echo_task):
+    execute_hook(mocker.Mock(args=["tests.web.core.test_tasks.EchoTask"], kwargs={"item_id": "item"}, result="result"))
+
+    assert EchoTask.hooked == ["result"]
+
+
+@pytest.mark.django_db
+def test_run(echo_task):
+    echo_task.sync = True
+
+    task_id = echo_task.run()
+
+    result = TaskResult.objects.get(id=task_id)
+    assert result.success
+    assert result.func == EXECUTE
+    assert result.hook == EXECUTE_HOOK
+    assert result.result == ["item", "item"]
+    assert EchoTask.hooked == [["item", "item"]]
+
+
+@pytest.mark.django_db
+class TestRunMany:
+    def _envelopes(self) -> list[dict]:
+        return [SignedPackage.loads(row.payload) for row in OrmQ.objects.order_by("id")]
+
+    def test_run_many(self):
+        tasks = EchoTask.run_many({"item_id": f"item-{i}"} for i in range(5))
+
+        assert len(tasks) == 5
+        assert all(isinstance(task, EchoTask) and task.started for task in tasks)
+        envelopes = self._envelopes()
+        assert [envelope["id"] for envelope in envelopes] == [task.id for task in tasks]
+        for i, envelope in enumerate(envelopes):
+            assert envelope["func"] == EXECUTE
+            assert envelope["args"] == ("tests.web.core.test_tasks.EchoTask",)
+            assert envelope["kwargs"] == {"item_id": f"item-{i}", "count": 1}
+            assert envelope["hook"] == EXECUTE_HOOK
+            assert envelope["group"] == "test"
+            assert envelope["name"] == "echo"
+            # and the envelope runs the task's handler
+            assert execute(*envelope["args"], **envelope["kwargs"]) == [f"item-{i}"]
+
+    def test_run_many__queue(self, settings):
+        settings.Q_QUEUES = ["maintenance"]
+
+        QueuedTask.run_many([{"item_id": "item"}])
+        EchoTask.run_many([{"item_id": "item"}])
+
+        assert list(OrmQ.objects.order_by("id").values_list("key", flat=True)) == ["maintenance", Conf.PREFIX]
+
+    def test_run_many__chunks(self, mocker):
+        bulk_create = mocker.spy(OrmQ.objects.get_queryset().__class__, "bulk_create")
+
+        EchoTask.run_many(({"item_id": f"item-{i}"} for i in range(5)), chunk_size=2)
+
+        assert [len(call.args[1]) for call in bulk_create.call_args_list] == [2, 2, 1]
+        assert OrmQ.objects.count() == 5
+
+    def test_run_many__group(self):
+        tasks = EchoTask.run_many([{"item_id": "a"}, {"item_id": "b"}], group="redrive")
+
+        assert [task.group for task in tasks] == ["redrive", "redrive"]
+        assert [envelope["group"] for envelope in self._envelopes()] == ["redrive", "redrive"]
+
+    def test_run_many__empty(self):
+        assert EchoTask.run_many([]) == []
+        assert OrmQ.objects.count() == 0
+
+    def test_run_many__invalid(self):
+        with pytest.raises(TypeError):
+            EchoTask.run_many([{"item_id": object()}])
+
+        assert OrmQ.objects.count() == 0
+
+    def test_run_many__notify(self, mocker):
+        broker = mocker.Mock(spec=ORM, list_key="test-queue")
+        broker.notify = mocker.Mock()
+        mocker.patch("web.core.tasks.get_broker", return_value=broker)
+
+        EchoTask.run_many(({"item_id": f"item-{i}"} for i in range(3)), chunk_size=2)
+
+        assert broker.notify.call_count == 2
+        broker.enqueue.assert_not_called()
+
+    def test_run_many__other_broker(self, mocker):
+        mocker.patch("web.core.tasks.get_broker")
+        run = mocker.patch.object(EchoTask, "run")
+
+        tasks = EchoTask.run_many([{"item_id": "a"}, {"item_id": "b"}])
+
+        assert len(tasks) == 2
+        assert run.call_count == 2
+        assert OrmQ.objects.count() == 0
+
+    def test_run_many__sync(self, mocker):
+        mocker.patch("web.core.tasks.Conf.SYNC", True)
+        run = mocker.patch.object(EchoTask, "run")
+
+        EchoTask.run_many([{"item_id": "a"}])
+
+        run.assert_called_once()
+        assert OrmQ.objects.count() == 0
+
+
+@pytest.mark.django_db
+class TestDedup:
+    @pytest.fixture(autouse=True)
+    def clear_hooked(self):
+        EchoTask.hooked.clear()
+
+    def test_get_dedup_key(self):
+        assert EchoTask.get_dedup_key(item_id="item") is None
+        assert DedupTask.get_dedup_key(item_id="item", count=2) == "task-dedup:echo:item"
+
+    def test_run(self):
+        assert DedupTask("item").run()
+
+        # pending
+        assert DedupTask("item").run() is None
+        assert DedupTask("other").run()
+        assert OrmQ.objects.count() == 2
+
+    def test_run__not_deduped(self):
+        assert EchoTask("item").run()
+        assert EchoTask("item").run()
+
+        assert OrmQ.objects.count() == 2
+
+    def test_run__failed(self, mocker):
+        mocker.patch("django_q.tasks.AsyncTask.run", side_effect=RuntimeError("queue unavailable"))
+
+        with pytest.raises(RuntimeError):
+            DedupTask("item").run()
+
+        mocker.stopall()
+        assert DedupTask("item").run()
+
+    def test_run__completed(self):
+        task = DedupTask("item")
+        task.sync = True
+
+        assert task.run()
+        assert EchoTask.hooked == [["item"]]
+
+        # released once the task is completed
+        assert DedupTask("item").run()
+
+    def test_execute_hook__releases(self, mocker):
+        DedupTask("item").run()
+        completed = mocker.Mock(args=[DedupTask.path()], kwargs={"item_id": "item", "count": 1}, result=["item"])
+
+        def post_handler(task):
+            # the post handler can queue the task again
+            assert DedupTask("item").run()
+
+        mocker.patch.object(DedupTask, "post_handler", side_effect=post_handler)
+
+        execute_hook(completed)
+
+        assert OrmQ.objects.count() == 2
+
+    def test_run_many(self):
+        DedupTask("a").run()
+
+        tasks = DedupTask.run_many([{"item_id": "a"}, {"item_id": "b"}, {"item_id": "b"}, {"item_id": "c"}])
+
+        assert [task.kwargs["item_id"] for task in tasks] == ["b", "c"]
+        assert OrmQ.objects.count() == 3
+
+    def test_run_many__failed(self, mocker):
+        mocker.patch.object(OrmQ.objects.get_queryset().__class__, "bulk_create", side_effect=RuntimeError("queue down"))
+
+        with pytest.raises(RuntimeError):
+            DedupTask.run_many([{"item_id": "a"}])
+
+        mocker.stopall()
+        assert DedupTask("a").run()
+
+
+class StagesPipeline(Pipeline):
+    group = "test"
+    name = "stages"
+    stages = ("first", "second")
+
+    def __init__(self, item_id):
+        super().__init__(item_id=item_id)
+        self.calls = []
+
+    def first(self, results, item_id):
+        self.calls.append("first")
+        return f"first-{item_id}"
+
+    def second(self, results, item_id):
+        self.calls.append("second")
+        if item_id == "fails":
+            raise RuntimeError("second failed")
+        return f"{results['first']}-second"
+
+
+@pytest.fixture
+def pipeline() -> StagesPipeline:
+    return StagesPipeline("item")
+
+
+def test_pipeline(pipeline):
+    assert pipeline.group == "test"
+    assert pipeline.name == "stages"
+    assert pipeline.kwargs["item_id"] == "item"
+    assert pipeline.args == ("tests.web.core.test_tasks.StagesPipeline",)
+
+
+def test_handler(pipeline):
+    results = pipeline.handler(item_id="item")
+
+    assert results == {"first": "first-item", "second": "first-item-second"}
+    assert pipeline.calls == ["first", "second"]
+    # and the checkpoint is cleared
+    assert pipeline.load_checkpoint(item_id="item") == {}
+
+
+def test_handler__resumes():
+    pipeline = StagesPipeline("fails")
+
+    with pytest.raises(RuntimeError):
+        pipeline.handler(item_id="fails")
+
+    assert pipeline.load_checkpoint(item_id="fails") == {"first": "first-fails"}
+
+    pipeline.calls.clear()
+    with pytest.raises(RuntimeError):
+        pipeline.handler(item_id="fails")
+
+    # the first stage isn't run again
+    assert pipeline.calls == ["second"]
+
+
+def test_checkpoint_key(pipeline):
+    assert pipeline.checkpoint_key(item_id="item") == pipeline.checkpoint_key(item_id="item")
+    assert pipeline.checkpoint_key(item_id="item") != pipeline.checkpoint_key(item_id="other")
+    assert pipeline.checkpoint_key(item_id="item").startswith("pipeline:test:stages:")
+
+
+def test_save_checkpoint(pipeline):
+    pipeline.save_checkpoint({"first": "result"}, item_id="item")
+
+    assert pipeline.load_checkpoint(item_id="item") == {"first": "result"}
+    assert pipeline.load_checkpoint(item_id="other") == {}
+
+    pipeline.clear_checkpoint(item_id="item")
+
+    assert pipeline.load_checkpoint(item_id="item") == {}
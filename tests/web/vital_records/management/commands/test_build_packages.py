@@ -0,0 +1,34 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+import pytest
+
+from web.vital_records.tasks.package import PACKAGE_TYPES
+
+
+@pytest.fixture
+def mock_build_base_package(mocker):
+    return mocker.patch(
+        "web.vital_records.management.commands.build_packages.build_base_package",
+        side_effect=lambda request_type: f"package_{request_type}.pdf",
+    )
+
+
+def test_build_packages__all(mocker, mock_build_base_package):
+    call_command("build_packages")
+
+    mock_build_base_package.assert_has_calls([mocker.call(t) for t in PACKAGE_TYPES])
+    assert mock_build_base_package.call_count == len(PACKAGE_TYPES)
+
+
+def test_build_packages__type(mock_build_base_package):
+    call_command("build_packages", "death")
+
+    mock_build_base_package.assert_called_once_with("death")
+
+
+def test_build_packages__invalid_type(mock_build_base_package):
+    with pytest.raises(CommandError):
+        call_command("build_packages", "invalid")
+
+    mock_build_base_package.assert_not_called()
@@ -0,0 +1,24 @@
+from django.core.management import call_command
+
+import pytest
+
+
+@pytest.fixture
+def mock_Dispatcher(mocker):
+    return mocker.patch("web.vital_records.management.commands.dispatch_emails.Dispatcher")
+
+
+def test_dispatch_emails(mock_Dispatcher):
+    call_command("dispatch_emails", "--interval", "2.5")
+
+    mock_Dispatcher.return_value.run.assert_called_once_with(2.5)
+
+
+def test_dispatch_emails__once(capsys, mock_Dispatcher):
+    mock_Dispatcher.return_value.tick.return_value = (2, 1)
+
+    call_command("dispatch_emails", "--once")
+
+    mock_Dispatcher.return_value.tick.assert_called_once_with()
+    mock_Dispatcher.return_value.run.assert_not_called()
+    assert "Submitted 2 emails, 1 delivered" in capsys.readouterr().out
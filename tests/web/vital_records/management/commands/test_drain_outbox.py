@@ -0,0 +1,24 @@
+from django.core.management import call_command
+
+import pytest
+
+
+@pytest.fixture
+def mock_OutboxDispatcher(mocker):
+    return mocker.patch("web.vital_records.management.commands.drain_outbox.OutboxDispatcher")
+
+
+def test_drain_outbox(mock_OutboxDispatcher):
+    call_command("drain_outbox", "--interval", "2.5")
+
+    mock_OutboxDispatcher.return_value.run.assert_called_once_with(2.5)
+
+
+def test_drain_outbox__once(capsys, mock_OutboxDispatcher):
+    mock_OutboxDispatcher.return_value.tick.return_value = 3
+
+    call_command("drain_outbox", "--once")
+
+    mock_OutboxDispatcher.return_value.tick.assert_called_once_with()
+    mock_OutboxDispatcher.return_value.run.assert_not_called()
+    assert "Queued 3 submitted requests" in capsys.readouterr().out
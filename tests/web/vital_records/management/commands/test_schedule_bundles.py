@@ -0,0 +1,57 @@
+from django.core.management import call_command
+from django_q.models import Schedule
+
+import pytest
+
+from web.vital_records.models import VitalRecordsRequest
+from web.vital_records.tasks.bundle import BUNDLE_SCHEDULE
+
+
+@pytest.fixture
+def mock_run_bundle_task(mocker):
+    return mocker.patch("web.vital_records.management.commands.schedule_bundles.run_bundle_task")
+
+
+@pytest.mark.django_db
+def test_schedule_bundles(settings):
+    settings.VITAL_RECORDS_BUNDLE_MINUTES = 1440
+
+    call_command("schedule_bundles")
+
+    schedule = Schedule.objects.get(name=BUNDLE_SCHEDULE)
+    assert schedule.func == "web.vital_records.tasks.bundle.run_bundle_task"
+    assert schedule.schedule_type == Schedule.MINUTES
+    assert schedule.minutes == 1440
+
+
+@pytest.mark.django_db
+def test_schedule_bundles__updated(settings):
+    settings.VITAL_RECORDS_BUNDLE_MINUTES = 1440
+    call_command("schedule_bundles")
+    settings.VITAL_RECORDS_BUNDLE_MINUTES = 60
+
+    call_command("schedule_bundles")
+
+    assert Schedule.objects.get(name=BUNDLE_SCHEDULE).minutes == 60
+
+
+@pytest.mark.django_db
+def test_schedule_bundles__off(settings, mock_run_bundle_task):
+    settings.VITAL_RECORDS_BUNDLE_MINUTES = 1440
+    call_command("schedule_bundles")
+    settings.VITAL_RECORDS_BUNDLE_MINUTES = 0
+
+    call_command("schedule_bundles")
+
+    assert not Schedule.objects.filter(name=BUNDLE_SCHEDULE).exists()
+    mock_run_bundle_task.assert_not_called()
+
+
+@pytest.mark.django_db
+def test_schedule_bundles__off_requests_waiting(settings, mock_run_bundle_task):
+    settings.VITAL_RECORDS_BUNDLE_MINUTES = 0
+    VitalRecordsRequest.objects.create(status="sent")
+
+    call_command("schedule_bundles")
+
+    mock_run_bundle_task.assert_called_once_with()
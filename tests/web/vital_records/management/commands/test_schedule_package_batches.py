@@ -0,0 +1,45 @@
+from django.core.management import call_command
+from django_q.models import Schedule
+
+import pytest
+
+from web.vital_records.tasks.package import BATCH_SCHEDULE
+
+
+@pytest.mark.django_db
+def test_schedule_package_batches(settings):
+    settings.VITAL_RECORDS_PACKAGE_BATCH_SIZE = 10
+    settings.VITAL_RECORDS_PACKAGE_BATCH_MINUTES = 5
+
+    call_command("schedule_package_batches")
+
+    schedule = Schedule.objects.get(name=BATCH_SCHEDULE)
+    assert schedule.func == "web.vital_records.tasks.package.run_batch_package_task"
+    assert schedule.schedule_type == Schedule.MINUTES
+    assert schedule.minutes == 5
+
+
+@pytest.mark.django_db
+def test_schedule_package_batches__updated(settings):
+    settings.VITAL_RECORDS_PACKAGE_BATCH_SIZE = 10
+    settings.VITAL_RECORDS_PACKAGE_BATCH_MINUTES = 5
+    call_command("schedule_package_batches")
+    settings.VITAL_RECORDS_PACKAGE_BATCH_MINUTES = 15
+
+    call_command("schedule_package_batches")
+
+    assert Schedule.objects.get(name=BATCH_SCHEDULE).minutes == 15
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("batch_size,minutes", [(0, 5), (10, 0)])
+def test_schedule_package_batches__off(settings, batch_size, minutes):
+    settings.VITAL_RECORDS_PACKAGE_BATCH_SIZE = 10
+    settings.VITAL_RECORDS_PACKAGE_BATCH_MINUTES = 5
+    call_command("schedule_package_batches")
+    settings.VITAL_RECORDS_PACKAGE_BATCH_SIZE = batch_size
+    settings.VITAL_RECORDS_PACKAGE_BATCH_MINUTES = minutes
+
+    call_command("schedule_package_batches")
+
+    assert not Schedule.objects.filter(name=BATCH_SCHEDULE).exists()
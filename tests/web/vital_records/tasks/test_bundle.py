@@ -0,0 +1,239 @@
+import csv
+import datetime
+from io import BytesIO, StringIO
+import os
+import zipfile
+
+from django.utils import timezone
+import pytest
+
+from web.vital_records.models import VitalRecordsRequest
+from web.vital_records.tasks.bundle import MANIFEST_FIELDS, MANIFEST_FILENAME, BundleTask, build_bundle, run_bundle_task
+from web.vital_records.tasks.store import get_package_store
+
+
+@pytest.fixture
+def store_dir(settings, tmp_path):
+    settings.VITAL_RECORDS_PACKAGE_STORE_DIR = str(tmp_path / "store")
+    return settings.VITAL_RECORDS_PACKAGE_STORE_DIR
+
+
+@pytest.fixture
+def sent_request(db, store_dir):
+    def _sent_request(request_type: str, package: bytes = b"%PDF"):
+        now = timezone.now()
+        request = VitalRecordsRequest.objects.create(
+            type=request_type,
+            status="sent",
+            fire="palisades",
+            first_name="Jane",
+            last_name="Doe",
+            date_of_event=datetime.date(2025, 1, 7),
+            submitted_at=now,
+            sent_at=now,
+        )
+        request.package_hash = f"package-{request.id}"
+        request.save()
+        get_package_store().put(request.package_hash, package)
+        return request
+
+    return _sent_request
+
+
+def test_run_bundle_task(mocker):
+    mock_task = mocker.MagicMock()
+    mock_BundleTask = mocker.patch("web.vital_records.tasks.bundle.BundleTask", return_value=mock_task)
+
+    result = run_bundle_task()
+
+    mock_BundleTask.assert_called_once()
+    mock_task.run.assert_called_once()
+    assert result == mock_task
+
+
+def test_manifest_fields():
+    assert MANIFEST_FIELDS[:2] == ("package", "package_id")
+    assert "RegFirstName" in MANIFEST_FIELDS
+    assert "Spouse1FirstName" in MANIFEST_FIELDS
+    assert len(MANIFEST_FIELDS) == len(set(MANIFEST_FIELDS))
+
+
+def test_build_bundle(sent_request):
+    birth = sent_request("birth", b"%PDF birth")
+    marriage = sent_request("marriage", b"%PDF marriage")
+
+    data, bundled = build_bundle([birth, marriage])
+
+    assert bundled == [birth, marriage]
+
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        names = archive.namelist()
+        assert len(names) == 3
+        assert names[-1] == MANIFEST_FILENAME
+        assert archive.read(names[0]) == b"%PDF birth"
+        assert archive.read(names[1]) == b"%PDF marriage"
+        manifest = list(csv.DictReader(StringIO(archive.read(MANIFEST_FILENAME).decode())))
+
+    assert [row["package"] for row in manifest] == names[:2]
+    assert manifest[0]["EventType"] == "Birth"
+    assert manifest[0]["RegFirstName"] == "Jane"
+    assert manifest[0]["package_id"] == str(birth.id)
+    assert manifest[1]["package_id"] == str(marriage.id)
+    assert manifest[1]["EventType"] == "Marriage"
+    assert manifest[1]["RegFirstName"] == ""
+
+
+def test_build_bundle__max_bytes(mocker, sent_request):
+    mocker.patch("web.vital_records.tasks.bundle.BUNDLE_OVERHEAD", 0)
+    requests = [sent_request("birth", b"%PDF" + b"0" * 1000) for _ in range(3)]
+
+    data, bundled = build_bundle(requests, max_bytes=2500)
+
+    # the third package would take the archive over, so it's left for the next bundle
+    assert bundled == requests[:2]
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        assert len(archive.namelist()) == 3
+    assert all(request.bundle_error == "" for request in requests)
+
+
+def test_build_bundle__too_large(mocker, sent_request):
+    mocker.patch("web.vital_records.tasks.bundle.BUNDLE_OVERHEAD", 0)
+    large = sent_request("birth", b"%PDF" + b"0" * 3000)
+    small = sent_request("birth", b"%PDF")
+
+    _, bundled = build_bundle([large, small], max_bytes=2500)
+
+    assert bundled == [small]
+    assert large.bundle_error == "Package is too large to bundle: 3004 bytes"
+
+
+def test_build_bundle__unreadable(sent_request):
+    missing = sent_request("birth")
+    os.remove(get_package_store().path(missing.package_hash))
+    readable = sent_request("birth")
+
+    data, bundled = build_bundle([missing, readable])
+
+    assert bundled == [readable]
+    assert missing.bundle_error.startswith("Couldn't read package:")
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        manifest = list(csv.DictReader(StringIO(archive.read(MANIFEST_FILENAME).decode())))
+    assert [row["package_id"] for row in manifest] == [str(readable.id)]
+
+
+class TestBundleTask:
+    @pytest.fixture
+    def task(self) -> BundleTask:
+        return BundleTask(bundle_size=2)
+
+    def test_task(self, task):
+        assert task.group == "vital-records"
+        assert task.name == "bundle"
+        assert task.queue == "maintenance"
+        assert task.kwargs["bundle_size"] == 2
+        assert task.started is False
+
+    def test_task__default_bundle_size(self, settings):
+        settings.VITAL_RECORDS_BUNDLE_SIZE = 50
+
+        assert BundleTask().kwargs["bundle_size"] == 50
+
+    @pytest.fixture
+    def mock_EmailMessage(self, mocker):
+        mock = mocker.patch("web.vital_records.tasks.bundle.EmailMessage")
+        mock.return_value.send.return_value = 1
+        return mock
+
+    def test_send_bundle(self, mocker, settings, mock_EmailMessage, sent_request, task):
+        settings.VITAL_RECORDS_EMAIL_TO = "office@example.com"
+        requests = [sent_request("birth"), sent_request("death")]
+
+        result = task.send_bundle(requests, b"bundle")
+
+        assert result == 1
+        mock_EmailMessage.assert_called_once_with(
+            subject="Completed: 2 Vital Record Requests", body=mocker.ANY, to=["office@example.com"]
+        )
+        mock_email = mock_EmailMessage.return_value
+        ((filename, content, mimetype),) = [c.args for c in mock_email.attach.call_args_list]
+        assert filename.startswith("vital-records-") and filename.endswith(".zip")
+        assert mimetype == "application/zip"
+        assert content == b"bundle"
+        mock_email.send.assert_called_once()
+
+    def test_handler(self, mocker, sent_request, task):
+        requests = [sent_request("birth") for _ in range(3)]
+        VitalRecordsRequest.objects.create(status="packaged")
+        mock_send_bundle = mocker.patch.object(task, "send_bundle", return_value=1)
+
+        result = task.handler(bundle_size=2)
+
+        assert result == 3
+        # bundles of 2, then 1, oldest first
+        assert [len(c.args[0]) for c in mock_send_bundle.call_args_list] == [2, 1]
+        assert mock_send_bundle.call_args_list[0].args[0] == requests[:2]
+        assert VitalRecordsRequest.objects.filter(pk__in=[r.id for r in requests], status="finished").count() == 3
+        assert VitalRecordsRequest.objects.filter(status="packaged").count() == 1
+
+    def test_handler__claimed(self, mocker, sent_request, task):
+        request = sent_request("birth")
+
+        def send_bundle(requests, bundle):
+            # claimed and committed while the bundle is sent, so another bundle task skips the requests
+            assert VitalRecordsRequest.claim_sent(10) == []
+            assert VitalRecordsRequest.objects.get(pk=request.id).status == "sent"
+            return 1
+
+        mocker.patch.object(task, "send_bundle", side_effect=send_bundle)
+
+        assert task.handler(bundle_size=2) == 1
+
+    def test_handler__max_bytes(self, mocker, settings, sent_request, task):
+        mocker.patch("web.vital_records.tasks.bundle.BUNDLE_OVERHEAD", 0)
+        settings.VITAL_RECORDS_BUNDLE_MAX_BYTES = 1500
+        requests = [sent_request("birth", b"%PDF" + b"0" * 1000) for _ in range(2)]
+        mock_send_bundle = mocker.patch.object(task, "send_bundle", return_value=1)
+
+        result = task.handler(bundle_size=2)
+
+        assert result == 2
+        assert [c.args[0] for c in mock_send_bundle.call_args_list] == [requests[:1], requests[1:]]
+
+    def test_handler__unreadable(self, mocker, sent_request, task):
+        missing = [sent_request("birth") for _ in range(2)]
+        for request in missing:
+            os.remove(get_package_store().path(request.package_hash))
+        readable = sent_request("birth")
+        mock_send_bundle = mocker.patch.object(task, "send_bundle", return_value=1)
+
+        result = task.handler(bundle_size=2)
+
+        assert result == 1
+        # the first claim is all unreadable, and the next one bundles the rest
+        assert [c.args[0] for c in mock_send_bundle.call_args_list] == [[readable]]
+        for request in missing:
+            # finished, rather than left sent for good
+            request.refresh_from_db()
+            assert request.status == "finished"
+            assert request.bundle_error.startswith("Couldn't read package:")
+        readable.refresh_from_db()
+        assert readable.status == "finished"
+        assert readable.bundle_error == ""
+
+    def test_handler__empty(self, db, mocker, task):
+        mock_send_bundle = mocker.patch.object(task, "send_bundle")
+
+        assert task.handler(bundle_size=2) == 0
+        mock_send_bundle.assert_not_called()
+
+    def test_handler__send_failed(self, mocker, sent_request, task):
+        request = sent_request("birth")
+        mocker.patch.object(task, "send_bundle", side_effect=ConnectionError())
+
+        with pytest.raises(ConnectionError):
+            task.handler(bundle_size=2)
+
+        request.refresh_from_db()
+        assert request.status == "sent"
+        # bundled again once the claim runs out
+        assert request.bundle_claimed_until > timezone.now()
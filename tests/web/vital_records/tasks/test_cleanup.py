@@ -1,5 +1,7 @@
 import datetime
+import os
 import pytest
+from web.vital_records.models import OutboundEmail, VitalRecordsRequest
 from web.vital_records.tasks.cleanup import CleanupTask, run_cleanup_task
 
 
@@ -19,6 +21,11 @@ def mock_VitalRecordsRequestMetadata(mocker):
     return mocker.patch("web.vital_records.tasks.cleanup.VitalRecordsRequestMetadata")
 
 
+@pytest.fixture
+def mock_OutboundEmail(mocker):
+    return mocker.patch("web.vital_records.tasks.cleanup.OutboundEmail")
+
+
 def test_run_cleanup_task(mocker):
     mock_task = mocker.MagicMock()
     mock_CleanupTask = mocker.patch("web.vital_records.tasks.cleanup.CleanupTask", return_value=mock_task)
@@ -54,6 +61,7 @@ class TestCleanupScheduledTask:
     def test_task(self, task):
         assert task.group == "vital-records"
         assert task.name == "cleanup"
+        assert task.queue == "maintenance"
         assert task.started is False
 
     def test_clean_file__file_doesnt_exist(self, mock_VitalRecordsRequest, mock_Path, task: CleanupTask):
@@ -85,20 +93,63 @@ class TestCleanupScheduledTask:
         assert result is True
         mock_path.unlink.assert_called_once()
 
-    def test_clean_record__ValueError(self, mock_VitalRecordsRequest, task: CleanupTask):
+    def test_clean_file__package_store(self, settings, mocker, mock_Path, task: CleanupTask):
+        settings.VITAL_RECORDS_PACKAGE_STORE_DIR = "/store"
+        mock_Path.return_value.exists.return_value = False
+
+        task.clean_file(mocker.Mock(package_hash="abc123"))
+
+        mock_Path.assert_called_once_with(os.path.join("/store", "abc123.pdf"))
+
+    def test_clean_file__discard(self, mocker, mock_Path, task: CleanupTask):
+        mock_store = mocker.patch("web.vital_records.tasks.cleanup.get_package_store").return_value
+        mock_Path.return_value.exists.return_value = False
+
+        task.clean_file(mocker.Mock(package_hash="abc123"))
+
+        mock_store.discard.assert_called_once_with("abc123")
+
+    def test_clean_file__discard_failed(self, mocker, mock_Path, task: CleanupTask):
+        mock_store = mocker.patch("web.vital_records.tasks.cleanup.get_package_store").return_value
+        mock_Path.return_value.exists.return_value = True
+        mock_Path.return_value.is_file.return_value = False
+
+        result = task.clean_file(mocker.Mock(package_hash="abc123"))
+
+        assert result is False
+        mock_store.discard.assert_not_called()
+
+    def test_clean_file__no_package_hash(self, mocker, mock_Path, task: CleanupTask):
+        request = mocker.Mock(package_hash="")
+        mock_Path.return_value.exists.return_value = False
+        mocker.patch("web.vital_records.tasks.cleanup.get_package_filename", return_value="/storage/request.pdf")
+
+        task.clean_file(request)
+
+        mock_Path.assert_called_once_with("/storage/request.pdf")
+
+    def test_clean_record__ValueError(self, mock_VitalRecordsRequest, mock_OutboundEmail, task: CleanupTask):
         mock_VitalRecordsRequest.delete.side_effect = ValueError()
         result = task.clean_record(mock_VitalRecordsRequest)
 
         mock_VitalRecordsRequest.delete.assert_called_once()
+        mock_OutboundEmail.objects.filter.assert_not_called()
         assert result is False
 
-    def test_clean_record(self, mock_VitalRecordsRequest, task: CleanupTask):
-        mock_VitalRecordsRequest.delete.return_value = (1, 1)
+    def test_clean_record(self, db, task: CleanupTask):
+        request = VitalRecordsRequest.objects.create(status="finished")
+        other = VitalRecordsRequest.objects.create(status="packaged")
+        for request_id in (request.id, request.id, other.id):
+            OutboundEmail.objects.create(request_id=request_id, recipient="requestor", to_address="jane@example.com")
+        request_id = request.id
 
-        result = task.clean_record(mock_VitalRecordsRequest)
+        result = task.clean_record(request)
 
-        mock_VitalRecordsRequest.delete.assert_called_once()
         assert result is True
+        assert not VitalRecordsRequest.objects.filter(pk=request_id).exists()
+        # the request's emails are gone with it, and no others
+        assert not OutboundEmail.objects.filter(request_id=request_id).exists()
+        assert OutboundEmail.objects.filter(request_id=other.id).count() == 1
 
     def test_clean_request__record_fails(
         self, mock_VitalRecordsRequest, mock_clean_record, mock_clean_file, task: CleanupTask
@@ -173,6 +224,17 @@ class TestCleanupScheduledTask:
         mock_create_metadata.assert_not_called()
         assert result is True
 
+    def test_handler__purge(self, mocker, mock_VitalRecordsRequest, task: CleanupTask):
+        mock_store = mocker.patch("web.vital_records.tasks.cleanup.get_package_store").return_value
+        mock_store.purge.return_value = 2
+        mock_batch = mocker.MagicMock()
+        mock_batch.count.return_value = 0
+        mock_VitalRecordsRequest.get_finished.return_value = mock_batch
+
+        task.handler()
+
+        mock_store.purge.assert_called_once()
+
     def test_handler__batch_fail(
         self,
         mocker,
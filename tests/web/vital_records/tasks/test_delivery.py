@@ -0,0 +1,527 @@
+from datetime import timedelta
+import os
+import random
+import threading
+
+import pytest
+from django.utils import timezone
+
+from web.core.mail import EmailBackend, FileAttachment
+from web.vital_records.models import OutboundEmail, VitalRecordsRequest
+from web.vital_records.tasks.delivery import (
+    FAILED,
+    POLL_INTERVAL,
+    RUNNING,
+    SUCCEEDED,
+    AzureDeliveryClient,
+    CircuitBreaker,
+    DeliveryError,
+    Dispatcher,
+    LocalDeliveryClient,
+    backoff,
+    build_message,
+    get_delivery_client,
+)
+from web.vital_records.tasks.store import get_package_store
+
+
+@pytest.fixture
+def clock():
+    class Clock:
+        now = 1000.0
+
+        def __call__(self):
+            return self.now
+
+    return Clock()
+
+
+@pytest.fixture
+def breaker(clock) -> CircuitBreaker:
+    return CircuitBreaker(threshold=2, reset_seconds=60, clock=clock)
+
+
+@pytest.fixture
+def mock_client(mocker):
+    client = mocker.Mock(spec=["submit", "status"])
+    client.submit.return_value = "operation-1"
+    client.status.return_value = SUCCEEDED
+    return client
+
+
+@pytest.fixture
+def dispatcher(mock_client, breaker) -> Dispatcher:
+    return Dispatcher(client=mock_client, breaker=breaker)
+
+
+@pytest.fixture
+def packaged_request(db) -> VitalRecordsRequest:
+    return VitalRecordsRequest.objects.create(type="birth", status="packaged", submitted_at=timezone.now())
+
+
+@pytest.fixture
+def outbound_email(packaged_request) -> OutboundEmail:
+    return OutboundEmail.objects.create(
+        request_id=packaged_request.id,
+        recipient="requestor",
+        to_address="jane@example.com",
+        subject="Completed: Birth Record Request",
+        text_content="text body",
+        html_content="<p>html body</p>",
+    )
+
+
+@pytest.fixture
+def submitted_email(outbound_email) -> OutboundEmail:
+    OutboundEmail.objects.filter(pk=outbound_email.pk).update(status="submitted", operation_id="operation-1", attempts=1)
+    return _refresh(outbound_email)
+
+
+def _refresh(email: OutboundEmail) -> OutboundEmail:
+    return OutboundEmail.objects.get(pk=email.pk)
+
+
+class TestCircuitBreaker:
+    def test_closed(self, breaker):
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow()
+
+    def test_record_error__below_threshold(self, breaker):
+        breaker.record_error()
+
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_record_error__opens(self, breaker):
+        breaker.record_error()
+        breaker.record_error()
+
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+
+    def test_record_success__resets_errors(self, breaker):
+        breaker.record_error()
+        breaker.record_success()
+        breaker.record_error()
+
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_half_open(self, breaker, clock):
+        breaker.record_error()
+        breaker.record_error()
+
+        clock.now += 60
+
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow()
+
+    def test_half_open__error_reopens(self, breaker, clock):
+        breaker.record_error()
+        breaker.record_error()
+        clock.now += 60
+
+        breaker.record_error()
+
+        assert breaker.state == CircuitBreaker.OPEN
+
+    def test_half_open__success_closes(self, breaker, clock):
+        breaker.record_error()
+        breaker.record_error()
+        clock.now += 60
+
+        breaker.record_success()
+
+        assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.parametrize("attempts, seconds", [(1, 30), (2, 60), (3, 120), (10, 60 * 60)])
+def test_backoff(settings, mocker, attempts, seconds):
+    settings.VITAL_RECORDS_EMAIL_BACKOFF_SECONDS = 30
+    mock_uniform = mocker.patch("web.vital_records.tasks.delivery.random.uniform", return_value=1)
+
+    assert backoff(attempts) == timedelta(seconds=seconds)
+    mock_uniform.assert_called_once_with(0.5, 1)
+
+
+def test_backoff__jitter(settings):
+    settings.VITAL_RECORDS_EMAIL_BACKOFF_SECONDS = 30
+
+    assert timedelta(seconds=15) <= backoff(1) <= timedelta(seconds=30)
+
+
+def test_get_delivery_client__local(settings):
+    settings.AZURE_COMMUNICATION_CONNECTION_STRING = None
+    settings.VITAL_RECORDS_EMAIL_STUB_LATENCY = 0.5
+    settings.VITAL_RECORDS_EMAIL_STUB_ERROR_RATE = 0.1
+
+    client = get_delivery_client()
+
+    assert isinstance(client, LocalDeliveryClient)
+    assert client.latency == 0.5
+    assert client.error_rate == 0.1
+
+
+def test_get_delivery_client__azure(settings, mocker):
+    settings.AZURE_COMMUNICATION_CONNECTION_STRING = "endpoint=https://example.com/;accesskey=a2V5"
+    mocker.patch("django_azure_communication_email.backend.EmailClient")
+
+    assert isinstance(get_delivery_client(), AzureDeliveryClient)
+
+
+class TestAzureDeliveryClient:
+    @pytest.fixture
+    def mock_EmailClient(self, mocker):
+        return mocker.patch("django_azure_communication_email.backend.EmailClient")
+
+    @pytest.fixture
+    def client(self, mock_EmailClient) -> AzureDeliveryClient:
+        return AzureDeliveryClient(EmailBackend(connection_string="endpoint=https://example.com/;accesskey=a2V5"))
+
+    def test_submit(self, mocker, client, mock_EmailClient):
+        email = OutboundEmail(to_address="jane@example.com", subject="Subject", text_content="text", html_content="html")
+
+        with build_message(email) as message:
+            operation_id = client.submit(message)
+
+        email_client = mock_EmailClient.from_connection_string.return_value
+        email_client.begin_send.assert_called_once_with(mocker.ANY, operation_id=operation_id, polling=False)
+        content = email_client.begin_send.call_args.args[0]
+        assert content["content"]["subject"] == "Subject"
+        assert content["recipients"]["to"][0]["address"] == "jane@example.com"
+
+    @pytest.mark.parametrize(
+        "status, expected",
+        [("NotStarted", RUNNING), ("Running", RUNNING), ("Succeeded", SUCCEEDED), ("Failed", FAILED), ("Canceled", FAILED)],
+    )
+    def test_status(self, client, mock_EmailClient, status, expected):
+        response = mock_EmailClient.from_connection_string.return_value.send_request.return_value
+        response.status_code = 200
+        response.json.return_value = {"id": "operation-1", "status": status}
+
+        assert client.status("operation-1") == expected
+
+    def test_status__error(self, client, mock_EmailClient):
+        response = mock_EmailClient.from_connection_string.return_value.send_request.return_value
+        response.status_code = 503
+
+        with pytest.raises(DeliveryError):
+            client.status("operation-1")
+
+
+class TestLocalDeliveryClient:
+    @pytest.fixture
+    def mock_get_connection(self, mocker):
+        return mocker.patch("web.vital_records.tasks.delivery.get_connection")
+
+    def test_submit(self, mocker, mock_get_connection):
+        client = LocalDeliveryClient()
+        message = mocker.Mock()
+
+        operation_id = client.submit(message)
+
+        mock_get_connection.return_value.__enter__.return_value.send_messages.assert_called_once_with([message])
+        assert client.status(operation_id) == SUCCEEDED
+
+    def test_latency(self, mocker, mock_get_connection):
+        mock_sleep = mocker.patch("web.vital_records.tasks.delivery.time.sleep")
+        client = LocalDeliveryClient(latency=0.25)
+
+        client.status(client.submit(mocker.Mock()))
+
+        assert mock_sleep.call_args_list == [mocker.call(0.25), mocker.call(0.25)]
+
+    def test_error_rate(self, mocker, mock_get_connection):
+        client = LocalDeliveryClient(error_rate=1)
+
+        with pytest.raises(DeliveryError):
+            client.submit(mocker.Mock())
+        with pytest.raises(DeliveryError):
+            client.status("operation-1")
+        mock_get_connection.assert_not_called()
+
+    def test_error_rate__some(self, mocker, mock_get_connection):
+        client = LocalDeliveryClient(error_rate=0.5, rng=random.Random(0))
+
+        errors = 0
+        for _ in range(100):
+            try:
+                client.submit(mocker.Mock())
+            except DeliveryError:
+                errors += 1
+
+        assert 30 < errors < 70
+
+    def test_failure_rate(self, mocker, mock_get_connection):
+        client = LocalDeliveryClient(failure_rate=1)
+
+        operation_id = client.submit(mocker.Mock())
+
+        mock_get_connection.assert_not_called()
+        assert client.status(operation_id) == FAILED
+
+
+def test_build_message():
+    email = OutboundEmail(to_address="jane@example.com", subject="Subject", text_content="text", html_content="<p>html</p>")
+
+    with build_message(email) as message:
+        pass
+
+    assert message.subject == "Subject"
+    assert message.to == ["jane@example.com"]
+    assert message.body == "text"
+    assert message.alternatives[0].content == "<p>html</p>"
+    assert message.attachments == []
+
+
+def test_build_message__attachment(settings, tmp_path):
+    settings.VITAL_RECORDS_PACKAGE_STORE_DIR = str(tmp_path)
+    (tmp_path / "abc123.pdf").write_bytes(b"%PDF")
+    email = OutboundEmail(
+        to_address="office@example.com",
+        subject="Subject",
+        text_content="text",
+        html_content="html",
+        attachment_package="abc123",
+        attachment_filename="request.pdf",
+    )
+
+    with build_message(email) as message:
+        pass
+
+    (attachment,) = message.attachments
+    assert isinstance(attachment, FileAttachment)
+    assert attachment.path == str(tmp_path / "abc123.pdf")
+    assert attachment.get_filename() == "request.pdf"
+
+
+def test_build_message__shared_attachment(db, settings):
+    settings.VITAL_RECORDS_PACKAGE_STORE_SHARED = True
+    get_package_store().put("abc123", b"%PDF")
+    email = OutboundEmail(
+        to_address="office@example.com",
+        subject="Subject",
+        text_content="text",
+        html_content="html",
+        attachment_package="abc123",
+        attachment_filename="request.pdf",
+    )
+
+    with build_message(email) as message:
+        (attachment,) = message.attachments
+        assert attachment.get_payload(decode=True) == b"%PDF"
+
+    # the temporary copy is deleted once the message is submitted
+    assert not os.path.exists(attachment.path)
+
+
+class TestDispatcher:
+    def test_submit_due(self, dispatcher, mock_client, outbound_email):
+        assert dispatcher.submit_due() == 1
+
+        mock_client.submit.assert_called_once()
+        email = _refresh(outbound_email)
+        assert email.status == "submitted"
+        assert email.operation_id == "operation-1"
+        assert email.attempts == 1
+        assert email.next_attempt_at > timezone.now()
+
+    def test_submit_due__claimed(self, dispatcher, mock_client, outbound_email):
+        def submit(message):
+            # claimed while the provider is called, so another dispatcher skips it
+            assert _refresh(outbound_email).status == "submitting"
+            assert OutboundEmail.claim_due(timedelta(minutes=10)) is None
+            return "operation-1"
+
+        mock_client.submit.side_effect = submit
+
+        assert dispatcher.submit_due() == 1
+
+        assert _refresh(outbound_email).status == "submitted"
+
+    def test_submit_due__batch_size(self, mock_client, breaker, outbound_email, packaged_request):
+        OutboundEmail.objects.create(request_id=packaged_request.id, recipient="office", to_address="office@example.com")
+        dispatcher = Dispatcher(client=mock_client, breaker=breaker, batch_size=1)
+
+        assert dispatcher.submit_due() == 1
+
+        assert OutboundEmail.objects.filter(status="queued").count() == 1
+
+    def test_submit_due__not_due(self, dispatcher, mock_client, outbound_email):
+        OutboundEmail.objects.filter(pk=outbound_email.pk).update(next_attempt_at=timezone.now() + timedelta(minutes=1))
+
+        assert dispatcher.submit_due() == 0
+
+        mock_client.submit.assert_not_called()
+
+    def test_submit_due__error(self, mocker, dispatcher, mock_client, breaker, outbound_email):
+        mocker.patch("web.vital_records.tasks.delivery.backoff", return_value=timedelta(seconds=30))
+        mock_client.submit.side_effect = DeliveryError("throttled")
+
+        assert dispatcher.submit_due() == 0
+
+        email = _refresh(outbound_email)
+        assert email.status == "queued"
+        assert email.attempts == 1
+        assert email.last_error == "throttled"
+        assert email.next_attempt_at > timezone.now() + timedelta(seconds=25)
+        assert breaker.errors == 1
+
+    def test_submit_due__retries_used_up(self, settings, dispatcher, mock_client, outbound_email):
+        settings.VITAL_RECORDS_EMAIL_RETRIES = 1
+        OutboundEmail.objects.filter(pk=outbound_email.pk).update(attempts=1)
+        mock_client.submit.side_effect = DeliveryError("throttled")
+
+        dispatcher.submit_due()
+
+        email = _refresh(outbound_email)
+        assert email.status == "failed"
+        assert email.attempts == 2
+        assert email.last_error == "throttled"
+
+    def test_submit_due__missing_package(self, settings, tmp_path, dispatcher, mock_client, breaker, outbound_email):
+        settings.VITAL_RECORDS_PACKAGE_STORE_DIR = str(tmp_path)
+        OutboundEmail.objects.filter(pk=outbound_email.pk).update(attachment_package="missing")
+
+        dispatcher.submit_due()
+
+        mock_client.submit.assert_not_called()
+        assert _refresh(outbound_email).status == "queued"
+        # not the provider's fault
+        assert breaker.errors == 0
+
+    def test_submit_due__breaker_opens(self, dispatcher, mock_client, breaker, outbound_email, packaged_request):
+        for _ in range(2):
+            OutboundEmail.objects.create(request_id=packaged_request.id, recipient="office", to_address="office@example.com")
+        mock_client.submit.side_effect = DeliveryError("unavailable")
+
+        dispatcher.submit_due()
+
+        # the breaker opened after 2 errors, and the third email wasn't tried
+        assert mock_client.submit.call_count == 2
+        assert breaker.state == CircuitBreaker.OPEN
+        assert OutboundEmail.objects.filter(attempts=0).count() == 1
+
+    def test_poll_submitted(self, dispatcher, mock_client, submitted_email):
+        delivered = dispatcher.poll_submitted()
+
+        mock_client.status.assert_called_once_with("operation-1")
+        assert delivered == [submitted_email.request_id]
+        email = _refresh(submitted_email)
+        assert email.status == "delivered"
+        assert email.delivered_at is not None
+
+    def test_poll_submitted__claimed(self, dispatcher, mock_client, submitted_email):
+        def status(operation_id):
+            assert OutboundEmail.claim_submitted(timedelta(minutes=10)) is None
+            return RUNNING
+
+        mock_client.status.side_effect = status
+
+        assert dispatcher.poll_submitted() == []
+
+        mock_client.status.assert_called_once()
+
+    def test_poll_submitted__running(self, dispatcher, mock_client, submitted_email):
+        mock_client.status.return_value = RUNNING
+
+        assert dispatcher.poll_submitted() == []
+
+        email = _refresh(submitted_email)
+        assert email.status == "submitted"
+        assert email.next_attempt_at > timezone.now() + POLL_INTERVAL - timedelta(seconds=1)
+
+    def test_poll_submitted__failed(self, dispatcher, mock_client, breaker, submitted_email):
+        mock_client.status.return_value = FAILED
+
+        assert dispatcher.poll_submitted() == []
+
+        email = _refresh(submitted_email)
+        assert email.status == "queued"
+        assert email.last_error == "Delivery failed for operation: operation-1"
+        # a failed delivery isn't a provider error
+        assert breaker.errors == 0
+
+    def test_poll_submitted__error(self, dispatcher, mock_client, breaker, submitted_email):
+        mock_client.status.side_effect = DeliveryError("unavailable")
+
+        assert dispatcher.poll_submitted() == []
+
+        assert _refresh(submitted_email).status == "submitted"
+        assert breaker.errors == 1
+
+    def test_complete_requests(self, dispatcher, outbound_email, packaged_request):
+        OutboundEmail.objects.filter(pk=outbound_email.pk).update(status="delivered")
+
+        assert dispatcher.complete_requests([packaged_request.id]) == 1
+
+        packaged_request.refresh_from_db()
+        assert packaged_request.status == "finished"
+        assert packaged_request.sent_at is not None
+
+    def test_complete_requests__bundled(self, settings, dispatcher, outbound_email, packaged_request):
+        settings.VITAL_RECORDS_BUNDLE_MINUTES = 60
+        OutboundEmail.objects.filter(pk=outbound_email.pk).update(status="delivered")
+
+        dispatcher.complete_requests([packaged_request.id])
+
+        packaged_request.refresh_from_db()
+        assert packaged_request.status == "sent"
+
+    def test_complete_requests__not_all_delivered(self, dispatcher, outbound_email, packaged_request):
+        OutboundEmail.objects.filter(pk=outbound_email.pk).update(status="delivered")
+        OutboundEmail.objects.create(request_id=packaged_request.id, recipient="office", to_address="office@example.com")
+
+        assert dispatcher.complete_requests([packaged_request.id]) == 0
+
+        packaged_request.refresh_from_db()
+        assert packaged_request.status == "packaged"
+
+    def test_tick(self, dispatcher, outbound_email, packaged_request):
+        # submitted, then due to be polled on the next tick
+        assert dispatcher.tick() == (1, 0)
+        OutboundEmail.objects.filter(pk=outbound_email.pk).update(next_attempt_at=timezone.now())
+        assert dispatcher.tick() == (0, 1)
+
+        packaged_request.refresh_from_db()
+        assert packaged_request.status == "finished"
+
+    def test_tick__breaker_open(self, dispatcher, mock_client, breaker, outbound_email):
+        breaker.record_error()
+        breaker.record_error()
+
+        assert dispatcher.tick() == (0, 0)
+
+        mock_client.submit.assert_not_called()
+
+    def test_tick__local_client(self, mocker, settings, packaged_request, outbound_email):
+        """Emails get delivered through a flaky provider, with retries."""
+        settings.VITAL_RECORDS_EMAIL_RETRIES = 10
+        mocker.patch("web.vital_records.tasks.delivery.backoff", return_value=timedelta(0))
+        mocker.patch("web.vital_records.tasks.delivery.POLL_INTERVAL", timedelta(0))
+        mock_get_connection = mocker.patch("web.vital_records.tasks.delivery.get_connection")
+        client = LocalDeliveryClient(error_rate=0.3, failure_rate=0.3, rng=random.Random(1))
+        dispatcher = Dispatcher(client=client, breaker=CircuitBreaker(threshold=100, reset_seconds=0))
+
+        for _ in range(30):
+            dispatcher.tick()
+            if _refresh(outbound_email).status == "delivered":
+                break
+
+        assert _refresh(outbound_email).status == "delivered"
+        mock_get_connection.return_value.__enter__.return_value.send_messages.assert_called_once()
+        packaged_request.refresh_from_db()
+        assert packaged_request.status == "finished"
+
+    def test_run(self, mocker, dispatcher):
+        stop = threading.Event()
+        ticks = iter([Exception("no database"), None])
+
+        def tick():
+            if error := next(ticks):
+                raise error
+            stop.set()
+
+        mock_tick = mocker.patch.object(dispatcher, "tick", side_effect=tick)
+
+        dispatcher.run(0, stop)
+
+        assert mock_tick.call_count == 2
@@ -1,6 +1,22 @@
+from contextlib import nullcontext
+import os
+
+from django.conf import settings
 import pytest
 
-from web.vital_records.tasks.email import EmailTask, EMAIL_HTML_TEMPLATE, EMAIL_TXT_TEMPLATE
+from web.core.mail import FileAttachment
+from web.vital_records.models import OutboundEmail
+
+from web.vital_records.tasks.email import (
+    EmailBodies,
+    EmailTask,
+    EMAIL_HTML_TEMPLATE,
+    EMAIL_TXT_TEMPLATE,
+    LOGO_URL,
+    OFFICE,
+    REQUESTOR,
+)
+from web.vital_records.tasks.store import get_package_store
 
 
 @pytest.fixture
@@ -9,6 +25,97 @@ def mock_VitalRecordsRequest(mocker, mock_VitalRecordsRequest):
     return mock_VitalRecordsRequest.get_with_status.return_value
 
 
+@pytest.fixture
+def mock_get_connection(mocker):
+    mock = mocker.patch("web.vital_records.tasks.email.get_connection")
+    mock_connection = mock.return_value.__enter__.return_value
+    mock_connection.send_messages.return_value = 1
+    return mock
+
+
+@pytest.fixture
+def package_file(tmp_path) -> str:
+    package_file = tmp_path / "package.pdf"
+    package_file.write_bytes(b"%PDF")
+    return str(package_file)
+
+
+@pytest.fixture
+def mock_email_bodies(mocker):
+    mock = mocker.patch("web.vital_records.tasks.email.email_bodies")
+    mock.get.return_value = ("email body", "email body")
+    return mock
+
+
+class TestEmailBodies:
+    @pytest.fixture
+    def template_dir(self, settings, tmp_path):
+        (tmp_path / "email.txt").write_text("{{ request_type }} x{{ number_of_copies }} for {{ email_address }}")
+        (tmp_path / "email.html").write_text("<p>{{ request_type }} for {{ email_address }}</p><img src='{{ logo_url }}'>")
+        settings.TEMPLATES = [{**settings.TEMPLATES[0], "DIRS": [tmp_path]}]
+        return tmp_path
+
+    @pytest.fixture
+    def bodies(self, template_dir) -> EmailBodies:
+        return EmailBodies("email.txt", "email.html")
+
+    @pytest.fixture
+    def spy_render(self, mocker):
+        return mocker.spy(EmailBodies, "_render")
+
+    def test_get(self, bodies):
+        text_content, html_content = bodies.get("Birth", 2, "jane@example.com")
+
+        assert text_content == "Birth x2 for jane@example.com"
+        assert html_content == f"<p>Birth for jane@example.com</p><img src='{LOGO_URL}'>"
+
+    def test_get__escapes_address(self, bodies):
+        text_content, html_content = bodies.get("Birth", 1, "<jane>@example.com")
+
+        assert text_content == "Birth x1 for &lt;jane&gt;@example.com"
+        assert html_content.startswith("<p>Birth for &lt;jane&gt;@example.com</p>")
+
+    def test_get__cached(self, bodies, spy_render):
+        assert bodies.get("Birth", 1, "jane@example.com")[0] == "Birth x1 for jane@example.com"
+        assert bodies.get("Birth", 1, "john@example.com")[0] == "Birth x1 for john@example.com"
+        assert bodies.get("Death", 1, "jane@example.com")[0] == "Death x1 for jane@example.com"
+
+        assert spy_render.call_count == 2
+
+    def test_get__template_changed(self, bodies, template_dir):
+        assert bodies.get("Birth", 1, "jane@example.com")[0] == "Birth x1 for jane@example.com"
+
+        template = template_dir / "email.txt"
+        template.write_text("Your {{ request_type }} request, {{ email_address }}")
+        mtime = template.stat().st_mtime_ns + 1_000_000_000
+        os.utime(template, ns=(mtime, mtime))
+
+        assert bodies.get("Birth", 1, "jane@example.com")[0] == "Your Birth request, jane@example.com"
+
+    def test_preload(self, bodies, spy_render):
+        bodies.preload(copies=(1, 2))
+
+        assert spy_render.call_count == 6
+        bodies.get("Marriage", 2, "jane@example.com")
+        assert spy_render.call_count == 6
+
+    def test_get__email_templates(self):
+        bodies = EmailBodies(EMAIL_TXT_TEMPLATE, EMAIL_HTML_TEMPLATE)
+
+        text_content, html_content = bodies.get("Birth", 1, "jane@example.com")
+
+        assert "jane@example.com" in text_content
+        assert "jane@example.com" in html_content
+        assert "__email_address__" not in text_content + html_content
+
+    def test_clear(self, bodies, spy_render):
+        bodies.get("Birth", 1, "jane@example.com")
+        bodies.clear()
+        bodies.get("Birth", 1, "jane@example.com")
+
+        assert spy_render.call_count == 2
+
+
 class TestEmailTask:
     @pytest.fixture
     def task(self, request_id, mock_PackageTask) -> EmailTask:
@@ -19,8 +126,12 @@ class TestEmailTask:
     def test_task(self, request_id, task):
         assert task.group == "vital-records"
         assert task.name == "email"
+        assert task.queue == "requests"
         assert task.kwargs["request_id"] == request_id
         assert task.kwargs["package"] == "package"
+        assert task.kwargs["recipients"] is None
+        assert task.kwargs["attempt"] == 1
+        assert task.get_dedup_key(**task.kwargs) == f"task-dedup:email:{request_id}"
         assert task.started is False
 
     @pytest.mark.parametrize(
@@ -55,6 +166,26 @@ class TestEmailTask:
         mock_email_instance.attach_alternative.assert_called_once_with(html_content, "text/html")
         assert result == mock_email_instance
 
+    def test__package_file(self, settings, task):
+        settings.VITAL_RECORDS_PACKAGE_STORE_DIR = "/store"
+
+        with task._package_file("abc123") as filename:
+            assert filename == os.path.join("/store", "abc123.pdf")
+
+    def test__package_file__path(self, task):
+        with task._package_file("/storage/vital-records-request.pdf") as filename:
+            assert filename == "/storage/vital-records-request.pdf"
+
+    def test__package_file__shared(self, db, settings, task):
+        settings.VITAL_RECORDS_PACKAGE_STORE_SHARED = True
+        get_package_store().put("abc123", b"%PDF")
+
+        with task._package_file("abc123") as filename:
+            with open(filename, "rb") as f:
+                assert f.read() == b"%PDF"
+
+        assert not os.path.exists(filename)
+
     @pytest.mark.parametrize(
         "request_type, request_type_formatted", [("birth", "Birth"), ("marriage", "Marriage"), ("death", "Death")]
     )
@@ -66,11 +197,13 @@ class TestEmailTask:
         mock_VitalRecordsRequest,
         request_type,
         request_type_formatted,
+        mock_get_connection,
+        mock_email_bodies,
+        package_file,
         task,
     ):
         mock_inst = mocker.MagicMock(email_address="email@example.com", number_of_records=1, type=request_type)
         mock_VitalRecordsRequest.get_with_status.return_value = mock_inst
-        mock_render = mocker.patch("web.vital_records.tasks.email.render_to_string", return_value="email body")
         mock_email_office = mocker.MagicMock()
         mock_email_requestor = mocker.MagicMock()
         mock__create_base_email = mocker.patch(
@@ -81,25 +214,15 @@ class TestEmailTask:
             ],
         )
 
-        # Simulate a success
-        mock_email_office.send.return_value = 1
-        mock_email_requestor.send.return_value = 1
-
         mock__format_record_type = mocker.patch("web.vital_records.tasks.email.EmailTask._format_record_type")
         mock__format_record_type.return_value = request_type_formatted
-
+        mocker.patch("web.vital_records.tasks.email.EmailTask._package_file", return_value=nullcontext(package_file))
+        mocker.patch("web.vital_records.tasks.email.get_package_filename", return_value="/storage/request.pdf")
         result = task.handler(request_id, "package")
 
         mock__format_record_type.assert_called_once()
 
-        expected_ctx = {
-            "number_of_copies": mock_VitalRecordsRequest.number_of_records,
-            "email_address": mock_VitalRecordsRequest.email_address,
-            "logo_url": "https://webstandards.ca.gov/wp-content/uploads/sites/8/2024/10/cagov-logo-coastal-flat.png",
-            "request_type": request_type_formatted,
-        }
-        mock_render.assert_any_call(EMAIL_TXT_TEMPLATE, expected_ctx)
-        mock_render.assert_any_call(EMAIL_HTML_TEMPLATE, expected_ctx)
+        mock_email_bodies.get.assert_called_once_with(request_type_formatted, 1, "email@example.com")
 
         expected_subject = f"Completed: {request_type_formatted} Record Request"
         office_call = mocker.call(
@@ -116,14 +239,169 @@ class TestEmailTask:
         )
         mock__create_base_email.assert_has_calls([office_call, requestor_call])
 
-        mock_email_office.attach_file.assert_called_once_with("package", "application/pdf")
-        mock_email_office.send.assert_called_once()
+        # read from the package store as the message is sent
+        mock_email_office.attach.assert_called_once()
+        (attachment,) = mock_email_office.attach.call_args.args
+        assert isinstance(attachment, FileAttachment)
+        assert attachment.path == package_file
+        assert attachment.get_filename() == "request.pdf"
+        assert attachment.get_content_type() == "application/pdf"
+        mock_email_requestor.attach.assert_not_called()
 
-        mock_email_requestor.attach_file.assert_not_called()
-        mock_email_requestor.send.assert_called_once()
+        # both through one connection
+        mock_get_connection.assert_called_once_with()
+        mock_connection = mock_get_connection.return_value.__enter__.return_value
+        assert mock_connection.send_messages.call_args_list == [
+            mocker.call([mock_email_office]),
+            mocker.call([mock_email_requestor]),
+        ]
 
         mock_VitalRecordsRequest.complete_send.assert_called_once()
         mock_VitalRecordsRequest.finish.assert_called_once()
         mock_VitalRecordsRequest.save.assert_called_once()
 
-        assert result == (1, 1)
+        assert result == {OFFICE: 1, REQUESTOR: 1}
+
+    @pytest.mark.django_db
+    def test_handler__dispatcher(
+        self, settings, mocker, request_id, mock_VitalRecordsRequest, mock_get_connection, mock_email_bodies, task
+    ):
+        settings.VITAL_RECORDS_EMAIL_DISPATCHER = True
+        mock_VitalRecordsRequest.id = request_id
+        mock_VitalRecordsRequest.email_address = "email@example.com"
+        mock_VitalRecordsRequest.type = "birth"
+        mocker.patch("web.vital_records.tasks.email.get_package_filename", return_value="/storage/request.pdf")
+
+        result = task.handler(request_id, "package")
+
+        # queued, not sent
+        mock_get_connection.assert_not_called()
+        mock_VitalRecordsRequest.complete_send.assert_not_called()
+        office, requestor = OutboundEmail.objects.filter(request_id=request_id).order_by("id")
+        assert result == {OFFICE: office.id, REQUESTOR: requestor.id}
+        assert office.recipient == OFFICE
+        assert office.to_address == settings.VITAL_RECORDS_EMAIL_TO
+        assert office.subject == "Completed: Birth Record Request"
+        assert office.text_content == "email body"
+        assert office.html_content == "email body"
+        assert office.attachment_package == "package"
+        assert office.attachment_filename == "request.pdf"
+        assert office.status == "queued"
+        assert requestor.recipient == REQUESTOR
+        assert requestor.to_address == "email@example.com"
+        assert requestor.attachment_package == ""
+
+    def test_handler__bundle(
+        self, settings, mocker, request_id, mock_VitalRecordsRequest, mock_get_connection, mock_email_bodies, task
+    ):
+        settings.VITAL_RECORDS_BUNDLE_MINUTES = 60
+        mock_VitalRecordsRequest.email_address = "email@example.com"
+        mock_VitalRecordsRequest.type = "birth"
+        mock__create_base_email = mocker.patch("web.vital_records.tasks.email.EmailTask._create_base_email")
+
+        result = task.handler(request_id, "package")
+
+        # only the requestor's confirmation, the package goes in the next bundle
+        mock__create_base_email.assert_called_once_with(
+            subject="Completed: Birth Record Request",
+            to_address=["email@example.com"],
+            text_content="email body",
+            html_content="email body",
+        )
+        mock__create_base_email.return_value.attach.assert_not_called()
+        mock_VitalRecordsRequest.complete_send.assert_called_once()
+        mock_VitalRecordsRequest.finish.assert_not_called()
+        mock_VitalRecordsRequest.save.assert_called_once()
+        assert result == {REQUESTOR: 1}
+
+    @pytest.fixture
+    def mock_messages(self, mocker, mock_VitalRecordsRequest, mock_email_bodies, package_file):
+        mocker.patch("web.vital_records.tasks.email.EmailTask._package_file", return_value=nullcontext(package_file))
+        mocker.patch("web.vital_records.tasks.email.get_package_filename", return_value="/storage/request.pdf")
+        mock_office, mock_requestor = mocker.MagicMock(name="office"), mocker.MagicMock(name="requestor")
+        mocker.patch(
+            "web.vital_records.tasks.email.EmailTask._create_base_email",
+            side_effect=lambda to_address, **kwargs: (
+                mock_office if to_address == [settings.VITAL_RECORDS_EMAIL_TO] else mock_requestor
+            ),
+        )
+        return mock_office, mock_requestor
+
+    def test_handler__partial_failure(self, request_id, mock_VitalRecordsRequest, mock_get_connection, mock_messages, task):
+        mock_office, mock_requestor = mock_messages
+        mock_connection = mock_get_connection.return_value.__enter__.return_value
+        mock_connection.send_messages.side_effect = lambda messages: 1 if messages == [mock_office] else 0
+
+        result = task.handler(request_id, "package")
+
+        assert result == {OFFICE: 1, REQUESTOR: 0}
+        mock_VitalRecordsRequest.complete_send.assert_not_called()
+        mock_VitalRecordsRequest.save.assert_not_called()
+
+    def test_handler__send_error(self, request_id, mock_VitalRecordsRequest, mock_get_connection, mock_messages, task):
+        mock_connection = mock_get_connection.return_value.__enter__.return_value
+        mock_connection.send_messages.side_effect = [ConnectionError(), 1]
+
+        result = task.handler(request_id, "package")
+
+        assert result == {OFFICE: 0, REQUESTOR: 1}
+        mock_VitalRecordsRequest.complete_send.assert_not_called()
+
+    def test_handler__recipients(self, request_id, mock_VitalRecordsRequest, mock_get_connection, mock_messages, task):
+        mock_office, mock_requestor = mock_messages
+
+        result = task.handler(request_id, "package", recipients=[REQUESTOR], attempt=2)
+
+        mock_connection = mock_get_connection.return_value.__enter__.return_value
+        mock_connection.send_messages.assert_called_once_with([mock_requestor])
+        assert result == {REQUESTOR: 1}
+        mock_VitalRecordsRequest.complete_send.assert_called_once()
+        mock_VitalRecordsRequest.finish.assert_called_once()
+
+    def test_handler__concurrent(
+        self, settings, mocker, request_id, mock_VitalRecordsRequest, mock_get_connection, mock_messages, task
+    ):
+        settings.VITAL_RECORDS_EMAIL_CONCURRENT = True
+        mock_office, mock_requestor = mock_messages
+
+        result = task.handler(request_id, "package")
+
+        # a connection for each message
+        assert mock_get_connection.call_count == 2
+        mock_connection = mock_get_connection.return_value.__enter__.return_value
+        mock_connection.send_messages.assert_has_calls(
+            [mocker.call([mock_office]), mocker.call([mock_requestor])], any_order=True
+        )
+        assert result == {OFFICE: 1, REQUESTOR: 1}
+        mock_VitalRecordsRequest.complete_send.assert_called_once()
+
+    def test_post_handler__not_success(self, mocker, request_id, task):
+        mock_EmailTask = mocker.patch("web.vital_records.tasks.email.EmailTask")
+
+        task.post_handler(mocker.MagicMock(success=False, kwargs=task.kwargs))
+
+        mock_EmailTask.assert_not_called()
+
+    def test_post_handler__sent(self, mocker, task):
+        mock_EmailTask = mocker.patch("web.vital_records.tasks.email.EmailTask")
+
+        task.post_handler(mocker.MagicMock(success=True, kwargs=task.kwargs, result={OFFICE: 1, REQUESTOR: 1}))
+
+        mock_EmailTask.assert_not_called()
+
+    def test_post_handler__retry_failed(self, mocker, request_id, task):
+        mock_EmailTask = mocker.patch("web.vital_records.tasks.email.EmailTask")
+
+        task.post_handler(mocker.MagicMock(success=True, kwargs=task.kwargs, result={OFFICE: 1, REQUESTOR: 0}))
+
+        mock_EmailTask.assert_called_once_with(request_id, "package", recipients=[REQUESTOR], attempt=2)
+        mock_EmailTask.return_value.run.assert_called_once()
+
+    def test_post_handler__retries_exhausted(self, settings, mocker, request_id, task):
+        settings.VITAL_RECORDS_EMAIL_RETRIES = 2
+        mock_EmailTask = mocker.patch("web.vital_records.tasks.email.EmailTask")
+        kwargs = {**task.kwargs, "attempt": 3}
+
+        task.post_handler(mocker.MagicMock(success=True, kwargs=kwargs, result={OFFICE: 0, REQUESTOR: 1}))
+
+        mock_EmailTask.assert_not_called()
@@ -0,0 +1,179 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import pytest
+from pypdf import PdfReader
+
+from web.vital_records.tasks.engine import RenderEngine, _warm_up
+from web.vital_records.tasks.package import SWORNSTATEMENT_TEMPLATE
+
+
+@pytest.fixture
+def mock_render(mocker):
+    return mocker.patch("web.vital_records.tasks.engine.pdf.render", return_value=b"%PDF")
+
+
+def test_warm_up(mocker):
+    mock_templates = mocker.patch("web.vital_records.tasks.engine.pdf.templates")
+
+    _warm_up(("one.pdf", "two.pdf"))
+
+    mock_templates.get.assert_has_calls([mocker.call("one.pdf"), mocker.call("two.pdf")])
+
+
+class TestRenderEngine:
+    @pytest.fixture
+    def engine(self):
+        engine = RenderEngine(processes=0, timeout=5)
+        yield engine
+        engine.shutdown()
+
+    def test_init(self):
+        engine = RenderEngine(processes=2, timeout=10, template_paths=["one.pdf"], optimization=2, incremental=True)
+
+        assert engine.processes == 2
+        assert engine.timeout == 10
+        assert engine.template_paths == ("one.pdf",)
+        assert engine.optimization == 2
+        assert engine.incremental is True
+
+    def test_submit__inline(self, engine, mock_render):
+        future = engine.submit(["template.pdf"], {"field": "value"}, {})
+
+        mock_render.assert_called_once_with(("template.pdf",), ({"field": "value"}, {}), 0, False)
+        assert future.done()
+        assert future.result() == b"%PDF"
+        assert engine._pool is None
+
+    def test_submit__inline_error(self, engine, mock_render):
+        mock_render.side_effect = ValueError("bad template")
+
+        future = engine.submit(["template.pdf"], {})
+
+        with pytest.raises(ValueError, match="bad template"):
+            engine.result(future)
+
+    def test_render__inline(self, engine):
+        data = engine.render([SWORNSTATEMENT_TEMPLATE], {"applicantName": "Jane Doe"})
+
+        reader = PdfReader(BytesIO(data))
+        assert reader.get_fields()["applicantName"]["/V"] == "Jane Doe"
+
+    def test_render__pool(self):
+        engine = RenderEngine(processes=1, timeout=30, template_paths=[SWORNSTATEMENT_TEMPLATE])
+        try:
+            data = engine.render([SWORNSTATEMENT_TEMPLATE], {"applicantName": "Jane Doe"})
+        finally:
+            engine.shutdown()
+
+        reader = PdfReader(BytesIO(data))
+        assert reader.get_fields()["applicantName"]["/V"] == "Jane Doe"
+        assert engine._pool is None
+
+    def test_render__pool_timeout(self):
+        engine = RenderEngine(processes=1, timeout=0.001, template_paths=[SWORNSTATEMENT_TEMPLATE])
+        future = engine.submit([SWORNSTATEMENT_TEMPLATE], {"applicantName": "Jane Doe"})
+        processes = list(engine._pool._processes.values())
+
+        with pytest.raises(TimeoutError):
+            engine.result(future)
+
+        # rather than left running alongside the next pool
+        for process in processes:
+            process.join(timeout=5)
+            assert not process.is_alive()
+        assert engine._pool is None
+
+    @pytest.fixture
+    def mock_pools(self, mocker) -> list:
+        """The pools the engine starts, each with a process, and the future of each render submitted to it."""
+        pools = []
+
+        def start_pool(*args, **kwargs):
+            pool = mocker.Mock(spec=["submit", "shutdown", "_processes"])
+            pool._processes = {1: mocker.Mock()}
+            pool.futures = []
+            pool.submit.side_effect = lambda *args: pool.futures.append(Future()) or pool.futures[-1]
+            pools.append(pool)
+            return pool
+
+        mocker.patch("web.vital_records.tasks.engine.ProcessPoolExecutor", side_effect=start_pool)
+        return pools
+
+    def test_render__pool_mocked(self, mock_pools):
+        engine = RenderEngine(processes=1, timeout=5)
+
+        future = engine.submit(["template.pdf"], {"field": "value"})
+
+        (pool,) = mock_pools
+        assert pool.submit.call_args.args[1:] == (("template.pdf",), ({"field": "value"},), 0, False)
+        assert not future.done()
+
+        pool.futures[0].set_result(b"%PDF")
+
+        assert engine.result(future) == b"%PDF"
+        assert engine._rendering == {}
+
+    def test_render__pool_error(self, mock_pools):
+        engine = RenderEngine(processes=1, timeout=5)
+        future = engine.submit(["template.pdf"], {})
+        (pool,) = mock_pools
+
+        pool.futures[0].set_exception(ValueError("bad template"))
+
+        with pytest.raises(ValueError, match="bad template"):
+            engine.result(future)
+        # the pool carries on
+        assert engine._pool is pool
+
+    def test_result__timeout(self, mock_pools):
+        engine = RenderEngine(processes=1, timeout=0.01)
+        stuck = engine.submit(["stuck.pdf"], {})
+        other = engine.submit(["other.pdf"], {})
+        (old_pool,) = mock_pools
+
+        with pytest.raises(TimeoutError):
+            engine.result(stuck)
+
+        # the stuck process is stopped, rather than left running alongside a new pool
+        old_pool._processes[1].terminate.assert_called_once()
+        old_pool.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+        assert stuck.done()
+        # the other render isn't failed along with it, but started again in a new pool
+        (_, new_pool) = mock_pools
+        new_pool.submit.assert_called_once()
+        assert new_pool.submit.call_args.args[1] == ("other.pdf",)
+        assert not other.done()
+
+    def test_result__pool_broken(self, mock_pools):
+        engine = RenderEngine(processes=1, timeout=5)
+        future = engine.submit(["template.pdf"], {})
+        (pool,) = mock_pools
+        pool.futures[0].set_exception(BrokenProcessPool())
+
+        with pytest.raises(BrokenProcessPool):
+            engine.result(future)
+
+        pool._processes[1].terminate.assert_called_once()
+        assert engine._pool is None
+
+    def test_shutdown(self, mock_pools):
+        engine = RenderEngine(processes=1, timeout=5)
+        future = engine.submit(["template.pdf"], {})
+
+        engine.shutdown()
+
+        with pytest.raises(BrokenProcessPool):
+            future.result(timeout=0)
+        assert engine._pool is None
+        assert engine._rendering == {}
+
+    def test_shutdown__terminate_workers(self, mocker):
+        engine = RenderEngine(processes=1, timeout=5)
+        engine._pool = mock_pool = mocker.Mock(spec=["terminate_workers"])
+
+        engine.shutdown()
+
+        mock_pool.terminate_workers.assert_called_once()
+        assert engine._pool is None
@@ -0,0 +1,76 @@
+import threading
+from uuid import uuid4
+
+from django_q.models import OrmQ
+import pytest
+
+from web.vital_records.models import RequestSubmission
+from web.vital_records.tasks.outbox import OutboxDispatcher
+
+
+@pytest.fixture
+def mock_submit_requests(mocker):
+    return mocker.patch("web.vital_records.tasks.outbox.submit_requests")
+
+
+@pytest.fixture
+def dispatcher() -> OutboxDispatcher:
+    return OutboxDispatcher(batch_size=2)
+
+
+def _submissions(count: int) -> list[RequestSubmission]:
+    return [RequestSubmission.objects.create(request_id=uuid4()) for _ in range(count)]
+
+
+@pytest.mark.django_db
+class TestOutboxDispatcher:
+    def test_drain_batch(self, dispatcher, mock_submit_requests):
+        submissions = _submissions(3)
+
+        assert dispatcher.drain_batch() == 2
+
+        mock_submit_requests.assert_called_once_with([submissions[0].request_id, submissions[1].request_id])
+        assert list(RequestSubmission.objects.all()) == [submissions[2]]
+
+    def test_drain_batch__empty(self, dispatcher, mock_submit_requests):
+        assert dispatcher.drain_batch() == 0
+
+        mock_submit_requests.assert_not_called()
+
+    def test_drain_batch__failed(self, dispatcher, mock_submit_requests):
+        _submissions(2)
+        mock_submit_requests.side_effect = RuntimeError("queue unavailable")
+
+        with pytest.raises(RuntimeError):
+            dispatcher.drain_batch()
+
+        # left for the next tick
+        assert RequestSubmission.objects.count() == 2
+
+    def test_tick(self, dispatcher, mock_submit_requests):
+        _submissions(5)
+
+        assert dispatcher.tick() == 5
+
+        assert [len(call.args[0]) for call in mock_submit_requests.call_args_list] == [2, 2, 1]
+        assert RequestSubmission.objects.count() == 0
+
+    def test_tick__queues_tasks(self, dispatcher):
+        _submissions(3)
+
+        dispatcher.tick()
+
+        assert OrmQ.objects.count() == 3
+
+    def test_run(self, mocker, dispatcher):
+        stop = threading.Event()
+
+        def tick():
+            stop.set()
+            raise RuntimeError("database unavailable")
+
+        mock_tick = mocker.patch.object(dispatcher, "tick", side_effect=tick)
+
+        dispatcher.run(0, stop)
+
+        mock_tick.assert_called_once_with()
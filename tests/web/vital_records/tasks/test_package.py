@@ -1,32 +1,56 @@
 import datetime
 import os
+from uuid import uuid4
 import pytest
 
 from django.utils import timezone
+from pypdf import PdfReader
 
 from web.settings import _filter_empty
 from web.vital_records.models import VitalRecordsRequest
 from web.vital_records.tasks.package import (
     APPLICATION_FOLDER,
+    APPLICATIONS,
+    PACKAGE_FIELDS,
+    PACKAGE_TYPES,
+    SWORN_STATEMENTS,
     SWORNSTATEMENT_TEMPLATE,
-    BirthApplication,
-    DeathApplication,
-    MarriageApplication,
+    BatchPackageTask,
+    PackagePipeline,
     PackageTask,
-    SwornStatement,
+    build_base_package,
+    check_package_fields,
+    create_documents,
+    get_application_template,
+    get_base_package_filename,
+    get_package_key,
+    get_package_templates,
+    get_render_engine,
+    run_batch_package_task,
     submit_request,
+    submit_requests,
+    write_package,
 )
-from web.vital_records.tasks.utils import get_package_filename
+from web.vital_records.tasks.pdf import OPTIMIZE_COMPACT
+from web.vital_records.tasks.schema import Schema
 
 
 @pytest.fixture
-def mock_PdfReader(mocker):
-    return mocker.patch("web.vital_records.tasks.package.PdfReader")
+def mock_get_render_engine(mocker):
+    return mocker.patch("web.vital_records.tasks.package.get_render_engine")
 
 
 @pytest.fixture
-def mock_PdfWriter(mocker):
-    return mocker.patch("web.vital_records.tasks.package.PdfWriter")
+def mock_get_package_store(mocker):
+    mock = mocker.patch("web.vital_records.tasks.package.get_package_store")
+    mock.return_value.exists.return_value = False
+    return mock
+
+
+@pytest.fixture
+def package_dir(settings, tmp_path):
+    settings.VITAL_RECORDS_PACKAGE_DIR = str(tmp_path / "packages")
+    return settings.VITAL_RECORDS_PACKAGE_DIR
 
 
 @pytest.fixture
@@ -83,6 +107,156 @@ def test_templates(settings):
     assert SWORNSTATEMENT_TEMPLATE == os.path.join(APPLICATION_FOLDER, "sworn-statement.pdf")
 
 
+@pytest.mark.parametrize("request_type", PACKAGE_TYPES)
+def test_get_application_template(request_type):
+    assert get_application_template(request_type) == os.path.join(APPLICATION_FOLDER, f"application_{request_type}.pdf")
+
+
+def test_get_base_package_filename(package_dir):
+    assert get_base_package_filename("birth") == os.path.join(package_dir, "package_birth.pdf")
+
+
+@pytest.mark.parametrize("request_type", PACKAGE_TYPES)
+def test_build_base_package(package_dir, request_type):
+    filename = build_base_package(request_type)
+
+    assert filename == get_base_package_filename(request_type)
+    assert os.listdir(package_dir) == [os.path.basename(filename)]
+
+    reader = PdfReader(filename)
+    assert len(reader.pages) == 2
+    assert "applicantName" in reader.get_fields()
+    assert "RequestorEmail" in reader.get_fields()
+
+
+def test_build_base_package__optimized(mocker, caplog, package_dir):
+    mock_optimize = mocker.patch("web.vital_records.tasks.package.optimize", return_value=123)
+
+    with caplog.at_level("INFO", logger="web.vital_records.tasks.package"):
+        filename = build_base_package("birth")
+
+    mock_optimize.assert_called_once_with(mocker.ANY, OPTIMIZE_COMPACT)
+    assert f"Optimized base package, saved 123 bytes: {filename}" in caplog.text
+
+
+def test_get_package_templates__no_base_package(package_dir):
+    assert get_package_templates("birth") == (get_application_template("birth"), SWORNSTATEMENT_TEMPLATE)
+
+
+def test_get_package_templates__base_package(package_dir):
+    filename = build_base_package("birth")
+
+    assert get_package_templates("birth") == (filename,)
+
+
+def test_get_package_templates__stale_base_package(package_dir):
+    filename = build_base_package("birth")
+    os.utime(filename, ns=(0, 0))
+
+    assert get_package_templates("birth") == (get_application_template("birth"), SWORNSTATEMENT_TEMPLATE)
+
+
+def test_check_package_fields(caplog, package_dir):
+    with caplog.at_level("WARNING", logger="web.vital_records.tasks.package"):
+        check_package_fields()
+
+    # every schema field is in its template
+    assert not [record.getMessage() for record in caplog.records]
+
+
+def test_check_package_fields__unknown(caplog, mocker, package_dir):
+    mocker.patch.dict(APPLICATIONS, {"birth": Schema("BirthApplication", {"NotAField": "first_name"})})
+
+    with caplog.at_level("WARNING", logger="web.vital_records.tasks.package"):
+        check_package_fields()
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages == ["BirthApplication fields not in the birth package template: NotAField"]
+
+
+def test_get_render_engine(mocker, settings, package_dir):
+    mock_check = mocker.patch("web.vital_records.tasks.package.check_package_fields")
+    settings.VITAL_RECORDS_RENDER_PROCESSES = 3
+    settings.VITAL_RECORDS_RENDER_TIMEOUT = 15
+    settings.VITAL_RECORDS_PACKAGE_OPTIMIZATION = 2
+    settings.VITAL_RECORDS_PACKAGE_INCREMENTAL = True
+    get_render_engine.cache_clear()
+
+    engine = get_render_engine()
+
+    assert engine is get_render_engine()
+    mock_check.assert_called_once()
+    assert engine.processes == 3
+    assert engine.timeout == 15
+    assert engine.optimization == 2
+    assert engine.incremental is True
+    assert set(engine.template_paths) == {SWORNSTATEMENT_TEMPLATE} | {get_application_template(t) for t in PACKAGE_TYPES}
+
+    get_render_engine.cache_clear()
+
+
+@pytest.fixture
+def store_dir(settings, tmp_path):
+    settings.VITAL_RECORDS_PACKAGE_STORE_DIR = str(tmp_path / "store")
+    return settings.VITAL_RECORDS_PACKAGE_STORE_DIR
+
+
+def test_get_package_key(mock_get_render_engine, package_dir):
+    mock_get_render_engine.return_value.optimization = 1
+    mock_get_render_engine.return_value.incremental = False
+    request_id = uuid4()
+    application, sworn_statement = {"RegFirstName": "Jane"}, {"city": "Los Angeles"}
+
+    key = get_package_key("birth", request_id, application, sworn_statement)
+
+    assert len(key) == 64
+    assert key == get_package_key("birth", request_id, {"RegFirstName": "Jane"}, {"city": "Los Angeles"})
+    # unique to the request, even with the same values
+    assert key != get_package_key("birth", uuid4(), application, sworn_statement)
+    assert key != get_package_key("birth", request_id, {"RegFirstName": "John"}, sworn_statement)
+    assert key != get_package_key("birth", request_id, application, {"city": "San Diego"})
+    assert key != get_package_key("death", request_id, application, sworn_statement)
+    mock_get_render_engine.return_value.optimization = 2
+    assert key != get_package_key("birth", request_id, application, sworn_statement)
+
+
+def test_write_package(mocker, mock_get_render_engine, package_dir, store_dir):
+    application, sworn_statement = {"RegFirstName": "Jane"}, {"applicantName": "Jane Doe"}
+    mocker.patch("web.vital_records.tasks.package.get_package_key", return_value="key")
+    mock_engine = mock_get_render_engine.return_value
+    mock_engine.result.return_value = b"%PDF"
+
+    key = write_package("birth", uuid4(), application, sworn_statement)
+
+    mock_engine.submit.assert_called_once_with(get_package_templates("birth"), application, sworn_statement)
+    assert key == "key"
+    with open(os.path.join(store_dir, "key.pdf"), "rb") as f:
+        assert f.read() == b"%PDF"
+
+
+def test_write_package__already_stored(mocker, mock_get_render_engine, package_dir, store_dir):
+    mocker.patch("web.vital_records.tasks.package.get_package_key", return_value="key")
+    mock_get_render_engine.return_value.result.return_value = b"%PDF"
+    request_id = uuid4()
+    write_package("birth", request_id, {}, {})
+
+    key = write_package("birth", request_id, {}, {})
+
+    assert key == "key"
+    mock_get_render_engine.return_value.submit.assert_called_once()
+
+
+def test_run_batch_package_task(mocker):
+    mock_task = mocker.MagicMock()
+    mock_BatchPackageTask = mocker.patch("web.vital_records.tasks.package.BatchPackageTask", return_value=mock_task)
+
+    result = run_batch_package_task()
+
+    mock_BatchPackageTask.assert_called_once_with()
+    mock_task.run.assert_called_once()
+    assert result == mock_task
+
+
 def test_submit_request(mocker, request_id, mock_PackageTask):
     mock_inst = mocker.MagicMock()
     mock_PackageTask.return_value = mock_inst
@@ -94,197 +268,292 @@ def test_submit_request(mocker, request_id, mock_PackageTask):
     assert result == mock_inst
 
 
-class TestBirthApplication:
-    def test_asdict(self):
-        app = BirthApplication()
+def test_submit_request__batch(mocker, settings, request_id, mock_PackageTask):
+    settings.VITAL_RECORDS_PACKAGE_BATCH_SIZE = 10
+    mock_BatchPackageTask = mocker.patch("web.vital_records.tasks.package.BatchPackageTask")
+
+    result = submit_request(request_id)
+
+    mock_PackageTask.assert_not_called()
+    mock_BatchPackageTask.assert_called_once_with()
+    mock_BatchPackageTask.return_value.run.assert_called_once()
+    assert result == mock_BatchPackageTask.return_value
+
+
+def test_submit_request__pipeline(mocker, settings, request_id, mock_PackageTask):
+    settings.VITAL_RECORDS_PACKAGE_PIPELINE = True
+    mock_PackagePipeline = mocker.patch("web.vital_records.tasks.package.PackagePipeline")
+
+    result = submit_request(request_id)
+
+    mock_PackageTask.assert_not_called()
+    mock_PackagePipeline.assert_called_once_with(request_id)
+    mock_PackagePipeline.return_value.run.assert_called_once()
+    assert result == mock_PackagePipeline.return_value
+
+
+def test_submit_requests(mocker, request_id):
+    mock_run_many = mocker.patch.object(PackageTask, "run_many")
+
+    result = submit_requests([request_id])
+
+    assert list(mock_run_many.call_args.args[0]) == [{"request_id": request_id}]
+    assert result == mock_run_many.return_value
+
+
+def test_submit_requests__empty(mocker):
+    mock_run_many = mocker.patch.object(PackageTask, "run_many")
+
+    assert submit_requests([]) == []
+    mock_run_many.assert_not_called()
+
+
+def test_submit_requests__batch(mocker, settings):
+    settings.VITAL_RECORDS_PACKAGE_BATCH_SIZE = 10
+    mock_run_many = mocker.patch.object(BatchPackageTask, "run_many")
+
+    submit_requests([uuid4() for _ in range(25)])
+
+    assert list(mock_run_many.call_args.args[0]) == [{}, {}, {}]
+
+
+def test_submit_requests__pipeline(mocker, settings, request_id):
+    settings.VITAL_RECORDS_PACKAGE_PIPELINE = True
+    mock_run_many = mocker.patch.object(PackagePipeline, "run_many")
+
+    submit_requests([request_id])
+
+    assert list(mock_run_many.call_args.args[0]) == [{"request_id": request_id}]
+
+
+@pytest.mark.parametrize("request_type", PACKAGE_TYPES)
+def test_create_documents(mocker, request_type):
+    request = mocker.Mock()
+    mock_application, mock_sworn_statement = mocker.Mock(), mocker.Mock()
+    mocker.patch.dict(APPLICATIONS, {request_type: mock_application})
+    mocker.patch.dict(SWORN_STATEMENTS, {request_type: mock_sworn_statement})
+
+    application, sworn_statement = create_documents(request_type, request)
+
+    mock_application.fill.assert_called_once_with(request)
+    mock_sworn_statement.fill.assert_called_once_with(request)
+    assert application == mock_application.fill.return_value
+    assert sworn_statement == mock_sworn_statement.fill.return_value
 
-        d = app.dict()
 
-        assert d["package_id"] == app.package_id
-        assert d["CDPH_VR_FORMTYPE"] == app.CDPH_VR_FORMTYPE
-        assert d["CopyType"] == app.CopyType
-        assert d["RelationshipToRegistrant"] == app.RelationshipToRegistrant
-        assert d["NumberOfCopies"] == app.NumberOfCopies
-        assert d["EventType"] == app.EventType
+@pytest.mark.django_db
+@pytest.mark.parametrize("request_type", PACKAGE_TYPES)
+def test_create_documents__values_row(request_type):
+    request = VitalRecordsRequest.objects.create(
+        type=request_type,
+        fire="palisades",
+        relationship="self",
+        legal_attestation="Jane Anne Doe",
+        first_name="Jane",
+        last_name="Doe",
+        county_of_event="Los Angeles",
+        date_of_birth=datetime.date(1990, 9, 22),
+        date_of_event=datetime.date(2025, 1, 7),
+        person_1_first_name="Jane",
+        person_1_last_name="Doe",
+        person_2_first_name="John",
+        person_2_last_name="Doe",
+        number_of_records=2,
+        address="1234 Main Street",
+        started_at=timezone.now(),
+    )
+    row = VitalRecordsRequest.objects.values(*PACKAGE_FIELDS).get(pk=request.pk)
+
+    assert create_documents(request_type, row) == create_documents(request_type, request)
+
+
+def test_package_fields():
+    model_fields = {field.attname for field in VitalRecordsRequest._meta.concrete_fields}
 
-    def test_create(self, mock_vital_records_request, request_id):
+    assert {"id", "type"} <= set(PACKAGE_FIELDS) <= model_fields
+    for schema in (*APPLICATIONS.values(), *SWORN_STATEMENTS.values()):
+        assert set(schema.fields) <= set(PACKAGE_FIELDS)
+
+
+class TestBirthApplication:
+    def test_fill__empty(self):
+        d = APPLICATIONS["birth"].fill(dict.fromkeys(PACKAGE_FIELDS))
+
+        assert d == {
+            "CDPH_VR_FORMTYPE": "WILDFIRE_CDPH_VR_B0A6353F1",
+            "EventType": "Birth",
+            "CopyType": "/WLDFREAUTH",
+            "RelationshipToRegistrant": "/1",
+            "RequestorCountry": "United States",
+        }
+
+    def test_fill(self, mock_vital_records_request, request_id):
         mock_vital_records_request.id = request_id
 
-        application = BirthApplication.create(mock_vital_records_request)
-
-        assert isinstance(application, BirthApplication)
-        assert application.package_id == mock_vital_records_request.id
-        assert application.WildfireName == mock_vital_records_request.fire.capitalize()
-        assert application.NumberOfCopies == mock_vital_records_request.number_of_records
-        assert application.RegFirstName == mock_vital_records_request.first_name
-        assert application.RegMiddleName == mock_vital_records_request.middle_name
-        assert application.RegLastName == mock_vital_records_request.last_name
-        assert application.County == mock_vital_records_request.county_of_event
-        assert application.RegDOE == mock_vital_records_request.date_of_birth.strftime("%m/%d/%Y")
-        assert application.Parent1FirstName == mock_vital_records_request.person_1_first_name
-        assert application.Parent1LastName == mock_vital_records_request.person_1_last_name
-        assert application.Parent2FirstName == mock_vital_records_request.person_2_first_name
-        assert application.Parent2LastName == mock_vital_records_request.person_2_last_name
-        assert application.RequestorFirstName == mock_vital_records_request.order_first_name
-        assert application.RequestorLastName == mock_vital_records_request.order_last_name
-        assert application.RequestorMailingAddress == " ".join(
+        application = APPLICATIONS["birth"].fill(mock_vital_records_request)
+
+        assert application["WildfireName"] == mock_vital_records_request.fire.capitalize()
+        assert application["NumberOfCopies"] == mock_vital_records_request.number_of_records
+        assert application["RegFirstName"] == mock_vital_records_request.first_name
+        assert application["RegMiddleName"] == mock_vital_records_request.middle_name
+        assert application["RegLastName"] == mock_vital_records_request.last_name
+        assert application["County"] == mock_vital_records_request.county_of_event
+        assert application["RegDOE"] == mock_vital_records_request.date_of_birth.strftime("%m/%d/%Y")
+        assert application["Parent1FirstName"] == mock_vital_records_request.person_1_first_name
+        assert application["Parent1LastName"] == mock_vital_records_request.person_1_last_name
+        assert application["Parent2FirstName"] == mock_vital_records_request.person_2_first_name
+        assert application["Parent2LastName"] == mock_vital_records_request.person_2_last_name
+        assert application["RequestorFirstName"] == mock_vital_records_request.order_first_name
+        assert application["RequestorLastName"] == mock_vital_records_request.order_last_name
+        assert application["RequestorMailingAddress"] == " ".join(
             _filter_empty((mock_vital_records_request.address, mock_vital_records_request.address_2))
         )
-        assert application.RequestorCity == mock_vital_records_request.city
-        assert application.RequestorStateProvince == mock_vital_records_request.state
-        assert application.RequestorZipCode == mock_vital_records_request.zip_code
-        assert application.RequestorCountry == "United States"
-        assert application.RequestorEmail == mock_vital_records_request.email_address
-        assert application.RequestorTelephone == mock_vital_records_request.phone_number
+        assert application["RequestorCity"] == mock_vital_records_request.city
+        assert application["RequestorStateProvince"] == mock_vital_records_request.state
+        assert application["RequestorZipCode"] == mock_vital_records_request.zip_code
+        assert application["RequestorCountry"] == "United States"
+        assert application["RequestorEmail"] == mock_vital_records_request.email_address
+        assert application["RequestorTelephone"] == mock_vital_records_request.phone_number
 
 
 class TestDeathApplication:
-    def test_asdict(self):
-        app = DeathApplication()
+    def test_fill__empty(self):
+        d = APPLICATIONS["death"].fill(dict.fromkeys(PACKAGE_FIELDS))
 
-        d = app.dict()
-
-        assert d["package_id"] == app.package_id
-        assert d["CDPH_VR_FORMTYPE"] == app.CDPH_VR_FORMTYPE
-        assert d["CopyType"] == app.CopyType
-        assert d["NumberOfCopies"] == app.NumberOfCopies
-        assert d["EventType"] == app.EventType
+        assert d == {
+            "CDPH_VR_FORMTYPE": "WILDFIRE_CDPH_VR_D52594BE",
+            "EventType": "Death",
+            "CopyType": "/WLDFREAUTH",
+            "RelationshipToRegistrant": "/1",
+            "RequestorCountry": "United States",
+        }
 
     @pytest.mark.parametrize("relationship,expected_relationship_option", [("self", "/1"), ("surviving_next_of_kin", "/6")])
-    def test_create(self, mock_vital_records_request, request_id, relationship, expected_relationship_option):
+    def test_fill(self, mock_vital_records_request, request_id, relationship, expected_relationship_option):
         mock_vital_records_request.id = request_id
         mock_vital_records_request.relationship = relationship
 
-        application = DeathApplication.create(mock_vital_records_request)
-
-        assert isinstance(application, DeathApplication)
-        assert application.package_id == mock_vital_records_request.id
-        assert application.WildfireName == mock_vital_records_request.fire.capitalize()
-        assert application.NumberOfCopies == mock_vital_records_request.number_of_records
-        assert application.RelationshipToRegistrant == expected_relationship_option
-        assert application.RegFirstName == mock_vital_records_request.first_name
-        assert application.RegMiddleName == mock_vital_records_request.middle_name
-        assert application.RegLastName == mock_vital_records_request.last_name
-        assert application.County == mock_vital_records_request.county_of_event
-        assert application.RegDOE == mock_vital_records_request.date_of_event.strftime("%m/%d/%Y")
-        assert application.RegDOB == mock_vital_records_request.date_of_birth.strftime("%m/%d/%Y")
-        assert application.Parent1FirstName == mock_vital_records_request.person_1_first_name
-        assert application.Parent1LastName == mock_vital_records_request.person_1_last_name
-        assert application.RegPartnerFirstName == mock_vital_records_request.person_2_first_name
-        assert application.RegPartnerLastName == mock_vital_records_request.person_2_last_name
-        assert application.RequestorFirstName == mock_vital_records_request.order_first_name
-        assert application.RequestorLastName == mock_vital_records_request.order_last_name
-        assert application.RequestorMailingAddress == " ".join(
+        application = APPLICATIONS["death"].fill(mock_vital_records_request)
+
+        assert application["WildfireName"] == mock_vital_records_request.fire.capitalize()
+        assert application["NumberOfCopies"] == mock_vital_records_request.number_of_records
+        assert application["RelationshipToRegistrant"] == expected_relationship_option
+        assert application["RegFirstName"] == mock_vital_records_request.first_name
+        assert application["RegMiddleName"] == mock_vital_records_request.middle_name
+        assert application["RegLastName"] == mock_vital_records_request.last_name
+        assert application["County"] == mock_vital_records_request.county_of_event
+        assert application["RegDOE"] == mock_vital_records_request.date_of_event.strftime("%m/%d/%Y")
+        assert application["RegDOB"] == mock_vital_records_request.date_of_birth.strftime("%m/%d/%Y")
+        assert application["Parent1FirstName"] == mock_vital_records_request.person_1_first_name
+        assert application["Parent1LastName"] == mock_vital_records_request.person_1_last_name
+        assert application["RegPartnerFirstName"] == mock_vital_records_request.person_2_first_name
+        assert application["RegPartnerLastName"] == mock_vital_records_request.person_2_last_name
+        assert application["RequestorFirstName"] == mock_vital_records_request.order_first_name
+        assert application["RequestorLastName"] == mock_vital_records_request.order_last_name
+        assert application["RequestorMailingAddress"] == " ".join(
             _filter_empty((mock_vital_records_request.address, mock_vital_records_request.address_2))
         )
-        assert application.RequestorCity == mock_vital_records_request.city
-        assert application.RequestorStateProvince == mock_vital_records_request.state
-        assert application.RequestorZipCode == mock_vital_records_request.zip_code
-        assert application.RequestorCountry == "United States"
-        assert application.RequestorEmail == mock_vital_records_request.email_address
-        assert application.RequestorTelephone == mock_vital_records_request.phone_number
+        assert application["RequestorCity"] == mock_vital_records_request.city
+        assert application["RequestorStateProvince"] == mock_vital_records_request.state
+        assert application["RequestorZipCode"] == mock_vital_records_request.zip_code
+        assert application["RequestorCountry"] == "United States"
+        assert application["RequestorEmail"] == mock_vital_records_request.email_address
+        assert application["RequestorTelephone"] == mock_vital_records_request.phone_number
 
 
 class TestMarriageApplication:
-    def test_asdict(self):
-        app = MarriageApplication()
-
-        d = app.dict()
-
-        assert d["package_id"] == app.package_id
-        assert d["CDPH_VR_FORMTYPE"] == app.CDPH_VR_FORMTYPE
-        assert d["CopyType"] == app.CopyType
-        assert d["RelationshipToRegistrant"] == app.RelationshipToRegistrant
-        assert d["NumberOfCopies"] == app.NumberOfCopies
-        assert d["EventType"] == app.EventType
-
-    def test_create(self, mock_vital_records_request, request_id):
+    def test_fill__empty(self):
+        d = APPLICATIONS["marriage"].fill(dict.fromkeys(PACKAGE_FIELDS))
+
+        assert d == {
+            "CDPH_VR_FORMTYPE": "WILDFIRE_CDPH_VR_M27FFEAFF",
+            "EventType": "Marriage",
+            "CopyType": "/WLDFREAUTH",
+            "RelationshipToRegistrant": "/1",
+            "RequestorCountry": "United States",
+        }
+
+    def test_fill(self, mock_vital_records_request, request_id):
         mock_vital_records_request.id = request_id
 
-        application = MarriageApplication.create(mock_vital_records_request)
-
-        assert isinstance(application, MarriageApplication)
-        assert application.package_id == mock_vital_records_request.id
-        assert application.WildfireName == mock_vital_records_request.fire.capitalize()
-        assert application.NumberOfCopies == mock_vital_records_request.number_of_records
-        assert application.Spouse1FirstName == mock_vital_records_request.person_1_first_name
-        assert application.Spouse1MiddleName == mock_vital_records_request.person_1_middle_name
-        assert application.Spouse1LastName == mock_vital_records_request.person_1_last_name
-        assert application.Spouse1BirthLastName == mock_vital_records_request.person_1_birth_last_name
-        assert application.Spouse2FirstName == mock_vital_records_request.person_2_first_name
-        assert application.Spouse2MiddleName == mock_vital_records_request.person_2_middle_name
-        assert application.Spouse2LastName == mock_vital_records_request.person_2_last_name
-        assert application.Spouse2BirthLastName == mock_vital_records_request.person_2_birth_last_name
-        assert application.County == mock_vital_records_request.county_of_event
-        assert application.RegDOE == mock_vital_records_request.date_of_event.strftime("%m/%d/%Y")
-        assert application.RequestorFirstName == mock_vital_records_request.order_first_name
-        assert application.RequestorLastName == mock_vital_records_request.order_last_name
-        assert application.RequestorMailingAddress == " ".join(
+        application = APPLICATIONS["marriage"].fill(mock_vital_records_request)
+
+        assert application["WildfireName"] == mock_vital_records_request.fire.capitalize()
+        assert application["NumberOfCopies"] == mock_vital_records_request.number_of_records
+        assert application["Spouse1FirstName"] == mock_vital_records_request.person_1_first_name
+        assert application["Spouse1MiddleName"] == mock_vital_records_request.person_1_middle_name
+        assert application["Spouse1LastName"] == mock_vital_records_request.person_1_last_name
+        assert application["Spouse1BirthLastName"] == mock_vital_records_request.person_1_birth_last_name
+        assert application["Spouse2FirstName"] == mock_vital_records_request.person_2_first_name
+        assert application["Spouse2MiddleName"] == mock_vital_records_request.person_2_middle_name
+        assert application["Spouse2LastName"] == mock_vital_records_request.person_2_last_name
+        assert application["Spouse2BirthLastName"] == mock_vital_records_request.person_2_birth_last_name
+        assert application["County"] == mock_vital_records_request.county_of_event
+        assert application["RegDOE"] == mock_vital_records_request.date_of_event.strftime("%m/%d/%Y")
+        assert application["RequestorFirstName"] == mock_vital_records_request.order_first_name
+        assert application["RequestorLastName"] == mock_vital_records_request.order_last_name
+        assert application["RequestorMailingAddress"] == " ".join(
             _filter_empty((mock_vital_records_request.address, mock_vital_records_request.address_2))
         )
-        assert application.RequestorCity == mock_vital_records_request.city
-        assert application.RequestorStateProvince == mock_vital_records_request.state
-        assert application.RequestorZipCode == mock_vital_records_request.zip_code
-        assert application.RequestorCountry == "United States"
-        assert application.RequestorEmail == mock_vital_records_request.email_address
-        assert application.RequestorTelephone == mock_vital_records_request.phone_number
+        assert application["RequestorCity"] == mock_vital_records_request.city
+        assert application["RequestorStateProvince"] == mock_vital_records_request.state
+        assert application["RequestorZipCode"] == mock_vital_records_request.zip_code
+        assert application["RequestorCountry"] == "United States"
+        assert application["RequestorEmail"] == mock_vital_records_request.email_address
+        assert application["RequestorTelephone"] == mock_vital_records_request.phone_number
 
 
 class TestSwornStatement:
-    def test_asdict(self):
-        ss = SwornStatement(registrantName="name")
+    @pytest.mark.parametrize("request_type", PACKAGE_TYPES)
+    def test_fill__empty(self, request_type):
+        d = SWORN_STATEMENTS[request_type].fill(dict.fromkeys(PACKAGE_FIELDS))
 
-        d = ss.dict()
+        assert d == {}
 
-        assert d["registrantName"] == "name"
-
-    def test_create_birth_sworn_statement(self, mock_vital_records_request):
+    def test_fill__birth(self, mock_vital_records_request):
         now = datetime.datetime.now(tz=datetime.UTC)
         mock_vital_records_request.started_at = now
 
-        sworn_statement = SwornStatement.create_birth_sworn_statement(mock_vital_records_request)
+        sworn_statement = SWORN_STATEMENTS["birth"].fill(mock_vital_records_request)
 
-        assert isinstance(sworn_statement, SwornStatement)
-        assert sworn_statement.applicantName == "Legal Attestation"
-        assert sworn_statement.applicantSignature1 == "Legal Attestation"
-        assert sworn_statement.applicantSignature2 == (
+        assert sworn_statement["applicantName"] == "Legal Attestation"
+        assert sworn_statement["applicantSignature1"] == "Legal Attestation"
+        assert sworn_statement["applicantSignature2"] == (
             f"Authorized via California Identity Gateway "
             f"{now.astimezone(timezone.get_default_timezone()).strftime('%Y-%m-%d %H:%M:%S')}"
         )
-        assert sworn_statement.registrantNameRow1 == "Jane Anne Doe"
-        assert sworn_statement.applicantRelationToRegistrantRow1 == "Relationship"
+        assert sworn_statement["registrantNameRow1"] == "Jane Anne Doe"
+        assert sworn_statement["applicantRelationToRegistrantRow1"] == "Relationship"
 
-    def test_create_marriage_sworn_statement(self, mock_vital_records_request):
+    def test_fill__marriage(self, mock_vital_records_request):
         now = datetime.datetime.now(tz=datetime.UTC)
         mock_vital_records_request.started_at = now
 
-        sworn_statement = SwornStatement.create_marriage_sworn_statement(mock_vital_records_request)
+        sworn_statement = SWORN_STATEMENTS["marriage"].fill(mock_vital_records_request)
 
-        assert isinstance(sworn_statement, SwornStatement)
-        assert sworn_statement.applicantName == "Legal Attestation"
-        assert sworn_statement.applicantSignature1 == "Legal Attestation"
-        assert sworn_statement.applicantSignature2 == (
+        assert sworn_statement["applicantName"] == "Legal Attestation"
+        assert sworn_statement["applicantSignature1"] == "Legal Attestation"
+        assert sworn_statement["applicantSignature2"] == (
             f"Authorized via California Identity Gateway "
             f"{now.astimezone(timezone.get_default_timezone()).strftime('%Y-%m-%d %H:%M:%S')}"
         )
-        assert sworn_statement.registrantNameRow1 == "F. Last1 / F. Last2"
-        assert sworn_statement.applicantRelationToRegistrantRow1 == "Relationship"
+        assert sworn_statement["registrantNameRow1"] == "F. Last1 / F. Last2"
+        assert sworn_statement["applicantRelationToRegistrantRow1"] == "Relationship"
 
-    def test_create_death_sworn_statement(self, mock_vital_records_request):
+    def test_fill__death(self, mock_vital_records_request):
         now = datetime.datetime.now(tz=datetime.UTC)
         mock_vital_records_request.started_at = now
 
-        sworn_statement = SwornStatement.create_death_sworn_statement(mock_vital_records_request)
+        sworn_statement = SWORN_STATEMENTS["death"].fill(mock_vital_records_request)
 
-        assert isinstance(sworn_statement, SwornStatement)
-        assert sworn_statement.applicantName == "Legal Attestation"
-        assert sworn_statement.applicantSignature1 == "Legal Attestation"
-        assert sworn_statement.applicantSignature2 == (
+        assert sworn_statement["applicantName"] == "Legal Attestation"
+        assert sworn_statement["applicantSignature1"] == "Legal Attestation"
+        assert sworn_statement["applicantSignature2"] == (
             f"Authorized via California Identity Gateway "
             f"{now.astimezone(timezone.get_default_timezone()).strftime('%Y-%m-%d %H:%M:%S')}"
         )
-        assert sworn_statement.registrantNameRow1 == "Jane Anne Doe"
-        assert sworn_statement.applicantRelationToRegistrantRow1 == "Relationship"
+        assert sworn_statement["registrantNameRow1"] == "Jane Anne Doe"
+        assert sworn_statement["applicantRelationToRegistrantRow1"] == "Relationship"
 
 
 class TestPackageTask:
@@ -293,35 +562,25 @@ class TestPackageTask:
     def task(self, request_id) -> PackageTask:
         return PackageTask(request_id)
 
-    @pytest.fixture(autouse=True)
-    def mock_open(self, mocker):
-        mocker.patch("web.vital_records.tasks.package.open")
-
     def test_task(self, request_id, task):
         assert task.group == "vital-records"
         assert task.name == "package"
+        assert task.queue == "requests"
         assert task.kwargs["request_id"] == request_id
+        assert task.get_dedup_key(request_id=request_id) == f"task-dedup:package:{request_id}"
         assert task.started is False
 
-    @pytest.mark.parametrize(
-        "request_type, mock_app_class, mock_ss_method_name",
-        [
-            ("birth", BirthApplication, "create_birth_sworn_statement"),
-            ("marriage", MarriageApplication, "create_marriage_sworn_statement"),
-            ("death", DeathApplication, "create_death_sworn_statement"),
-        ],
-    )
+    @pytest.mark.parametrize("request_type", PACKAGE_TYPES)
     def test_handler(
         self,
         mocker,
         request_id,
         mock_VitalRecordsRequest,
-        mock_PdfReader,
-        mock_PdfWriter,
+        mock_get_render_engine,
+        mock_get_package_store,
+        package_dir,
         task,
         request_type,
-        mock_app_class,
-        mock_ss_method_name,
     ):
         now = datetime.datetime.now(tz=datetime.UTC)
         mock_inst = mocker.MagicMock(
@@ -335,36 +594,41 @@ class TestPackageTask:
         )
         mock_VitalRecordsRequest.get_with_status.return_value = mock_inst
 
-        mock_application_obj = mocker.MagicMock()
-        mock_application_obj.dict.return_value = {"app_key": "app_value"}
-        mocker.patch.object(mock_app_class, "create", return_value=mock_application_obj)
-
-        mock_sworn_statement_obj = mocker.MagicMock()
-        mock_sworn_statement_obj.dict.return_value = {}
-        mocker.patch.object(SwornStatement, mock_ss_method_name, return_value=mock_sworn_statement_obj)
+        mock_create_documents = mocker.patch(
+            "web.vital_records.tasks.package.create_documents", return_value=({"app_key": "app_value"}, {})
+        )
 
         result = task.handler(request_id)
 
         mock_VitalRecordsRequest.get_with_status.assert_called_once_with(request_id, "enqueued")
+        mock_create_documents.assert_called_once_with(request_type, mock_inst)
 
-        getattr(mock_app_class, "create").assert_called_once_with(mock_inst)
-        getattr(SwornStatement, mock_ss_method_name).assert_called_once_with(mock_inst)
-
-        mock_PdfReader.assert_any_call(os.path.join(APPLICATION_FOLDER, f"application_{request_type}.pdf"))
-        mock_PdfReader.assert_any_call(SWORNSTATEMENT_TEMPLATE)
-        mock_reader = mock_PdfReader.return_value
-
-        mock_PdfWriter.assert_called_once()
-        mock_writer = mock_PdfWriter.return_value
-        mock_writer.append.assert_any_call(mock_reader)
-        mock_writer.update_page_form_field_values.assert_any_call(mock_writer.pages[0], {}, auto_regenerate=False)
-        mock_writer.update_page_form_field_values.assert_any_call(mock_writer.pages[1], {}, auto_regenerate=False)
-        mock_writer.write.assert_called_once()
+        mock_engine = mock_get_render_engine.return_value
+        mock_engine.submit.assert_called_once_with(get_package_templates(request_type), {"app_key": "app_value"}, {})
+        mock_engine.result.assert_called_once_with(mock_engine.submit.return_value)
+        mock_get_package_store.return_value.put.assert_called_once_with(result, mock_engine.result.return_value)
 
+        assert mock_inst.package_hash == result
         mock_inst.complete_package.assert_called_once()
         mock_inst.save.assert_called_once()
 
-        assert result == get_package_filename(mock_inst)
+        assert len(result) == 64
+
+    def test_handler__already_stored(
+        self, mocker, request_id, mock_VitalRecordsRequest, mock_get_render_engine, mock_get_package_store, task
+    ):
+        mock_inst = mock_VitalRecordsRequest.get_with_status.return_value
+        mocker.patch("web.vital_records.tasks.package.create_documents", return_value=({}, {}))
+        mocker.patch("web.vital_records.tasks.package.get_package_key", return_value="key")
+        mock_get_package_store.return_value.exists.return_value = True
+
+        result = task.handler(request_id)
+
+        mock_get_render_engine.return_value.submit.assert_not_called()
+        mock_get_package_store.return_value.put.assert_not_called()
+        assert mock_inst.package_hash == "key"
+        mock_inst.complete_package.assert_called_once()
+        assert result == "key"
 
     def test_post_handler__not_success(self, mocker, mock_EmailTask, task):
         patched_task = mocker.MagicMock(wraps=task, success=False)
@@ -381,3 +645,276 @@ class TestPackageTask:
         mock_EmailTask.assert_called_once_with(request_id, patched_task.result)
         mock_email = mock_EmailTask.return_value
         mock_email.run.assert_called_once()
+
+
+class TestPackagePipeline:
+    @pytest.fixture
+    def task(self, request_id) -> PackagePipeline:
+        return PackagePipeline(request_id)
+
+    @pytest.fixture
+    def mock_load_checkpoint(self, mocker, task):
+        return mocker.patch.object(task, "load_checkpoint", return_value={})
+
+    def test_task(self, request_id, task):
+        assert task.group == "vital-records"
+        assert task.name == "package-pipeline"
+        assert task.queue == "requests"
+        assert task.stages == ("package", "email")
+        # not queued along with a package task for the same request
+        assert task.get_dedup_key(request_id=request_id) == PackageTask.get_dedup_key(request_id=request_id)
+        assert task.kwargs["request_id"] == request_id
+        assert task.started is False
+
+    def test_handler(self, request_id, mock_PackageTask, mock_EmailTask, mock_load_checkpoint, task):
+        mock_PackageTask.return_value.handler.return_value = "key"
+        mock_EmailTask.return_value.handler.return_value = {"office": 1, "requestor": 1}
+
+        result = task.handler(request_id=request_id)
+
+        mock_PackageTask.assert_called_once_with(request_id)
+        mock_PackageTask.return_value.handler.assert_called_once_with(request_id)
+        mock_EmailTask.assert_called_once_with(request_id, "key")
+        mock_EmailTask.return_value.handler.assert_called_once_with(request_id, "key")
+        assert result == {"package": "key", "email": {"office": 1, "requestor": 1}}
+
+    def test_handler__packaged(self, request_id, mock_PackageTask, mock_EmailTask, mock_load_checkpoint, task):
+        mock_load_checkpoint.return_value = {"package": "key"}
+
+        result = task.handler(request_id=request_id)
+
+        mock_PackageTask.assert_not_called()
+        mock_EmailTask.assert_called_once_with(request_id, "key")
+        assert result["email"] == mock_EmailTask.return_value.handler.return_value
+
+    @pytest.mark.django_db
+    def test_load_checkpoint(self, task):
+        request = VitalRecordsRequest.objects.create(status="packaged", package_hash="key")
+
+        assert task.load_checkpoint(request_id=request.id) == {"package": "key"}
+
+    @pytest.mark.django_db
+    def test_load_checkpoint__enqueued(self, task):
+        request = VitalRecordsRequest.objects.create(status="enqueued")
+
+        assert task.load_checkpoint(request_id=request.id) == {}
+
+    def test_post_handler__not_success(self, mocker, mock_EmailTask, task):
+        patched_task = mocker.MagicMock(wraps=task, success=False)
+
+        task.post_handler(patched_task)
+
+        mock_EmailTask.assert_not_called()
+
+    def test_post_handler__success(self, mocker, mock_EmailTask, task):
+        patched_task = mocker.MagicMock(
+            wraps=task, success=True, result={"package": "key", "email": {"office": 1, "requestor": 1}}
+        )
+
+        task.post_handler(patched_task)
+
+        mock_EmailTask.assert_not_called()
+
+    def test_post_handler__retry(self, mocker, request_id, mock_EmailTask, task):
+        patched_task = mocker.MagicMock(
+            wraps=task, success=True, result={"package": "key", "email": {"office": 0, "requestor": 1}}
+        )
+
+        task.post_handler(patched_task)
+
+        mock_EmailTask.assert_called_once_with(request_id, "key", recipients=["office"], attempt=2)
+        mock_EmailTask.return_value.run.assert_called_once()
+
+    def test_post_handler__no_retries(self, mocker, settings, mock_EmailTask, task):
+        settings.VITAL_RECORDS_EMAIL_RETRIES = 0
+        patched_task = mocker.MagicMock(
+            wraps=task, success=True, result={"package": "key", "email": {"office": 0, "requestor": 1}}
+        )
+
+        task.post_handler(patched_task)
+
+        mock_EmailTask.assert_not_called()
+
+
+class TestBatchPackageTask:
+    @pytest.fixture
+    def task(self) -> BatchPackageTask:
+        return BatchPackageTask(batch_size=2)
+
+    @pytest.fixture
+    def mock_VitalRecordsRequest(self, mock_VitalRecordsRequest):
+        mock_VitalRecordsRequest.get_exhausted.return_value = []
+        return mock_VitalRecordsRequest
+
+    @pytest.fixture
+    def mock_create_documents(self, mocker):
+        return mocker.patch(
+            "web.vital_records.tasks.package.create_documents",
+            side_effect=lambda request_type, row: ({"RegFirstName": row["id"]}, {}),
+        )
+
+    @pytest.fixture
+    def mock_render_package(self, mocker):
+        return mocker.patch("web.vital_records.tasks.package.render_package")
+
+    @pytest.fixture(autouse=True)
+    def mock_get_package_key(self, mocker):
+        return mocker.patch(
+            "web.vital_records.tasks.package.get_package_key",
+            side_effect=lambda request_type, request_id, application, sworn_statement: f"package-{request_id}",
+        )
+
+    @pytest.fixture
+    def mock_save_package(self, mocker, mock_get_package_store):
+        return mocker.patch("web.vital_records.tasks.package.save_package", side_effect=lambda key, *args: key)
+
+    def test_task(self, task):
+        assert task.group == "vital-records"
+        assert task.name == "package-batch"
+        assert task.kwargs["batch_size"] == 2
+        assert task.started is False
+
+    def test_task__default_batch_size(self, settings):
+        settings.VITAL_RECORDS_PACKAGE_BATCH_SIZE = 25
+
+        assert BatchPackageTask().kwargs["batch_size"] == 25
+
+    def test_handler(
+        self,
+        db,
+        mocker,
+        settings,
+        mock_VitalRecordsRequest,
+        mock_create_documents,
+        mock_render_package,
+        mock_save_package,
+        task,
+    ):
+        requests = [
+            {"id": "one", "type": "birth", "package_attempts": 1},
+            {"id": "two", "type": "death", "package_attempts": 1},
+        ]
+        mock_VitalRecordsRequest.claim_enqueued.return_value = requests
+
+        result = task.handler(batch_size=2)
+
+        mock_VitalRecordsRequest.claim_enqueued.assert_called_once_with(
+            2, fields=PACKAGE_FIELDS, max_attempts=3, lease=datetime.timedelta(seconds=settings.Q_CLUSTER["timeout"])
+        )
+        mock_create_documents.assert_has_calls([mocker.call("birth", requests[0]), mocker.call("death", requests[1])])
+        assert mock_render_package.call_count == 2
+        assert mock_save_package.call_count == 2
+        mock_VitalRecordsRequest.complete_package_many.assert_called_once_with({"one": "package-one", "two": "package-two"})
+        assert result == [("one", "package-one"), ("two", "package-two")]
+
+    def test_handler__already_stored(
+        self,
+        db,
+        mocker,
+        mock_VitalRecordsRequest,
+        mock_create_documents,
+        mock_render_package,
+        mock_save_package,
+        mock_get_package_store,
+        task,
+    ):
+        requests = [
+            {"id": "stored", "type": "birth", "package_attempts": 1},
+            {"id": "new", "type": "death", "package_attempts": 1},
+        ]
+        mock_VitalRecordsRequest.claim_enqueued.return_value = requests
+        mock_get_package_store.return_value.exists.side_effect = [True, False]
+
+        result = task.handler(batch_size=2)
+
+        mock_render_package.assert_called_once_with("death", {"RegFirstName": "new"}, {})
+        mock_save_package.assert_called_once_with("package-new", mock_render_package.return_value)
+        assert result == [("stored", "package-stored"), ("new", "package-new")]
+
+    def test_handler__independent_failures(
+        self, db, mocker, mock_VitalRecordsRequest, mock_create_documents, mock_render_package, mock_save_package, task
+    ):
+        requests = [
+            {"id": "bad", "type": "birth", "package_attempts": 1},
+            {"id": "good", "type": "death", "package_attempts": 1},
+        ]
+        mock_VitalRecordsRequest.claim_enqueued.return_value = requests
+        mock_create_documents.side_effect = [ValueError("bad record"), ({"RegFirstName": "good"}, {})]
+
+        result = task.handler(batch_size=2)
+
+        mock_VitalRecordsRequest.complete_package_many.assert_called_once_with({"good": "package-good"})
+        assert result == [("good", "package-good")]
+
+    def test_handler__independent_render_failures(
+        self, db, mocker, mock_VitalRecordsRequest, mock_create_documents, mock_render_package, mock_save_package, task
+    ):
+        requests = [
+            {"id": "good", "type": "birth", "package_attempts": 1},
+            {"id": "timeout", "type": "death", "package_attempts": 1},
+        ]
+        mock_VitalRecordsRequest.claim_enqueued.return_value = requests
+        mock_save_package.side_effect = ["package-good", TimeoutError()]
+
+        result = task.handler(batch_size=2)
+
+        mock_VitalRecordsRequest.complete_package_many.assert_called_once_with({"good": "package-good"})
+        assert result == [("good", "package-good")]
+
+    def test_handler__give_up(
+        self, db, mocker, mock_VitalRecordsRequest, mock_create_documents, mock_render_package, mock_save_package, task
+    ):
+        mock_VitalRecordsRequest.claim_enqueued.return_value = [{"id": "bad", "type": "birth", "package_attempts": 3}]
+        mock_create_documents.side_effect = ValueError("bad record")
+        mock_logger = mocker.patch("web.vital_records.tasks.package.logger")
+
+        result = task.handler(batch_size=2)
+
+        assert result == []
+        mock_logger.error.assert_called_once_with("Giving up packaging: bad after 3 attempts")
+        # moved to failed, rather than left enqueued
+        assert mock_VitalRecordsRequest.fail_package_many.call_args_list == [mocker.call([]), mocker.call(["bad"])]
+
+    def test_handler__exhausted(self, db, mocker, mock_create_documents, mock_render_package, mock_save_package, task):
+        past = timezone.now() - datetime.timedelta(minutes=1)
+        # its task was stopped on the last attempt
+        stalled = VitalRecordsRequest.objects.create(status="enqueued", package_attempts=3, package_claimed_until=past)
+        # another task is on its last attempt
+        VitalRecordsRequest.objects.create(
+            status="enqueued", package_attempts=3, package_claimed_until=timezone.now() + datetime.timedelta(minutes=1)
+        )
+        mock_logger = mocker.patch("web.vital_records.tasks.package.logger")
+
+        assert task.handler(batch_size=2) == []
+
+        stalled.refresh_from_db()
+        assert stalled.status == "failed"
+        mock_logger.error.assert_called_once_with(f"Giving up packaging: {stalled.id} after 3 attempts")
+        assert VitalRecordsRequest.objects.filter(status="enqueued").count() == 1
+
+    def test_handler__empty(
+        self, db, mock_VitalRecordsRequest, mock_create_documents, mock_render_package, mock_save_package, task
+    ):
+        mock_VitalRecordsRequest.claim_enqueued.return_value = []
+
+        result = task.handler(batch_size=2)
+
+        mock_create_documents.assert_not_called()
+        mock_VitalRecordsRequest.complete_package_many.assert_called_once_with({})
+        assert result == []
+
+    def test_post_handler__not_success(self, mocker, mock_EmailTask, task):
+        patched_task = mocker.MagicMock(wraps=task, success=False)
+
+        task.post_handler(patched_task)
+
+        mock_EmailTask.assert_not_called()
+
+    def test_post_handler__success(self, mocker, mock_EmailTask, task):
+        patched_task = mocker.MagicMock(wraps=task, success=True, result=[("one", "package-one"), ("two", "package-two")])
+
+        task.post_handler(patched_task)
+
+        mock_EmailTask.assert_has_calls(
+            [mocker.call("one", "package-one"), mocker.call().run(), mocker.call("two", "package-two"), mocker.call().run()]
+        )
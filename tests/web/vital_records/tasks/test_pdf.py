@@ -0,0 +1,477 @@
+from io import BytesIO
+import mmap
+import os
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import NameObject, StreamObject, TextStringObject
+
+from web.vital_records.tasks.pdf import (
+    OPTIMIZE_COMPACT,
+    OPTIMIZE_COMPRESS,
+    OPTIMIZE_NONE,
+    FieldIndex,
+    IncrementalUpdate,
+    TemplateCache,
+    TextStreamAppearance,
+    _consecutive,
+    _field_name,
+    _objects,
+    _replace_object,
+    _startxref,
+    optimize,
+    render,
+)
+from web.vital_records.tasks.package import SWORNSTATEMENT_TEMPLATE, get_application_template
+
+
+@pytest.fixture
+def template_file(tmp_path):
+    path = tmp_path / "template.pdf"
+    with open(SWORNSTATEMENT_TEMPLATE, "rb") as src:
+        path.write_bytes(src.read())
+    return str(path)
+
+
+@pytest.fixture
+def cache():
+    return TemplateCache()
+
+
+@pytest.fixture
+def spy_PdfReader(mocker):
+    return mocker.patch("web.vital_records.tasks.pdf.PdfReader", wraps=PdfReader)
+
+
+def _values(page):
+    """Field name to value, for the widget annotations on page."""
+    values = {}
+    for annotation in page["/Annots"]:
+        annotation = annotation.get_object()
+        field = annotation if "/T" in annotation else annotation["/Parent"].get_object()
+        values[field["/T"]] = field.get("/V")
+    return values
+
+
+class TestFieldIndex:
+    @pytest.fixture
+    def reader(self, template_file):
+        return PdfReader(template_file)
+
+    def test_init(self, reader):
+        index = FieldIndex(reader.pages[0])
+
+        assert "applicantName" in index
+        assert "notarySignature" not in index
+        assert len(index.fields) == 14
+        for name, positions in index.fields.items():
+            for position in positions:
+                assert _field_name(reader.pages[0]["/Annots"][position].get_object()) == name
+
+    def test_init__radio_group(self):
+        reader = PdfReader(get_application_template("birth"))
+
+        index = FieldIndex(reader.pages[0])
+
+        # radio buttons are widgets with a named parent field
+        assert len(index.fields["RelationshipToRegistrant"]) > 1
+        assert len(index.fields["CopyType"]) > 1
+
+    def test_unknown(self, reader):
+        index = FieldIndex(reader.pages[0])
+
+        assert index.unknown(["applicantName", "notarySignature", "package_id"]) == {"notarySignature", "package_id"}
+
+    def test_fill(self, reader):
+        index = FieldIndex(reader.pages[0])
+        writer = PdfWriter()
+        writer.append(reader)
+
+        index.fill(writer, writer.pages[0], {"applicantName": "Jane Doe", "city": "Los Angeles", "unknown": "ignored"})
+
+        values = _values(writer.pages[0])
+        assert values["applicantName"] == "Jane Doe"
+        assert values["city"] == "Los Angeles"
+        assert "unknown" not in values
+
+    def test_fill__radio_group(self):
+        reader = PdfReader(get_application_template("death"))
+        index = FieldIndex(reader.pages[0])
+        writer = PdfWriter()
+        writer.append(reader)
+
+        index.fill(writer, writer.pages[0], {"RelationshipToRegistrant": "/6"})
+
+        states = [
+            writer.pages[0]["/Annots"][position].get_object()["/AS"] for position in index.fields["RelationshipToRegistrant"]
+        ]
+        assert states.count("/6") == 1
+        assert all(state in ("/6", "/Off") for state in states)
+
+    def test_fill__annotations_reordered(self, reader):
+        index = FieldIndex(reader.pages[0])
+        writer = PdfWriter()
+        writer.append(reader)
+        writer.pages[0]["/Annots"].reverse()
+
+        index.fill(writer, writer.pages[0], {"applicantName": "Jane Doe"})
+
+        assert _values(writer.pages[0])["applicantName"] == "Jane Doe"
+
+    def test_fill__annotation_removed(self, reader):
+        index = FieldIndex(reader.pages[0])
+        writer = PdfWriter()
+        writer.append(reader)
+        del writer.pages[0]["/Annots"][index.fields["day"][0]]
+
+        index.fill(writer, writer.pages[0], {"applicantName": "Jane Doe", "city": "Los Angeles"})
+
+        values = _values(writer.pages[0])
+        assert values["applicantName"] == "Jane Doe"
+        assert values["city"] == "Los Angeles"
+
+    def test_fill__checks_filled_fields_only(self, mocker, reader):
+        index = FieldIndex(reader.pages[0])
+        writer = PdfWriter()
+        writer.append(reader)
+        spy_field_name = mocker.patch("web.vital_records.tasks.pdf._field_name", wraps=_field_name)
+
+        index.fill(writer, writer.pages[0], {"applicantName": "Jane Doe"})
+
+        # just the filled field's annotation, rather than every field on the page
+        assert spy_field_name.call_count == len(index.fields["applicantName"])
+
+
+class TestTemplateCache:
+    def test_get__parses_once(self, cache, template_file, spy_PdfReader):
+        first = cache.get(template_file)
+        second = cache.get(template_file)
+
+        assert first is second
+        assert first.path == template_file
+        assert len(first.digest) == 64
+        assert len(first.indexes) == 1
+        assert "applicantName" in first.indexes[0]
+        spy_PdfReader.assert_called_once()
+
+    def test_get__mtime_changed_same_contents(self, cache, template_file, spy_PdfReader):
+        first = cache.get(template_file)
+        stat = os.stat(template_file)
+        os.utime(template_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        second = cache.get(template_file)
+
+        assert first is second
+        assert second.mtime_ns == stat.st_mtime_ns + 1_000_000_000
+        spy_PdfReader.assert_called_once()
+
+    def test_get__contents_changed(self, cache, template_file, spy_PdfReader):
+        first = cache.get(template_file)
+        with open(template_file, "ab") as f:
+            f.write(b"\n% appended\n")
+
+        second = cache.get(template_file)
+
+        assert first is not second
+        assert first.digest != second.digest
+        assert spy_PdfReader.call_count == 2
+
+    def test_get__mapped(self, cache, template_file):
+        template = cache.get(template_file)
+
+        assert isinstance(template.data, mmap.mmap)
+        assert template.reader.stream is template.data
+        with open(template_file, "rb") as f:
+            assert template.data[:] == f.read()
+
+    def test_get__mapped_file_replaced(self, cache, template_file, tmp_path):
+        first = cache.get(template_file)
+        with open(template_file, "rb") as f:
+            data = f.read()
+        replacement = tmp_path / "replacement.pdf"
+        replacement.write_bytes(data + b"\n% replaced\n")
+        os.replace(replacement, template_file)
+
+        second = cache.get(template_file)
+
+        assert first is not second
+        # the old mapping still has the old contents, for as long as the old template is held
+        assert first.data[:] == data
+        assert "applicantName" in first.reader.get_fields()
+
+        old_data = first.data
+        del first
+        # then it's closed, rather than left to the cycle collector
+        assert old_data.closed
+        assert not second.data.closed
+
+    def test_map__empty_file(self, tmp_path):
+        path = tmp_path / "empty.pdf"
+        path.write_bytes(b"")
+
+        assert TemplateCache._map(str(path)) == b""
+
+    def test_get__missing_file(self, cache, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            cache.get(str(tmp_path / "missing.pdf"))
+
+    def test_writer__independent_copies(self, cache, template_file):
+        writer_1 = cache.writer(template_file, template_file)
+        writer_2 = cache.writer(template_file)
+
+        assert isinstance(writer_1, PdfWriter)
+        assert len(writer_1.pages) == 2
+        assert len(writer_2.pages) == 1
+
+        writer_1.update_page_form_field_values(writer_1.pages[0], {"applicantName": "Filled"}, auto_regenerate=False)
+
+        assert writer_2.get_fields()["applicantName"].get("/V") != "Filled"
+        assert cache.get(template_file).reader.get_fields()["applicantName"].get("/V") != "Filled"
+
+    def test_indexes(self, cache, template_file):
+        indexes = cache.indexes(template_file, template_file)
+
+        assert indexes == cache.get(template_file).indexes * 2
+
+    def test_clear(self, cache, template_file, spy_PdfReader):
+        cache.get(template_file)
+        cache.clear()
+        cache.get(template_file)
+
+        assert spy_PdfReader.call_count == 2
+
+    def test_clear__closes_mapping(self, cache, template_file):
+        data = cache.get(template_file).data
+
+        cache.clear()
+
+        assert data.closed
+
+
+def test_render(template_file):
+    data = render([template_file], [{"applicantName": "Jane Doe", "city": "Los Angeles"}])
+
+    reader = PdfReader(BytesIO(data))
+    fields = reader.get_fields()
+    assert fields["applicantName"]["/V"] == "Jane Doe"
+    assert fields["city"]["/V"] == "Los Angeles"
+
+
+def test_render__pages(template_file):
+    data = render([template_file, template_file], [{}, {"applicantName": "Page 2"}])
+
+    reader = PdfReader(BytesIO(data))
+    assert len(reader.pages) == 2
+    annotations = [a.get_object() for a in reader.pages[1]["/Annots"]]
+    assert any(a.get("/V") == "Page 2" for a in annotations)
+
+
+def _filled(*paths):
+    cache = TemplateCache()
+    writer = cache.writer(*paths)
+    for page, index in zip(writer.pages, cache.indexes(*paths)):
+        index.fill(writer, page, {"applicantName": "Jane Doe", "RequestorFirstName": "Jane"})
+    return writer
+
+
+def _written(writer):
+    stream = BytesIO()
+    writer.write(stream)
+    return stream.getvalue()
+
+
+@pytest.mark.parametrize("level", [OPTIMIZE_NONE, OPTIMIZE_COMPRESS, OPTIMIZE_COMPACT])
+def test_optimize(level):
+    paths = (get_application_template("birth"), SWORNSTATEMENT_TEMPLATE)
+    unoptimized = len(_written(_filled(*paths)))
+    writer = _filled(*paths)
+
+    saved = optimize(writer, level)
+
+    data = _written(writer)
+    if level == OPTIMIZE_NONE:
+        assert saved == 0
+        assert len(data) == unoptimized
+    else:
+        assert saved > 0
+        assert len(data) < unoptimized
+        # an estimate, ignoring the cross-reference table
+        assert saved == pytest.approx(unoptimized - len(data), rel=0.1)
+
+    reader = PdfReader(BytesIO(data))
+    assert len(reader.pages) == 2
+    assert reader.get_fields()["applicantName"]["/V"] == "Jane Doe"
+    assert reader.get_fields()["RequestorFirstName"]["/V"] == "Jane"
+
+
+def test_optimize__compact_saves_more():
+    paths = (get_application_template("death"), SWORNSTATEMENT_TEMPLATE)
+
+    assert optimize(_filled(*paths), OPTIMIZE_COMPACT) > optimize(_filled(*paths), OPTIMIZE_COMPRESS)
+
+
+def test_render__optimization(mocker, caplog, template_file):
+    mock_optimize = mocker.patch("web.vital_records.tasks.pdf.optimize", return_value=100_000)
+
+    with caplog.at_level("INFO", logger="web.vital_records.tasks.pdf"):
+        data = render([template_file], [{}], OPTIMIZE_COMPACT)
+
+    mock_optimize.assert_called_once_with(mocker.ANY, OPTIMIZE_COMPACT)
+    assert f"Optimized package at level 2, saved 100000 of {len(data) + 100_000} bytes" in caplog.text
+
+
+def test_render__optimization_trivial(mocker, caplog, template_file):
+    mocker.patch("web.vital_records.tasks.pdf.optimize", return_value=1)
+
+    with caplog.at_level("INFO", logger="web.vital_records.tasks.pdf"):
+        render([template_file], [{}], OPTIMIZE_COMPRESS)
+
+    assert "Optimized package" not in caplog.text
+
+
+def test_render__no_optimization(mocker, template_file):
+    mock_optimize = mocker.patch("web.vital_records.tasks.pdf.optimize")
+
+    render([template_file], [{}])
+
+    mock_optimize.assert_not_called()
+
+
+@pytest.fixture
+def base_package(tmp_path):
+    path = tmp_path / "package_birth.pdf"
+    TemplateCache().writer(get_application_template("birth"), SWORNSTATEMENT_TEMPLATE).write(str(path))
+    return str(path)
+
+
+def test_pypdf_internals(template_file):
+    """The pypdf internals used to fill and optimize packages, which aren't public API and can change in any release.
+
+    If this fails after upgrading pypdf, update `pdf.py` for the new release before changing the pin in pyproject.toml.
+    """
+    writer = PdfWriter(clone_from=template_file)
+
+    # every object, at the index of its object number - 1
+    objects = _objects(writer)
+    assert objects
+    assert all(obj is None or obj.indirect_reference.idnum == i + 1 for i, obj in enumerate(objects))
+
+    # replacing an object keeps its object number
+    stream = next(obj for obj in objects if isinstance(obj, StreamObject))
+    reference = stream.indirect_reference
+    encoded = stream.flate_encode(level=9)
+    _replace_object(writer, stream, encoded)
+    assert writer.get_object(reference) is encoded
+    assert _objects(writer)[reference.idnum - 1] is encoded
+
+    # an appearance stream for a text field's widget, from the field's value
+    widget = next(a.get_object() for a in writer.pages[0]["/Annots"] if a.get_object().get("/FT") == "/Tx")
+    widget[NameObject("/V")] = TextStringObject("Jane Doe")
+    appearance = TextStreamAppearance.from_text_annotation(writer.root_object["/AcroForm"], widget, widget)
+    assert isinstance(appearance, StreamObject)
+    assert b"Jane Doe" in appearance.get_data()
+
+
+def test_consecutive():
+    assert _consecutive([1, 2, 3, 7, 9, 10]) == [[1, 2, 3], [7], [9, 10]]
+    assert _consecutive([]) == []
+
+
+def test_startxref(base_package):
+    with open(base_package, "rb") as f:
+        data = f.read()
+
+    assert data.startswith(b"xref", _startxref(data))
+
+
+class TestIncrementalUpdate:
+    @pytest.fixture
+    def template(self, cache, base_package):
+        return cache.get(base_package)
+
+    @pytest.fixture
+    def update(self, template):
+        return IncrementalUpdate(template)
+
+    def _read(self, update):
+        stream = BytesIO()
+        update.write(stream)
+        return stream.getvalue(), PdfReader(stream)
+
+    def test_supports(self, cache, template):
+        assert IncrementalUpdate.supports(template)
+        # uses a cross-reference stream
+        assert not IncrementalUpdate.supports(cache.get(SWORNSTATEMENT_TEMPLATE))
+
+    def test_fill(self, update, template):
+        update.fill(0, {"RegFirstName": "Jane (J)", "NumberOfCopies": 2, "RelationshipToRegistrant": "/1"})
+        update.fill(1, {"city": "Los Angeles", "notarySignature": "unknown field"})
+
+        data, reader = self._read(update)
+
+        # the template is unchanged, only new objects are appended
+        assert data.startswith(template.data)
+        assert len(data) - len(template.data) < 20_000
+        fields = reader.get_fields()
+        assert fields["RegFirstName"]["/V"] == "Jane (J)"
+        assert fields["NumberOfCopies"]["/V"] == "2"
+        assert fields["RelationshipToRegistrant"]["/V"] == "/1"
+        assert fields["city"]["/V"] == "Los Angeles"
+        assert "/V" not in fields["RegLastName"]
+        assert len(reader.pages) == 2
+
+    def test_fill__appearances(self, update):
+        update.fill(0, {"RegFirstName": "Jane", "RelationshipToRegistrant": "/1"})
+
+        _, reader = self._read(update)
+
+        for annotation in reader.pages[0]["/Annots"]:
+            annotation = annotation.get_object()
+            name = _field_name(annotation)
+            if name == "RegFirstName":
+                assert b"(Jane) Tj" in annotation["/AP"]["/N"].get_data()
+            elif name == "RelationshipToRegistrant":
+                assert annotation["/AS"] in ("/1", "/Off")
+                assert (annotation["/AS"] == "/1") == ("/1" in annotation["/AP"]["/N"])
+
+    def test_fill__compressed_appearances(self, template):
+        update = IncrementalUpdate(template, OPTIMIZE_COMPRESS)
+        update.fill(0, {"RegFirstName": "Jane"})
+
+        appearances = [obj for _, obj in update.objects.values() if "/BBox" in obj]
+        assert len(appearances) == 1
+        assert appearances[0]["/Filter"] == "/FlateDecode"
+
+    def test_write__no_changes(self, update, template):
+        data, reader = self._read(update)
+
+        assert data.startswith(template.data)
+        assert len(reader.pages) == 2
+
+    def test_write__file(self, update, tmp_path):
+        update.fill(1, {"applicantName": "Jane Doe"})
+        filename = tmp_path / "filled.pdf"
+
+        with open(filename, "wb") as f:
+            update.write(f)
+
+        assert PdfReader(filename).get_fields()["applicantName"]["/V"] == "Jane Doe"
+
+
+def test_render__incremental(mocker, base_package):
+    spy_writer = mocker.spy(TemplateCache, "writer")
+
+    data = render([base_package], [{"RegFirstName": "Jane"}, {"city": "Los Angeles"}], incremental=True)
+
+    spy_writer.assert_not_called()
+    fields = PdfReader(BytesIO(data)).get_fields()
+    assert fields["RegFirstName"]["/V"] == "Jane"
+    assert fields["city"]["/V"] == "Los Angeles"
+
+
+def test_render__incremental_not_supported(caplog, template_file):
+    with caplog.at_level("WARNING", logger="web.vital_records.tasks.pdf"):
+        data = render([template_file], [{"applicantName": "Jane Doe"}], incremental=True)
+
+    assert "Template doesn't support incremental updates" in caplog.text
+    assert PdfReader(BytesIO(data)).get_fields()["applicantName"]["/V"] == "Jane Doe"
@@ -0,0 +1,58 @@
+import datetime
+
+import pytest
+
+from web.vital_records.tasks.schema import Schema, Source, const, date, join
+
+
+@pytest.fixture
+def schema():
+    return Schema(
+        "Application",
+        {
+            "FormType": const("FORM"),
+            "FirstName": "first_name",
+            "Name": join("first_name", "last_name"),
+            "DOB": date("date_of_birth"),
+            "Initial": Source("first_name", func=lambda first_name: first_name[0]),
+        },
+    )
+
+
+@pytest.fixture
+def row():
+    return {"first_name": "Jane", "last_name": "Doe", "date_of_birth": datetime.date(1990, 9, 22)}
+
+
+def test_source__no_func():
+    with pytest.raises(ValueError):
+        Source("first_name", "last_name")
+
+
+def test_schema(schema):
+    assert schema.name == "Application"
+    assert schema.names == ("FormType", "FirstName", "Name", "DOB", "Initial")
+    assert schema.fields == ("first_name", "last_name", "date_of_birth")
+
+
+def test_fill__row(schema, row):
+    assert schema.fill(row) == {
+        "FormType": "FORM",
+        "FirstName": "Jane",
+        "Name": "Jane Doe",
+        "DOB": "09/22/1990",
+        "Initial": "J",
+    }
+
+
+def test_fill__instance(mocker, schema, row):
+    assert schema.fill(mocker.Mock(**row)) == schema.fill(row)
+
+
+def test_fill__empty_values(schema):
+    assert schema.fill({"first_name": "Jane", "last_name": "", "date_of_birth": None}) == {
+        "FormType": "FORM",
+        "FirstName": "Jane",
+        "Name": "Jane",
+        "Initial": "J",
+    }
@@ -0,0 +1,173 @@
+from datetime import timedelta
+import os
+from uuid import uuid4
+
+from django.utils import timezone
+import pytest
+
+from web.vital_records.models import StoredPackage
+from web.vital_records.tasks.store import DatabasePackageStore, PackageStore, get_package_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PackageStore(str(tmp_path / "packages"))
+
+
+def test_key():
+    key = PackageStore.key(["digest"], [{"b": 2, "a": 1}, {}], 1)
+
+    assert len(key) == 64
+    # independent of field order
+    assert key == PackageStore.key(["digest"], [{"a": 1, "b": 2}, {}], 1)
+    assert key != PackageStore.key(["other-digest"], [{"a": 1, "b": 2}, {}], 1)
+    assert key != PackageStore.key(["digest"], [{"a": 1, "b": 3}, {}], 1)
+    assert key != PackageStore.key(["digest"], [{}, {"a": 1, "b": 2}], 1)
+    assert key != PackageStore.key(["digest"], [{"a": 1, "b": 2}, {}], 2)
+    assert key != PackageStore.key(["digest"], [{"a": 1, "b": 2}, {}], 1, request_id=uuid4())
+
+
+def test_path(store):
+    assert store.path("abc123") == os.path.join(store.directory, "abc123.pdf")
+
+
+def test_put(store):
+    store.put("abc123", b"%PDF")
+
+    assert store.exists("abc123")
+    assert os.listdir(store.directory) == ["abc123.pdf"]
+    with open(store.path("abc123"), "rb") as f:
+        assert f.read() == b"%PDF"
+
+
+def test_put__replaces(store):
+    store.put("abc123", b"old")
+    store.put("abc123", b"new")
+
+    with open(store.path("abc123"), "rb") as f:
+        assert f.read() == b"new"
+
+
+def test_exists__missing(store):
+    assert not store.exists("abc123")
+
+
+def test_local_file(store):
+    store.put("abc123", b"%PDF")
+
+    with store.local_file("abc123") as filename:
+        assert filename == store.path("abc123")
+
+    # the stored file itself, kept until the package is cleaned up
+    assert os.path.isfile(store.path("abc123"))
+
+
+def test_get_package_store(settings):
+    settings.VITAL_RECORDS_PACKAGE_STORE_DIR = "/store"
+
+    store = get_package_store()
+
+    assert type(store) is PackageStore
+    assert store.directory == "/store"
+
+
+def test_get_package_store__shared(settings):
+    settings.VITAL_RECORDS_PACKAGE_STORE_DIR = "/store"
+    settings.VITAL_RECORDS_PACKAGE_STORE_SHARED = True
+    settings.VITAL_RECORDS_PACKAGE_STORE_TTL = 60
+
+    store = get_package_store()
+
+    assert isinstance(store, DatabasePackageStore)
+    assert store.directory == "/store"
+    assert store.ttl == 60
+
+
+@pytest.mark.django_db
+class TestDatabasePackageStore:
+    @pytest.fixture
+    def store(self, tmp_path):
+        return DatabasePackageStore(str(tmp_path / "packages"), ttl=60)
+
+    @pytest.fixture
+    def other_node(self, tmp_path):
+        """The store as seen from another node, with its own directory."""
+        return DatabasePackageStore(str(tmp_path / "other"), ttl=60)
+
+    def test_put(self, store):
+        store.put("abc123", b"%PDF")
+
+        stored = StoredPackage.objects.get(key="abc123")
+        assert bytes(stored.data) == b"%PDF"
+        assert stored.expires_at > timezone.now() + timedelta(seconds=50)
+        # only in the database, where the cleanup task deletes it
+        assert not os.path.exists(store.directory)
+
+    def test_put__replaces(self, store):
+        store.put("abc123", b"old")
+        store.put("abc123", b"new")
+
+        assert bytes(StoredPackage.objects.get(key="abc123").data) == b"new"
+
+    def test_exists(self, store, other_node):
+        assert not other_node.exists("abc123")
+
+        store.put("abc123", b"%PDF")
+
+        assert other_node.exists("abc123")
+
+    def test_exists__expired(self, store):
+        store.put("abc123", b"%PDF")
+        StoredPackage.objects.update(expires_at=timezone.now())
+
+        assert not store.exists("abc123")
+
+    def test_local_file(self, store, other_node):
+        store.put("abc123", b"%PDF")
+
+        with other_node.local_file("abc123") as filename:
+            with open(filename, "rb") as f:
+                assert f.read() == b"%PDF"
+            assert os.stat(filename).st_mode & 0o077 == 0
+
+        # a temporary copy, rather than one kept on the node that the cleanup task can't reach
+        assert not os.path.exists(filename)
+        assert not os.path.exists(other_node.directory)
+
+    def test_local_file__error(self, store):
+        store.put("abc123", b"%PDF")
+
+        with pytest.raises(RuntimeError):
+            with store.local_file("abc123") as filename:
+                raise RuntimeError("send failed")
+
+        assert not os.path.exists(filename)
+
+    def test_local_file__missing(self, store):
+        with pytest.raises(FileNotFoundError):
+            with store.local_file("abc123"):
+                pass
+
+    def test_local_file__expired(self, store, other_node):
+        store.put("abc123", b"%PDF")
+        StoredPackage.objects.update(expires_at=timezone.now())
+
+        with pytest.raises(FileNotFoundError):
+            with other_node.local_file("abc123"):
+                pass
+
+    def test_discard(self, store):
+        store.put("abc123", b"%PDF")
+        store.put("def456", b"%PDF")
+
+        store.discard("abc123")
+
+        assert list(StoredPackage.objects.values_list("key", flat=True)) == ["def456"]
+
+    def test_purge(self, store):
+        store.put("abc123", b"%PDF")
+        store.put("def456", b"%PDF")
+        StoredPackage.objects.filter(key="abc123").update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        assert store.purge() == 1
+        assert list(StoredPackage.objects.values_list("key", flat=True)) == ["def456"]
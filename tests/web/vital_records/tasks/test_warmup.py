@@ -0,0 +1,72 @@
+import pytest
+
+from django_q.signals import post_spawn
+
+from web.vital_records.tasks.package import get_package_templates
+from web.vital_records.tasks.warmup import on_worker_spawn, warm_up
+
+
+@pytest.fixture
+def mock_warm_up(mocker):
+    return mocker.patch("web.vital_records.tasks.warmup.warm_up")
+
+
+@pytest.fixture
+def mock_get_render_engine(mocker):
+    return mocker.patch("web.vital_records.tasks.warmup.get_render_engine")
+
+
+@pytest.fixture
+def mock_email_bodies(mocker):
+    return mocker.patch("web.vital_records.tasks.warmup.email_bodies")
+
+
+@pytest.mark.django_db
+def test_warm_up(mocker, mock_get_render_engine, mock_email_bodies):
+    mock_record = mocker.patch("web.vital_records.tasks.warmup.warm_up_duration.record")
+
+    duration = warm_up()
+
+    assert duration > 0
+    mock_email_bodies.preload.assert_called_once_with()
+    engine = mock_get_render_engine.return_value
+    engine.render.assert_called_once()
+    template_paths, application, sworn_statement = engine.render.call_args.args
+    assert template_paths == get_package_templates("birth")
+    assert application["CDPH_VR_FORMTYPE"] == "WILDFIRE_CDPH_VR_B0A6353F1"
+    assert sworn_statement == {}
+    mock_record.assert_called_once_with(duration)
+
+
+@pytest.mark.django_db
+def test_warm_up__renders(mock_email_bodies):
+    # a real render, through the cached render engine
+    assert warm_up() > 0
+
+
+def test_on_worker_spawn(mock_warm_up):
+    on_worker_spawn("django_q", proc_name="Process-1:1")
+
+    mock_warm_up.assert_called_once_with()
+
+
+def test_on_worker_spawn__disabled(settings, mock_warm_up):
+    settings.VITAL_RECORDS_WORKER_WARM_UP = False
+
+    on_worker_spawn("django_q", proc_name="Process-1:1")
+
+    mock_warm_up.assert_not_called()
+
+
+def test_on_worker_spawn__failed(caplog, mock_warm_up):
+    mock_warm_up.side_effect = Exception("no database")
+
+    on_worker_spawn("django_q", proc_name="Process-1:1")
+
+    assert "Warm up failed for worker: Process-1:1" in caplog.text
+
+
+def test_post_spawn(mock_warm_up):
+    post_spawn.send(sender="django_q", proc_name="Process-1:1")
+
+    mock_warm_up.assert_called_once_with()
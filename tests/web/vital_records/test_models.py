@@ -1,7 +1,11 @@
+from datetime import timedelta
 from uuid import uuid4
 import pytest
 
-from web.vital_records.models import VitalRecordsRequest
+from django.db import transaction
+from django.utils import timezone
+
+from web.vital_records.models import OutboundEmail, RequestSubmission, VitalRecordsRequest
 
 
 def test_get_with_status__matching_request(mocker):
@@ -50,3 +54,254 @@ def test_get_finished(db):
     assert set(finished_requests) == {finished_request1, finished_request2}
     for request in finished_requests:
         assert request.status == "finished"
+
+
+def test_claim_enqueued(db):
+    now = timezone.now()
+    oldest = VitalRecordsRequest.objects.create(status="enqueued", enqueued_at=now - timedelta(minutes=2))
+    older = VitalRecordsRequest.objects.create(status="enqueued", enqueued_at=now - timedelta(minutes=1))
+    VitalRecordsRequest.objects.create(status="enqueued", enqueued_at=now)
+    VitalRecordsRequest.objects.create(status="packaged", enqueued_at=now - timedelta(minutes=3))
+
+    claimed = VitalRecordsRequest.claim_enqueued(2)
+
+    assert claimed == [oldest, older]
+    assert [request.package_attempts for request in claimed] == [1, 1]
+    assert all(request.package_claimed_until > now for request in claimed)
+
+
+def test_claim_enqueued__fields(db):
+    request = VitalRecordsRequest.objects.create(status="enqueued", type="birth", enqueued_at=timezone.now())
+
+    claimed = VitalRecordsRequest.claim_enqueued(2, fields=("id", "type"))
+
+    assert claimed == [{"id": request.id, "type": "birth", "package_attempts": 1}]
+
+
+def test_claim_enqueued__claimed(db):
+    request = VitalRecordsRequest.objects.create(status="enqueued", enqueued_at=timezone.now())
+
+    assert VitalRecordsRequest.claim_enqueued(2, lease=timedelta(minutes=5)) == [request]
+    # still held by the first claim
+    assert VitalRecordsRequest.claim_enqueued(2) == []
+
+    VitalRecordsRequest.objects.filter(pk=request.pk).update(package_claimed_until=timezone.now())
+    assert VitalRecordsRequest.claim_enqueued(2) == [request]
+
+
+def test_claim_enqueued__fewest_attempts_first(db):
+    now = timezone.now()
+    failing = VitalRecordsRequest.objects.create(status="enqueued", enqueued_at=now - timedelta(minutes=1), package_attempts=1)
+    new = VitalRecordsRequest.objects.create(status="enqueued", enqueued_at=now)
+    VitalRecordsRequest.objects.create(status="enqueued", enqueued_at=now - timedelta(minutes=2), package_attempts=3)
+
+    claimed = VitalRecordsRequest.claim_enqueued(5, max_attempts=3)
+
+    # the request that's used up its attempts isn't claimed
+    assert claimed == [new, failing]
+
+
+def test_claim_enqueued__in_transaction(db):
+    request = VitalRecordsRequest.objects.create(status="enqueued", enqueued_at=timezone.now())
+
+    with transaction.atomic():
+        claimed = VitalRecordsRequest.claim_enqueued(2)
+
+    assert claimed == [request]
+
+
+def test_claim_sent(db):
+    now = timezone.now()
+    oldest = VitalRecordsRequest.objects.create(status="sent", sent_at=now - timedelta(minutes=2))
+    older = VitalRecordsRequest.objects.create(status="sent", sent_at=now - timedelta(minutes=1))
+    VitalRecordsRequest.objects.create(status="sent", sent_at=now)
+    VitalRecordsRequest.objects.create(status="packaged", sent_at=now - timedelta(minutes=3))
+
+    claimed = VitalRecordsRequest.claim_sent(2, lease=timedelta(minutes=10))
+
+    assert claimed == [oldest, older]
+    oldest.refresh_from_db()
+    assert oldest.bundle_claimed_until > now + timedelta(minutes=9)
+
+
+def test_claim_sent__claimed(db):
+    now = timezone.now()
+    VitalRecordsRequest.objects.create(status="sent", sent_at=now, bundle_claimed_until=now + timedelta(minutes=1))
+    expired = VitalRecordsRequest.objects.create(status="sent", sent_at=now, bundle_claimed_until=now - timedelta(seconds=1))
+
+    assert VitalRecordsRequest.claim_sent(10) == [expired]
+    # and not again until the claim runs out
+    assert VitalRecordsRequest.claim_sent(10) == []
+
+
+def test_release_sent(db):
+    request = VitalRecordsRequest.objects.create(status="sent", sent_at=timezone.now())
+    VitalRecordsRequest.claim_sent(10)
+
+    assert VitalRecordsRequest.release_sent([request.id]) == 1
+
+    assert VitalRecordsRequest.claim_sent(10) == [request]
+
+
+def test_get_exhausted(db):
+    now = timezone.now()
+    expired = VitalRecordsRequest.objects.create(
+        status="enqueued", package_attempts=3, package_claimed_until=now - timedelta(seconds=1)
+    )
+    VitalRecordsRequest.objects.create(status="enqueued", package_attempts=3, package_claimed_until=now + timedelta(minutes=1))
+    VitalRecordsRequest.objects.create(status="enqueued", package_attempts=2, package_claimed_until=now - timedelta(seconds=1))
+    VitalRecordsRequest.objects.create(status="packaged", package_attempts=3, package_claimed_until=now - timedelta(seconds=1))
+
+    assert VitalRecordsRequest.get_exhausted(3) == [expired.id]
+
+
+def test_fail_package_many(db):
+    enqueued = VitalRecordsRequest.objects.create(status="enqueued")
+    packaged = VitalRecordsRequest.objects.create(status="packaged")
+
+    count = VitalRecordsRequest.fail_package_many([enqueued.id, packaged.id])
+
+    assert count == 1
+    enqueued.refresh_from_db()
+    packaged.refresh_from_db()
+    assert enqueued.status == "failed"
+    assert enqueued.already_submitted
+    assert packaged.status == "packaged"
+
+
+def test_finish_many(db):
+    sent = VitalRecordsRequest.objects.create(status="sent")
+    packaged = VitalRecordsRequest.objects.create(status="packaged")
+    VitalRecordsRequest.objects.create(status="sent")
+
+    count = VitalRecordsRequest.finish_many([sent.id, packaged.id])
+
+    assert count == 1
+    sent.refresh_from_db()
+    packaged.refresh_from_db()
+    assert sent.status == "finished"
+    assert packaged.status == "packaged"
+    assert VitalRecordsRequest.objects.filter(status="sent").count() == 1
+
+
+def test_complete_package_many(db):
+    enqueued = VitalRecordsRequest.objects.create(status="enqueued")
+    sent = VitalRecordsRequest.objects.create(status="sent")
+    VitalRecordsRequest.objects.create(status="enqueued")
+
+    count = VitalRecordsRequest.complete_package_many({enqueued.id: "enqueued-hash", sent.id: "sent-hash"})
+
+    assert count == 1
+    enqueued.refresh_from_db()
+    sent.refresh_from_db()
+    assert enqueued.status == "packaged"
+    assert enqueued.packaged_at is not None
+    assert enqueued.package_hash == "enqueued-hash"
+    assert sent.status == "sent"
+    assert sent.package_hash == ""
+    assert VitalRecordsRequest.objects.filter(status="enqueued").count() == 1
+
+
+def test_complete_package_many__empty(db):
+    assert VitalRecordsRequest.complete_package_many({}) == 0
+
+
+def _outbound_email(**kwargs) -> OutboundEmail:
+    return OutboundEmail.objects.create(request_id=uuid4(), recipient="requestor", to_address="jane@example.com", **kwargs)
+
+
+def test_outbound_email_claim_due(db):
+    now = timezone.now()
+    oldest = _outbound_email(next_attempt_at=now - timedelta(minutes=2))
+    _outbound_email(next_attempt_at=now - timedelta(minutes=1))
+    _outbound_email(next_attempt_at=now + timedelta(minutes=1))
+    _outbound_email(status="submitted", next_attempt_at=now - timedelta(minutes=3))
+
+    claimed = OutboundEmail.claim_due(timedelta(minutes=10))
+
+    assert claimed == oldest
+    oldest.refresh_from_db()
+    assert oldest.status == "submitting"
+    assert oldest.attempts == 1
+    assert oldest.next_attempt_at > now + timedelta(minutes=9)
+
+
+def test_outbound_email_claim_due__claimed(db):
+    now = timezone.now()
+    _outbound_email(status="submitting", next_attempt_at=now + timedelta(minutes=1))
+
+    assert OutboundEmail.claim_due(timedelta(minutes=10)) is None
+
+
+def test_outbound_email_claim_due__lease_ran_out(db):
+    # left submitting by a dispatcher that stopped
+    stale = _outbound_email(status="submitting", attempts=1, next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+    claimed = OutboundEmail.claim_due(timedelta(minutes=10))
+
+    assert claimed == stale
+    assert claimed.status == "submitting"
+    assert claimed.attempts == 2
+
+
+def test_outbound_email_claim_submitted(db):
+    now = timezone.now()
+    due = _outbound_email(status="submitted", next_attempt_at=now - timedelta(seconds=1))
+    _outbound_email(status="submitted", next_attempt_at=now + timedelta(minutes=1))
+    _outbound_email(next_attempt_at=now - timedelta(minutes=1))
+
+    claimed = OutboundEmail.claim_submitted(timedelta(minutes=10))
+
+    assert claimed == due
+    due.refresh_from_db()
+    assert due.status == "submitted"
+    assert due.next_attempt_at > now + timedelta(minutes=9)
+    # not due again until the lease runs out
+    assert OutboundEmail.claim_submitted(timedelta(minutes=10)) is None
+
+
+def test_outbound_email_transitions(db):
+    email = _outbound_email(last_error="timed out")
+
+    claimed_until = timezone.now() + timedelta(minutes=10)
+    email.start_submit(claimed_until)
+    assert email.status == "submitting"
+    assert email.attempts == 1
+    assert email.next_attempt_at == claimed_until
+
+    email.complete_submit("operation-1")
+    assert email.status == "submitted"
+    assert email.operation_id == "operation-1"
+    assert email.last_error == ""
+
+    next_attempt_at = timezone.now() + timedelta(minutes=1)
+    email.retry("delivery failed", next_attempt_at)
+    assert email.status == "queued"
+    assert email.last_error == "delivery failed"
+    assert email.next_attempt_at == next_attempt_at
+
+    email.start_submit(claimed_until)
+    email.complete_submit("operation-2")
+    email.complete_delivery()
+    assert email.status == "delivered"
+    assert email.delivered_at is not None
+
+
+def test_outbound_email_fail(db):
+    email = _outbound_email(status="submitting")
+
+    email.fail("no more retries")
+
+    assert email.status == "failed"
+    assert email.last_error == "no more retries"
+
+
+def test_request_submission_claim(db):
+    oldest = RequestSubmission.objects.create(request_id=uuid4())
+    older = RequestSubmission.objects.create(request_id=uuid4())
+    RequestSubmission.objects.create(request_id=uuid4())
+
+    with transaction.atomic():
+        claimed = RequestSubmission.claim(2)
+
+    assert claimed == [oldest, older]
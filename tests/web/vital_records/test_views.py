@@ -2,7 +2,7 @@ from django.urls import reverse
 
 import pytest
 
-from web.vital_records.models import VitalRecordsRequest
+from web.vital_records.models import RequestSubmission, VitalRecordsRequest
 from web.vital_records.views import common
 from web.vital_records.forms.common import EligibilityForm
 from web.vital_records.session import Session
@@ -141,6 +141,53 @@ class TestSubmittedView:
     def test_template_name(self, view):
         assert view.template_name == "vital_records/submitted.html"
 
+    @pytest.fixture
+    def mock_get(self, mocker):
+        return mocker.patch("django.views.generic.detail.BaseDetailView.get")
+
+    @pytest.fixture
+    def mock_submit_request(self, mocker):
+        return mocker.patch("web.vital_records.views.common.submit_request")
+
+    @pytest.mark.django_db
+    def test_get(self, app_request, view, mock_get, mock_submit_request):
+        view.object = VitalRecordsRequest.objects.create(status="submitted")
+
+        response = view.get(app_request)
+
+        assert response == mock_get.return_value
+        view.object.refresh_from_db()
+        assert view.object.status == "enqueued"
+        mock_submit_request.assert_called_once_with(view.object.pk)
+        assert not RequestSubmission.objects.exists()
+
+    @pytest.mark.django_db
+    def test_get__outbox(self, settings, app_request, view, mock_get, mock_submit_request):
+        settings.VITAL_RECORDS_SUBMIT_OUTBOX = True
+        view.object = VitalRecordsRequest.objects.create(status="submitted")
+
+        response = view.get(app_request)
+
+        assert response == mock_get.return_value
+        view.object.refresh_from_db()
+        assert view.object.status == "enqueued"
+        mock_submit_request.assert_not_called()
+        assert RequestSubmission.objects.get().request_id == view.object.pk
+
+    @pytest.mark.django_db
+    def test_get__outbox_failed(self, mocker, settings, app_request, view, mock_get):
+        settings.VITAL_RECORDS_SUBMIT_OUTBOX = True
+        request = VitalRecordsRequest.objects.create(status="submitted")
+        view.object = VitalRecordsRequest.objects.get(pk=request.pk)
+        mocker.patch.object(RequestSubmission.objects, "create", side_effect=RuntimeError("database unavailable"))
+
+        with pytest.raises(RuntimeError):
+            view.get(app_request)
+
+        # the status change is rolled back along with the submission
+        request.refresh_from_db()
+        assert request.status == "submitted"
+
 
 class TestUnverifiedView:
     @pytest.fixture
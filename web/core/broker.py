@@ -0,0 +1,116 @@
+import logging
+from time import sleep
+
+from django.db import connections
+from django.utils import timezone
+from django_q.brokers.orm import ORM
+from django_q.conf import Conf
+import psycopg
+from psycopg import sql
+
+logger = logging.getLogger(__name__)
+
+# the prefix of the notification channel for each queue
+CHANNEL_PREFIX = "django_q:"
+
+
+class PostgresBroker(ORM):
+    """The ORM broker, woken with Postgres LISTEN/NOTIFY as tasks are queued, rather than polling the queue.
+
+    Queuing a task sends a notification on the queue's channel, which is delivered when the transaction it's queued in
+    commits. While the queue is empty, the cluster waits for a notification on a connection of its own that listens to
+    the channel, for up to `Q_POLL` seconds rather than sleeping. That wait running out is the fallback poll, for a
+    task whose notification was missed (e.g. while the listening connection was reconnecting).
+
+    On other databases (e.g. SQLite in development), the queue is polled, as with the ORM broker.
+
+    Usage (see `Q_LISTEN` in settings):
+
+        Q_CLUSTER["broker_class"] = "web.core.broker.PostgresBroker"
+    """
+
+    def __init__(self, list_key: str = None):
+        super().__init__(list_key)
+        self._listener = None
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._listener = None
+
+    @property
+    def channel(self) -> str:
+        return f"{CHANNEL_PREFIX}{self.list_key}"
+
+    @property
+    def listening(self) -> bool:
+        """True if workers are woken by notifications: the broker's database is Postgres."""
+        return connections[Conf.ORM].vendor == "postgresql"
+
+    def notify(self):
+        """Wake the clusters waiting for tasks on this queue, once the current transaction commits."""
+        if self.listening:
+            with connections[Conf.ORM].cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, '')", [self.channel])
+
+    def enqueue(self, task):
+        task_id = super().enqueue(task)
+        self.notify()
+        return task_id
+
+    def _claim(self) -> list[tuple]:
+        """Lock up to `Q_BULK` of the queued tasks for this cluster, as the ORM broker does."""
+        tasks = self.get_connection().filter(key=self.list_key, lock__lt=timezone.now())[: Conf.BULK]
+        claimed = []
+        for task in tasks:
+            if self.get_connection().filter(id=task.id, lock=task.lock).update(lock=self.timeout(task)):
+                claimed.append((task.pk, task.payload))
+            # else another cluster claimed the task first
+        return claimed
+
+    def _listen(self) -> psycopg.Connection | None:
+        """The connection listening to the queue's channel, connected if it isn't already; None if it can't be."""
+        if self._listener is None or self._listener.closed:
+            connection = connections[Conf.ORM]
+            try:
+                # not from the pool, if one is configured: the connection is held for as long as the cluster runs
+                self._listener = psycopg.connect(**connection.get_connection_params(), autocommit=True)
+                self._listener.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+            except psycopg.Error:
+                logger.warning("Couldn't listen for tasks, polling instead", exc_info=True)
+                self._close_listener()
+                return None
+            logger.debug(f"Listening for tasks on: {self.channel}")
+        return self._listener
+
+    def _close_listener(self):
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+    def wait(self, timeout: float):
+        """Wait up to timeout seconds for a task to be queued."""
+        listener = self._listen() if self.listening else None
+        if listener is None:
+            sleep(timeout)
+            return
+        try:
+            woken = any(True for _ in listener.notifies(timeout=timeout, stop_after=1))
+            if woken:
+                # a burst of tasks sends a burst of notifications: drain those already here, which the next claim covers,
+                # so each doesn't wake the cluster again to find the queue empty
+                for _ in listener.notifies(timeout=0):
+                    pass
+        except psycopg.Error:
+            logger.warning("Lost the connection listening for tasks", exc_info=True)
+            self._close_listener()
+            sleep(timeout)
+
+    def dequeue(self):
+        if self.listening:
+            # listen before checking the queue, so a task queued in between isn't missed
+            self._listen()
+        tasks = self._claim()
+        if tasks:
+            return tasks
+        # empty queue, wait for a task
+        self.wait(Conf.POLL)
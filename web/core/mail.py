@@ -0,0 +1,213 @@
+import base64
+from email.mime.base import MIMEBase
+import io
+import json
+import logging
+import os
+from typing import Iterator
+from uuid import uuid4
+
+from django_azure_communication_email import EmailBackend as ACEmailBackend
+
+logger = logging.getLogger(__name__)
+
+# a multiple of 3 bytes, so each chunk encodes to base64 without padding, and the chunks' encodings join up
+CHUNK_SIZE = 3 * 16 * 1024
+
+
+class FileAttachment(MIMEBase):
+    """An email attachment that is read from its file as the message is sent, rather than held in memory with it.
+
+    `EmailBackend` streams the file into the provider's request a chunk at a time; other backends, which serialize the
+    whole message (e.g. SMTP, files), read the file when they get the payload.
+
+    Usage:
+
+        message.attach(FileAttachment("/path/to/package.pdf", "request.pdf", "application/pdf"))
+    """
+
+    def __init__(self, path: str, filename: str, mimetype: str):
+        maintype, subtype = mimetype.split("/", 1)
+        super().__init__(maintype, subtype)
+        self.path = path
+        # and checks the file is there, before the message is sent
+        self.size = os.path.getsize(path)
+        self.add_header("Content-Disposition", "attachment", filename=filename)
+        self["Content-Transfer-Encoding"] = "base64"
+
+    @property
+    def _payload(self) -> str:
+        # what `Message.get_payload()` and the email generators read
+        with open(self.path, "rb") as f:
+            return base64.encodebytes(f.read()).decode("ascii")
+
+    @_payload.setter
+    def _payload(self, value):
+        # set by `Message.__init__`, the payload is always the file's content
+        pass
+
+    def base64_size(self) -> int:
+        """The length of the file's content in base64, without line breaks."""
+        return (self.size + 2) // 3 * 4
+
+    def iter_base64(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """The file's content in base64, without line breaks, encoded a chunk at a time."""
+        with open(self.path, "rb") as f:
+            # no chunk is held on to here between reads, so one is dropped as soon as the reader is done with it
+            for _ in range(0, self.size, chunk_size):
+                yield base64.b64encode(f.read(chunk_size))
+
+    def read_base64(self) -> str:
+        """The file's content in base64, without line breaks."""
+        return b"".join(self.iter_base64()).decode("ascii")
+
+
+class JsonStream(io.RawIOBase):
+    """A JSON request body that is read a chunk at a time, with the content of each `FileAttachment` in it streamed
+    from its file as base64. Its length is known up front, and it can be rewound, so a failed request can be retried.
+
+    Usage:
+
+        body = JsonStream.from_json({"attachments": [{"name": "request.pdf", "contentInBase64": attachment}]})
+        requests.post(url, data=body)
+    """
+
+    def __init__(self, parts: list[bytes | FileAttachment]):
+        self.parts = parts
+        self.length = sum(part.base64_size() if isinstance(part, FileAttachment) else len(part) for part in parts)
+        self.seek(0)
+
+    @classmethod
+    def from_json(cls, obj) -> "JsonStream":
+        """The JSON for obj, in which each `FileAttachment` is a string of its content in base64."""
+        attachments = []
+        placeholder = f"file-attachment-{uuid4().hex}"
+
+        def encode(value):
+            if isinstance(value, FileAttachment):
+                attachments.append(value)
+                return placeholder
+            raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+        text = json.dumps(obj, default=encode)
+        first, *rest = text.split(placeholder)
+        parts = [first.encode()]
+        for attachment, piece in zip(attachments, rest):
+            parts.extend((attachment, piece.encode()))
+        return cls(parts)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def _iter_chunks(self) -> Iterator[bytes]:
+        for part in self.parts:
+            if isinstance(part, FileAttachment):
+                yield from part.iter_base64()
+            else:
+                yield part
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Only rewinding to the start is supported, along with getting the position."""
+        if whence == io.SEEK_CUR and offset == 0:
+            return self._position
+        if whence != io.SEEK_SET or offset != 0:
+            raise io.UnsupportedOperation("JsonStream can only be rewound to the start")
+        self._chunks = self._iter_chunks()
+        self._buffer = memoryview(b"")
+        self._position = 0
+        return 0
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            # let go of the chunk that's been read, before encoding the next one
+            self._buffer = None
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buffer = memoryview(chunk)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        self._position += size
+        return size
+
+
+class EmailBackend(ACEmailBackend):
+    """Azure Communication Email backend that doesn't read `FileAttachment` files into memory in one go.
+
+    Authenticating with a token (`AZURE_COMMUNICATION_ENDPOINT` and a managed identity), a message's request body is a
+    `JsonStream`, so sending holds about a chunk of each attachment in memory. Authenticating with a key (e.g.
+    `AZURE_COMMUNICATION_CONNECTION_STRING`), requests are signed with a hash of the whole body, which has to be in
+    memory; each attachment is then encoded into it a chunk at a time, rather than from a copy of the whole file.
+
+    Inside `with get_connection() as connection:`, the provider's client, and its HTTP connections, stay open across
+    `send_messages()` calls until the block ends, rather than being opened and closed for each call.
+    """
+
+    @property
+    def streaming(self) -> bool:
+        """True if request bodies can be streamed: requests aren't signed with a hash of the body."""
+        return not (self._connection_string or self._key_credential)
+
+    @property
+    def client(self):
+        """The provider's email client, opened if it isn't already."""
+        self.open()
+        return self._client
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+        super().close()
+
+    def send_messages(self, email_messages) -> int:
+        """Send each message, and return the number sent. The client is left open if it was already, like Django's SMTP
+        backend leaves its connection."""
+        if not email_messages:
+            return 0
+
+        new_client = self._client is None
+        self.open()
+        if self._client is None:
+            # failed silently
+            return 0
+
+        sent = 0
+        try:
+            for message in email_messages:
+                try:
+                    self._client.begin_send(self.convert_message(message))
+                    sent += 1
+                except Exception as ex:
+                    if not self.fail_silently:
+                        raise
+                    logger.warning("Failed to send email", exc_info=ex)
+        finally:
+            if new_client:
+                self.close()
+        return sent
+
+    def _build_attachment(self, file) -> dict:
+        if isinstance(file, FileAttachment):
+            # filled in by convert_message()
+            return {"name": file.get_filename(), "contentType": file.get_content_type(), "contentInBase64": file}
+        return super()._build_attachment(file)
+
+    def convert_message(self, message) -> dict | JsonStream:
+        """The request body for message: a `JsonStream` if `streaming`, otherwise a dict."""
+        payload = super().convert_message(message)
+        if self.streaming:
+            return JsonStream.from_json(payload)
+        for attachment in payload.get("attachments", ()):
+            if isinstance(attachment["contentInBase64"], FileAttachment):
+                attachment["contentInBase64"] = attachment["contentInBase64"].read_base64()
+        return payload
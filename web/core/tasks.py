@@ -1,9 +1,73 @@
+import hashlib
+from itertools import islice
+import json
 import logging
+from typing import Iterable
+from uuid import UUID
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django_q.brokers import get_broker
+from django_q.brokers.orm import ORM
+from django_q.conf import Conf
+from django_q.humanhash import uuid
+from django_q.models import OrmQ
+from django_q.signals import pre_enqueue
+from django_q.signing import SignedPackage
 from django_q.tasks import AsyncTask
 
 logger = logging.getLogger(__name__)
 
+# what a `Task` queues: the function that runs its handler, and the hook that runs its post handler
+EXECUTE = "web.core.tasks.execute"
+EXECUTE_HOOK = "web.core.tasks.execute_hook"
+# the types of the arguments a `Task` is queued with, and of the items in any lists or dicts among them
+ARGUMENT_TYPES = (str, int, float, bool, type(None), UUID)
+# keyword arguments that are options for the task queue, rather than for the handler
+OPTION_KEYWORDS = {"group", "task_name", "hook", "save", "sync", "cached", "ack_failure", "broker", "cluster", "timeout"}
+# the number of tasks `Task.run_many()` queues with each insert
+RUN_MANY_CHUNK_SIZE = 500
+# the prefix of the cache key that holds a task's dedup key while it's pending or running
+DEDUP_PREFIX = "task-dedup:"
+
+
+def check_argument(value):
+    """Raise a TypeError if value isn't a JSON primitive or a UUID, or a list or dict of them."""
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            check_argument(item)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            check_argument(key)
+            check_argument(item)
+    elif not isinstance(value, ARGUMENT_TYPES):
+        raise TypeError(f"Task arguments must be JSON primitives or UUIDs, not: {type(value).__name__}")
+
+
+def _get_task(path: str) -> "Task":
+    """An instance of the `Task` subclass at the dotted path, to call its handlers on."""
+    task_class = import_string(path)
+    if not (isinstance(task_class, type) and issubclass(task_class, Task)):
+        raise TypeError(f"Not a Task: {path}")
+    # not initialised: handlers get everything they need from their arguments
+    return task_class.__new__(task_class)
+
+
+def execute(path: str, *args, **kwargs):
+    """Run the handler of the `Task` subclass at the dotted path with args and kwargs, in a cluster worker."""
+    return _get_task(path).handler(*args, **kwargs)
+
+
+def execute_hook(task):
+    """Run the post handler of the `Task` subclass that queued the completed task, once its dedup key is released."""
+    handler = _get_task(task.args[0])
+    # before the post handler, which may queue the task again, e.g. to retry it
+    handler.release_dedup_key(**task.kwargs)
+    return handler.post_handler(task)
+
 
 class Task(AsyncTask):
     """Base class to model work that is processed asynchronously via a task queue.
@@ -12,6 +76,10 @@ class Task(AsyncTask):
 
       group (str): An identifier that can be used to aggregate results from related tasks.
       name (str): The specific name of this task.
+      dedup_key (str): Optional, formatted with the task's keyword arguments, e.g. "package:{request_id}". A task isn't
+      queued while another with the same key is pending or running (for up to `dedup_timeout` seconds).
+      queue (str): Optional, the named queue the task is put on, e.g. "maintenance". A queue listed in `Q_QUEUES` is
+      consumed by a cluster of its own, with its own workers, timeout and retry; otherwise by the default cluster.
 
     Usage:
 
@@ -44,16 +112,140 @@ class Task(AsyncTask):
 
         # add it to the queue, a worker will pick it up
         task.run()
+
+    The task is queued as a compact envelope: `execute()`, with the dotted path of the task's class and the handler's
+    arguments, rather than the task instance itself. Its arguments must be JSON primitives or UUIDs (or lists and dicts
+    of them), and the handler and post handler are called on an instance of the class that isn't initialised.
     """
 
     group = "disaster-recovery"
     name = "task"
+    dedup_key = None
+    dedup_timeout = 60 * 60
+    queue = None
 
     def __init__(self, *args, **kwargs):
+        check_argument(args)
+        check_argument({key: value for key, value in kwargs.items() if key not in OPTION_KEYWORDS})
         kwargs["group"] = kwargs.pop("group", self.group)
         kwargs["task_name"] = kwargs.pop("task_name", self.name)
-        kwargs["hook"] = self.post_handler
-        super().__init__(self.handler, *args, **kwargs)
+        kwargs["hook"] = EXECUTE_HOOK
+        kwargs["cluster"] = kwargs.pop("cluster", self.get_cluster())
+        super().__init__(EXECUTE, self.path(), *args, **kwargs)
+
+    @classmethod
+    def get_cluster(cls) -> str:
+        """The cluster that consumes this task's queue: the queue's own if it's in `Q_QUEUES`, otherwise the default."""
+        if cls.queue and cls.queue in settings.Q_QUEUES:
+            return cls.queue
+        # rather than the cluster queuing the task, which may be another queue's
+        return Conf.PREFIX
+
+    @classmethod
+    def path(cls) -> str:
+        """The dotted path of this task class, which the task is queued with."""
+        return f"{cls.__module__}.{cls.__qualname__}"
+
+    def _handler_kwargs(self) -> dict:
+        return {key: value for key, value in self.kwargs.items() if key not in OPTION_KEYWORDS}
+
+    @classmethod
+    def get_dedup_key(cls, **kwargs) -> str | None:
+        """The cache key held while a task with these keyword arguments is pending or running; None for no dedup."""
+        if cls.dedup_key is None:
+            return None
+        return DEDUP_PREFIX + cls.dedup_key.format(**kwargs)
+
+    def acquire_dedup_key(self) -> bool:
+        """Hold this task's dedup key. Returns False if it's already held, by a duplicate that's pending or running."""
+        key = self.get_dedup_key(**self._handler_kwargs())
+        if key is None or cache.add(key, self.name, self.dedup_timeout):
+            return True
+        logger.info(f"Skipping duplicate task: {key}")
+        return False
+
+    @classmethod
+    def release_dedup_key(cls, **kwargs):
+        """Release the dedup key of the task with these keyword arguments, once it's completed (or couldn't be queued)."""
+        key = cls.get_dedup_key(**kwargs)
+        if key is not None:
+            cache.delete(key)
+
+    def run(self) -> str | None:
+        """Queue this task. Returns its ID, or None if it's a duplicate of a task that's pending or running."""
+        if not self.acquire_dedup_key():
+            return None
+        try:
+            return super().run()
+        except Exception:
+            self.release_dedup_key(**self._handler_kwargs())
+            raise
+
+    def _envelope(self) -> dict:
+        """The task package that `run()` queues, as `django_q.tasks.async_task()` builds it."""
+        kwargs = self._handler_kwargs()
+        options = {key: value for key, value in self.kwargs.items() if key in OPTION_KEYWORDS and key != "task_name"}
+        human, task_id = uuid()
+        envelope = {"id": task_id, "name": self.kwargs.get("task_name") or human, "func": self.func, "args": self.args}
+        envelope.update(options)
+        if "cached" not in envelope and Conf.CACHED:
+            envelope["cached"] = Conf.CACHED
+        if "ack_failure" not in envelope and Conf.ACK_FAILURES:
+            envelope["ack_failure"] = Conf.ACK_FAILURES
+        envelope["kwargs"] = kwargs
+        envelope["started"] = timezone.now()
+        return envelope
+
+    @classmethod
+    def run_many(cls, kwargs_list: Iterable[dict], group: str = None, chunk_size: int = RUN_MANY_CHUNK_SIZE) -> list["Task"]:
+        """Queue a task of this class for each dict of arguments to its constructor, `chunk_size` tasks to an insert.
+
+        Each task is tagged with group, if given, rather than the class's group, so the results of the lot can be
+        fetched together, e.g. with `Task.result_group()`. Returns the queued tasks, without any duplicates skipped.
+
+        Tasks are queued one by one when the broker isn't the ORM broker, or when the cluster runs tasks synchronously.
+
+        Usage:
+
+            tasks = PackageTask.run_many(({"request_id": id} for id in request_ids), group="redrive")
+        """
+        broker = get_broker(cls.get_cluster())
+        kwargs_list = iter(kwargs_list)
+        queued = []
+        while chunk := [cls(**kwargs) for kwargs in islice(kwargs_list, chunk_size)]:
+            if group:
+                for task in chunk:
+                    # the class's group is the default for the option, and what the task's results are fetched by
+                    task.group = task.kwargs["group"] = group
+
+            if Conf.SYNC or not isinstance(broker, ORM):
+                queued.extend(task for task in chunk if task.run() is not None)
+                continue
+
+            chunk = [task for task in chunk if task.acquire_dedup_key()]
+            if not chunk:
+                continue
+            rows = []
+            for task in chunk:
+                envelope = task._envelope()
+                pre_enqueue.send(sender="django_q", task=envelope)
+                rows.append(OrmQ(key=broker.list_key, payload=SignedPackage.dumps(envelope), lock=timezone.now()))
+                task.id = envelope["id"]
+            try:
+                with transaction.atomic(using=Conf.ORM):
+                    OrmQ.objects.using(Conf.ORM).bulk_create(rows)
+                    if hasattr(broker, "notify"):
+                        broker.notify()
+            except Exception:
+                for task in chunk:
+                    task.release_dedup_key(**task._handler_kwargs())
+                raise
+            for task in chunk:
+                task.started = True
+            queued.extend(chunk)
+            logger.debug(f"Queued {len(queued)} {cls.name} tasks")
+
+        return queued
 
     def handler(self, *args, **kwargs):
         """Perform the work for this task, when it is picked up by a worker from a queue."""
@@ -62,3 +254,71 @@ class Task(AsyncTask):
     def post_handler(self, task):
         """Optional hook performs work after this task completes. Often used to add a follow-up task to the queue."""
         logger.debug(f"Post handler for task: {task.id}")
+
+
+class Pipeline(Task):
+    """A task that runs a sequence of stages one after another in the same worker, rather than each stage queuing the
+    next as a task of its own.
+
+    Attributes:
+
+      stages (tuple[str]): The names of the methods to run, in order. Each is called with the results of the stages
+      before it, by name, followed by the task's arguments.
+
+    The results so far are saved as a checkpoint after each stage, so a pipeline that's run again (e.g. presented again
+    by the broker after a failure) resumes after the last completed stage. Checkpoints are kept in the cache for
+    `checkpoint_timeout` seconds; subclasses can keep them elsewhere by overriding `load_checkpoint()` and friends.
+
+    Usage:
+
+        from web.core.tasks import Pipeline
+
+        class MyPipeline(Pipeline):
+            group = "my-group"
+            name = "my-pipeline"
+            stages = ("fetch", "send")
+
+            def __init__(self, some_arg):
+                super().__init__(some_arg=some_arg)
+
+            def fetch(self, results, some_arg):
+                return fetch_something(some_arg)
+
+            def send(self, results, some_arg):
+                return send_something(results["fetch"])
+
+        MyPipeline(some_arg="the-data").run()
+    """
+
+    stages = ()
+    checkpoint_timeout = 24 * 60 * 60
+
+    def checkpoint_key(self, *args, **kwargs) -> str:
+        """The cache key of the checkpoint for a run of this pipeline with these arguments."""
+        arguments = json.dumps({"args": args, "kwargs": kwargs}, sort_keys=True, default=str)
+        return f"pipeline:{self.group}:{self.name}:{hashlib.sha256(arguments.encode()).hexdigest()}"
+
+    def load_checkpoint(self, *args, **kwargs) -> dict:
+        """The results of the stages completed by an earlier run with these arguments, by name."""
+        return cache.get(self.checkpoint_key(*args, **kwargs), {})
+
+    def save_checkpoint(self, results: dict, *args, **kwargs):
+        """Save the results of the stages completed so far, by name."""
+        cache.set(self.checkpoint_key(*args, **kwargs), results, self.checkpoint_timeout)
+
+    def clear_checkpoint(self, *args, **kwargs):
+        """Forget the checkpoint, once every stage is completed."""
+        cache.delete(self.checkpoint_key(*args, **kwargs))
+
+    def handler(self, *args, **kwargs) -> dict:
+        """Run the stages that aren't completed yet. Returns the result of each stage, by name."""
+        results = self.load_checkpoint(*args, **kwargs)
+        for stage in self.stages:
+            if stage in results:
+                logger.debug(f"Skipping completed stage: {stage} of task: {self.name}")
+                continue
+            logger.debug(f"Running stage: {stage} of task: {self.name}")
+            results[stage] = getattr(self, stage)(results, *args, **kwargs)
+            self.save_checkpoint(results, *args, **kwargs)
+        self.clear_checkpoint(*args, **kwargs)
+        return results
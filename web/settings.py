@@ -258,13 +258,28 @@ STATIC_ROOT = os.path.join(RUNTIME_DIR, "static")
 # Storage for e.g. generated files, not routable from the website
 STORAGE_DIR = os.environ.get("DJANGO_STORAGE_DIR", RUNTIME_DIR)
 
+# Rendered packages, stored by content hash
+VITAL_RECORDS_PACKAGE_STORE_DIR = os.environ.get("VITAL_RECORDS_PACKAGE_STORE_DIR", os.path.join(STORAGE_DIR, "packages"))
+# Share rendered packages between task workers through the database, for workers that don't share a storage directory;
+# packages are then only kept in the database, and read into temporary files while they're sent
+VITAL_RECORDS_PACKAGE_STORE_SHARED = os.environ.get("VITAL_RECORDS_PACKAGE_STORE_SHARED", "False").lower() == "true"
+# Seconds a shared package is kept in the database, unless the request is cleaned up first
+VITAL_RECORDS_PACKAGE_STORE_TTL = int(os.environ.get("VITAL_RECORDS_PACKAGE_STORE_TTL", 7 * 24 * 60 * 60))
+
+# Pre-merged base packages, built by `python manage.py build_packages`
+VITAL_RECORDS_PACKAGE_DIR = os.environ.get("VITAL_RECORDS_PACKAGE_DIR", os.path.join(RUNTIME_DIR, "packages"))
+
 # Email
 # https://docs.djangoproject.com/en/5.1/ref/settings/#email-backend
 # https://github.com/retech-us/django-azure-communication-email
 AZURE_COMMUNICATION_CONNECTION_STRING = os.environ.get("AZURE_COMMUNICATION_CONNECTION_STRING")
+# Or authenticate with a managed identity in this tenant, which lets package attachments be streamed to the endpoint
+AZURE_COMMUNICATION_ENDPOINT = os.environ.get("AZURE_COMMUNICATION_ENDPOINT")
+AZURE_TENANT_ID = os.environ.get("AZURE_TENANT_ID")
 
-if AZURE_COMMUNICATION_CONNECTION_STRING:
-    EMAIL_BACKEND = "django_azure_communication_email.EmailBackend"
+if AZURE_COMMUNICATION_CONNECTION_STRING or AZURE_COMMUNICATION_ENDPOINT:
+    # streams file attachments, see `web.core.mail`
+    EMAIL_BACKEND = "web.core.mail.EmailBackend"
     EMAIL_USE_TLS = True
 else:
     EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
@@ -274,6 +289,58 @@ else:
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-from-email
 DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL", "noreply@example.ca.gov")
 VITAL_RECORDS_EMAIL_TO = os.environ.get("VITAL_RECORDS_EMAIL_TO", "example@example.ca.gov")
+# Deliver packages to VITAL_RECORDS_EMAIL_TO as zip archives every this many minutes (e.g. 1440 for daily), rather than
+# one email per request; 0=one email per request. Requestors still get a confirmation email per request
+VITAL_RECORDS_BUNDLE_MINUTES = int(os.environ.get("VITAL_RECORDS_BUNDLE_MINUTES", 0))
+# The maximum number of packages in a single archive, and so in a single email
+VITAL_RECORDS_BUNDLE_SIZE = int(os.environ.get("VITAL_RECORDS_BUNDLE_SIZE", 20))
+# The maximum size in bytes of a single archive. Attachments grow by a third when they're base64 encoded into the email,
+# which has to stay under the email provider's limit (10 MB for Azure Communication Services)
+VITAL_RECORDS_BUNDLE_MAX_BYTES = int(os.environ.get("VITAL_RECORDS_BUNDLE_MAX_BYTES", 7_000_000))
+# Send a request's office and requestor emails at the same time, each through its own connection, rather than one after
+# the other through a shared connection
+VITAL_RECORDS_EMAIL_CONCURRENT = os.environ.get("VITAL_RECORDS_EMAIL_CONCURRENT", "False").lower() == "true"
+# The number of times an email that failed to send is retried, on its own
+VITAL_RECORDS_EMAIL_RETRIES = int(os.environ.get("VITAL_RECORDS_EMAIL_RETRIES", 3))
+# Queue emails for the email dispatcher (`python manage.py dispatch_emails`), which delivers them apart from the task
+# workers, rather than sending them from the email task
+VITAL_RECORDS_EMAIL_DISPATCHER = os.environ.get("VITAL_RECORDS_EMAIL_DISPATCHER", "False").lower() == "true"
+# Seconds the dispatcher waits before retrying a failed email, doubling with each retry
+VITAL_RECORDS_EMAIL_BACKOFF_SECONDS = int(os.environ.get("VITAL_RECORDS_EMAIL_BACKOFF_SECONDS", 30))
+# After this many email provider errors in a row, the dispatcher pauses sending for VITAL_RECORDS_EMAIL_BREAKER_SECONDS
+VITAL_RECORDS_EMAIL_BREAKER_THRESHOLD = int(os.environ.get("VITAL_RECORDS_EMAIL_BREAKER_THRESHOLD", 5))
+VITAL_RECORDS_EMAIL_BREAKER_SECONDS = int(os.environ.get("VITAL_RECORDS_EMAIL_BREAKER_SECONDS", 60))
+# Without Azure Communication Email, the dispatcher delivers through EMAIL_BACKEND instead, adding this many
+# seconds of latency to each call, and failing this fraction of calls (0-1)
+VITAL_RECORDS_EMAIL_STUB_LATENCY = float(os.environ.get("VITAL_RECORDS_EMAIL_STUB_LATENCY", 0))
+VITAL_RECORDS_EMAIL_STUB_ERROR_RATE = float(os.environ.get("VITAL_RECORDS_EMAIL_STUB_ERROR_RATE", 0))
+
+# The number of enqueued requests packaged together by a single task; 0=one task per request
+VITAL_RECORDS_PACKAGE_BATCH_SIZE = int(os.environ.get("VITAL_RECORDS_PACKAGE_BATCH_SIZE", 0))
+# The number of times a batch package task tries to package a request, before moving it to failed
+VITAL_RECORDS_PACKAGE_ATTEMPTS = int(os.environ.get("VITAL_RECORDS_PACKAGE_ATTEMPTS", 3))
+# With VITAL_RECORDS_PACKAGE_BATCH_SIZE, also run a batch package task every this many minutes, to retry requests whose
+# task was stopped, and fail those out of attempts; 0=only when requests are submitted
+VITAL_RECORDS_PACKAGE_BATCH_MINUTES = int(os.environ.get("VITAL_RECORDS_PACKAGE_BATCH_MINUTES", 5))
+# Package and email each request in a single task, rather than queuing an email task once it's packaged; not used with
+# VITAL_RECORDS_PACKAGE_BATCH_SIZE
+VITAL_RECORDS_PACKAGE_PIPELINE = os.environ.get("VITAL_RECORDS_PACKAGE_PIPELINE", "False").lower() == "true"
+# Save submitted requests to an outbox, along with their move to enqueued, for the outbox dispatcher
+# (`python manage.py drain_outbox`) to queue, rather than queuing them while the submitted page is loading
+VITAL_RECORDS_SUBMIT_OUTBOX = os.environ.get("VITAL_RECORDS_SUBMIT_OUTBOX", "False").lower() == "true"
+# The number of processes each cluster worker starts to render packages; 0=render in the cluster worker itself
+VITAL_RECORDS_RENDER_PROCESSES = int(os.environ.get("VITAL_RECORDS_RENDER_PROCESSES", 0))
+# The number of seconds a single package render may take before the render pool is restarted
+VITAL_RECORDS_RENDER_TIMEOUT = int(os.environ.get("VITAL_RECORDS_RENDER_TIMEOUT", 60))
+# How much to shrink each package before it is written; 0=none, 1=compress streams, 2=also merge duplicate and
+# drop unreferenced objects (slower). Off by default: base packages are always built at 2, which leaves little to save
+VITAL_RECORDS_PACKAGE_OPTIMIZATION = int(os.environ.get("VITAL_RECORDS_PACKAGE_OPTIMIZATION", 0))
+# Write each package as an incremental update of its base package: the base package bytes, followed by just the filled
+# fields. Much faster, at the cost of slightly larger packages; only level 1 optimization applies
+VITAL_RECORDS_PACKAGE_INCREMENTAL = os.environ.get("VITAL_RECORDS_PACKAGE_INCREMENTAL", "False").lower() == "true"
+# Load templates, connect to the database and render a throwaway package in each cluster worker as it starts, before
+# it takes any tasks
+VITAL_RECORDS_WORKER_WARM_UP = os.environ.get("VITAL_RECORDS_WORKER_WARM_UP", "True").lower() == "true"
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -306,6 +373,26 @@ Q_CLUSTER = {
     "timeout": int(os.environ.get("Q_TIMEOUT", 150)),
     # The number of workers to use in the cluster.
     "workers": int(os.environ.get("Q_WORKERS", 1)),
+    # Daemonic workers can't start child processes, such as the package render pool.
+    "daemonize_workers": VITAL_RECORDS_RENDER_PROCESSES == 0,
+}
+
+# Wake cluster workers with Postgres LISTEN/NOTIFY as tasks are queued, rather than only when they poll the queue (every
+# Q_POLL seconds, which is then just the fallback); polls as usual on other databases
+if os.environ.get("Q_LISTEN", "False").lower() == "true":
+    Q_CLUSTER["broker_class"] = "web.core.broker.PostgresBroker"
+
+# Named task queues, each consumed by a cluster of its own, so e.g. maintenance tasks don't hold up packaging new
+# requests. Tasks declare their queue; tasks in a queue that isn't listed here are consumed by the default cluster
+Q_QUEUES = _filter_empty(os.environ.get("Q_QUEUES", "").split(","))
+# Start a queue's cluster with Q_CLUSTER_NAME=<queue>. Its workers, timeout and retry default to the default cluster's,
+# and are set with e.g. Q_MAINTENANCE_WORKERS, Q_MAINTENANCE_TIMEOUT and Q_MAINTENANCE_RETRY
+Q_CLUSTER["ALT_CLUSTERS"] = {
+    queue: {
+        option: int(os.environ.get(f"Q_{queue.upper()}_{option.upper()}", Q_CLUSTER[option]))
+        for option in ("workers", "timeout", "retry")
+    }
+    for queue in Q_QUEUES
 }
 
 # Content Security Policy
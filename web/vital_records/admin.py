@@ -17,3 +17,21 @@ class VitalRecordsRequestMetadataAdmin(admin.ModelAdmin):
         "packaged_at",
         "sent_at",
     )
+
+
+@admin.register(models.OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    date_hierarchy = "created_at"
+    list_display = (
+        "id",
+        "request_id",
+        "recipient",
+        "status",
+        "attempts",
+        "next_attempt_at",
+        "created_at",
+        "delivered_at",
+    )
+    list_filter = ("status", "recipient")
+    # the email content is personal information
+    exclude = ("to_address", "text_content", "html_content")
@@ -9,3 +9,10 @@ class VitalsAppConfig(AppConfig):
     name = "web.vital_records"
     label = "vital_records"
     verbose_name = "Vital Records"
+
+    def ready(self):
+        from django_q.signals import post_spawn
+
+        from web.vital_records.tasks.warmup import on_worker_spawn
+
+        post_spawn.connect(on_worker_spawn, dispatch_uid="vital_records_warm_up")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from web.vital_records.tasks.package import PACKAGE_TYPES, build_base_package
+
+
+class Command(BaseCommand):
+    help = "Builds the pre-merged application and sworn statement base package for each record type."
+
+    def add_arguments(self, parser):
+        parser.add_argument("types", nargs="*", choices=PACKAGE_TYPES, help="Record type(s) to build. Defaults to all.")
+
+    def handle(self, *args, **options):
+        for request_type in options.get("types") or PACKAGE_TYPES:
+            filename = build_base_package(request_type)
+            self.stdout.write(self.style.SUCCESS(f"Built {request_type} base package: {filename}"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from web.vital_records.tasks.delivery import Dispatcher
+
+
+class Command(BaseCommand):
+    help = "Delivers the emails queued with VITAL_RECORDS_EMAIL_DISPATCHER, until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds between dispatcher ticks")
+        parser.add_argument("--once", action="store_true", help="Run a single tick, then exit")
+
+    def handle(self, *args, **options):
+        dispatcher = Dispatcher()
+        if options["once"]:
+            submitted, delivered = dispatcher.tick()
+            self.stdout.write(self.style.SUCCESS(f"Submitted {submitted} emails, {delivered} delivered"))
+        else:
+            dispatcher.run(options["interval"])
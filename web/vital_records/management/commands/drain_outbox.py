@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from web.vital_records.tasks.outbox import OutboxDispatcher
+
+
+class Command(BaseCommand):
+    help = "Queues the requests submitted with VITAL_RECORDS_SUBMIT_OUTBOX for packaging, until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds between dispatcher ticks")
+        parser.add_argument("--once", action="store_true", help="Run a single tick, then exit")
+
+    def handle(self, *args, **options):
+        dispatcher = OutboxDispatcher()
+        if options["once"]:
+            queued = dispatcher.tick()
+            self.stdout.write(self.style.SUCCESS(f"Queued {queued} submitted requests"))
+        else:
+            dispatcher.run(options["interval"])
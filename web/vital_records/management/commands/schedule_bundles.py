@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django_q.models import Schedule
+
+from web.vital_records.models import VitalRecordsRequest
+from web.vital_records.tasks.bundle import BUNDLE_SCHEDULE, run_bundle_task
+
+
+class Command(BaseCommand):
+    help = "Schedules delivering request packages in bundles every VITAL_RECORDS_BUNDLE_MINUTES, or unschedules it when 0."
+
+    def handle(self, *args, **options):
+        minutes = settings.VITAL_RECORDS_BUNDLE_MINUTES
+        if minutes > 0:
+            Schedule.objects.update_or_create(
+                name=BUNDLE_SCHEDULE,
+                defaults={
+                    "func": "web.vital_records.tasks.bundle.run_bundle_task",
+                    "schedule_type": Schedule.MINUTES,
+                    "minutes": minutes,
+                },
+            )
+            self.stdout.write(self.style.SUCCESS(f"Scheduled bundles every {minutes} minutes"))
+        else:
+            Schedule.objects.filter(name=BUNDLE_SCHEDULE).delete()
+            self.stdout.write(self.style.SUCCESS("Bundles not scheduled, packages are sent one email per request"))
+            # requests left waiting from when bundles were scheduled
+            if VitalRecordsRequest.objects.filter(status="sent").exists():
+                run_bundle_task()
+                self.stdout.write(self.style.SUCCESS("Queued a final bundle for requests sent while bundling"))
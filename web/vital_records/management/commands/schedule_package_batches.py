@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django_q.models import Schedule
+
+from web.vital_records.tasks.package import BATCH_SCHEDULE
+
+
+class Command(BaseCommand):
+    help = (
+        "Schedules a batch package task every VITAL_RECORDS_PACKAGE_BATCH_MINUTES with VITAL_RECORDS_PACKAGE_BATCH_SIZE, "
+        "or unschedules it without."
+    )
+
+    def handle(self, *args, **options):
+        minutes = settings.VITAL_RECORDS_PACKAGE_BATCH_MINUTES
+        if settings.VITAL_RECORDS_PACKAGE_BATCH_SIZE > 0 and minutes > 0:
+            Schedule.objects.update_or_create(
+                name=BATCH_SCHEDULE,
+                defaults={
+                    "func": "web.vital_records.tasks.package.run_batch_package_task",
+                    "schedule_type": Schedule.MINUTES,
+                    "minutes": minutes,
+                },
+            )
+            self.stdout.write(self.style.SUCCESS(f"Scheduled package batches every {minutes} minutes"))
+        else:
+            Schedule.objects.filter(name=BATCH_SCHEDULE).delete()
+            self.stdout.write(self.style.SUCCESS("Package batches not scheduled"))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-18 13:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vital_records", "0011_vitalrecordsrequestmetadata_type"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="vitalrecordsrequest",
+            name="package_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
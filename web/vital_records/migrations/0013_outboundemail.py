@@ -0,0 +1,51 @@
+# Generated by Django 5.2.11 on 2026-10-18 13:42
+
+import django.utils.timezone
+import django_fsm
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vital_records", "0012_vitalrecordsrequest_package_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboundEmail",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("request_id", models.UUIDField(db_index=True, editable=False)),
+                ("recipient", models.CharField(max_length=20)),
+                ("to_address", models.CharField(max_length=128)),
+                ("subject", models.CharField(max_length=256)),
+                ("text_content", models.TextField()),
+                ("html_content", models.TextField()),
+                ("attachment_package", models.CharField(blank=True, max_length=256)),
+                ("attachment_filename", models.CharField(blank=True, max_length=256)),
+                (
+                    "status",
+                    django_fsm.FSMField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("submitted", "Submitted"),
+                            ("delivered", "Delivered"),
+                            ("failed", "Failed"),
+                        ],
+                        default="queued",
+                        max_length=50,
+                    ),
+                ),
+                ("attempts", models.IntegerField(default=0)),
+                ("next_attempt_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("operation_id", models.CharField(blank=True, max_length=64)),
+                ("last_error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("delivered_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "indexes": [models.Index(fields=["status", "next_attempt_at"], name="vital_recor_status_8f71de_idx")],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.11 on 2026-10-18 13:54
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vital_records", "0013_outboundemail"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoredPackage",
+            fields=[
+                ("key", models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ("data", models.BinaryField()),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("expires_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.11 on 2026-10-18 14:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vital_records", "0014_storedpackage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RequestSubmission",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("request_id", models.UUIDField(editable=False, unique=True)),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.11 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vital_records", "0015_requestsubmission"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="vitalrecordsrequest",
+            name="package_attempts",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="vitalrecordsrequest",
+            name="package_claimed_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
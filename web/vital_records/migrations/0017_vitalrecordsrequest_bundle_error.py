@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-18 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vital_records", "0016_vitalrecordsrequest_package_attempts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="vitalrecordsrequest",
+            name="bundle_error",
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.11 on 2026-10-18 14:36
+
+import django_fsm
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vital_records", "0017_vitalrecordsrequest_bundle_error"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="outboundemail",
+            name="status",
+            field=django_fsm.FSMField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("submitting", "Submitting"),
+                    ("submitted", "Submitted"),
+                    ("delivered", "Delivered"),
+                    ("failed", "Failed"),
+                ],
+                default="queued",
+                max_length=50,
+            ),
+        ),
+    ]
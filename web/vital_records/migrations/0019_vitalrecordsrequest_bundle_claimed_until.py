@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vital_records", "0018_outboundemail_submitting"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="vitalrecordsrequest",
+            name="bundle_claimed_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.11 on 2026-10-18 15:03
+
+import django_fsm
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vital_records", "0019_vitalrecordsrequest_bundle_claimed_until"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="vitalrecordsrequest",
+            name="status",
+            field=django_fsm.FSMField(
+                choices=[
+                    ("initialized", "Initialized"),
+                    ("started", "Started"),
+                    ("submitted", "Request Submitted"),
+                    ("enqueued", "Request Enqueued"),
+                    ("packaged", "Request Packaged"),
+                    ("sent", "Request Sent"),
+                    ("finished", "Finished"),
+                    ("failed", "Packaging Failed"),
+                ],
+                default="initialized",
+                max_length=50,
+            ),
+        ),
+    ]
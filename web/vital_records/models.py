@@ -1,6 +1,8 @@
+from datetime import timedelta
+from typing import Sequence
 from uuid import UUID, uuid4
 
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django_fsm import FSMField, transition
 
@@ -16,6 +18,7 @@ class VitalRecordsRequest(models.Model):
         ("packaged", "Request Packaged"),
         ("sent", "Request Sent"),
         ("finished", "Finished"),
+        ("failed", "Packaging Failed"),
     ]
 
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
@@ -53,6 +56,15 @@ class VitalRecordsRequest(models.Model):
     enqueued_at = models.DateTimeField(null=True, blank=True)
     packaged_at = models.DateTimeField(null=True, blank=True)
     sent_at = models.DateTimeField(null=True, blank=True)
+    # the key of the request's package in the package store, see `web.vital_records.tasks.store`
+    package_hash = models.CharField(max_length=64, blank=True)
+    # the number of times a batch package task claimed the request, and when that claim runs out
+    package_attempts = models.IntegerField(default=0)
+    package_claimed_until = models.DateTimeField(null=True, blank=True)
+    # when a bundle task's claim on the request runs out, and why the request's package couldn't be bundled, if it
+    # couldn't, see `web.vital_records.tasks.bundle`
+    bundle_claimed_until = models.DateTimeField(null=True, blank=True)
+    bundle_error = models.TextField(blank=True)
 
     @staticmethod
     def get_with_status(request_id: UUID, required_status: str):
@@ -77,9 +89,105 @@ class VitalRecordsRequest(models.Model):
     def get_finished():
         return VitalRecordsRequest.objects.filter(status="finished")
 
+    @staticmethod
+    def claim_enqueued(
+        count: int, fields: Sequence[str] = None, max_attempts: int = 3, lease: timedelta = timedelta(minutes=5)
+    ) -> list:
+        """
+        Claim up to `count` of the `enqueued` requests, fewest attempts then oldest first. With `fields`, return
+        `.values()` rows of just those fields (and `package_attempts`) instead of model instances.
+
+        Each claimed request's `package_attempts` is counted, and it isn't claimed again until `lease` has passed, so
+        a request that fails to be packaged is retried by a later batch, rather than claimed first by every batch. A
+        request that's been claimed `max_attempts` times isn't claimed again.
+
+        The claim is committed before returning, so the rows aren't locked while the requests are packaged.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            # on databases that support it, rows already locked by a concurrent claim are skipped
+            claimable = (
+                VitalRecordsRequest.objects.select_for_update(skip_locked=True)
+                .filter(status="enqueued", package_attempts__lt=max_attempts)
+                .filter(models.Q(package_claimed_until__isnull=True) | models.Q(package_claimed_until__lte=now))
+            )
+            ids = list(claimable.order_by("package_attempts", "enqueued_at").values_list("id", flat=True)[:count])
+            VitalRecordsRequest.objects.filter(pk__in=ids).update(
+                package_attempts=models.F("package_attempts") + 1, package_claimed_until=now + lease
+            )
+
+        claimed = VitalRecordsRequest.objects.filter(pk__in=ids)
+        if fields:
+            claimed = claimed.values(*dict.fromkeys((*fields, "package_attempts")))
+        return list(claimed.order_by("package_attempts", "enqueued_at"))
+
+    @staticmethod
+    def claim_sent(count: int, lease: timedelta = timedelta(minutes=5)) -> list["VitalRecordsRequest"]:
+        """
+        Claim up to `count` of the oldest requests in the `sent` state. A claimed request isn't claimed again until
+        `lease` has passed, or the claim is released with `release_sent()`.
+
+        The claim is committed before returning, like `claim_enqueued()`, so the rows aren't locked while the requests
+        are bundled and sent.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            claimable = (
+                VitalRecordsRequest.objects.select_for_update(skip_locked=True)
+                .filter(status="sent")
+                .filter(models.Q(bundle_claimed_until__isnull=True) | models.Q(bundle_claimed_until__lte=now))
+            )
+            ids = list(claimable.order_by("sent_at").values_list("id", flat=True)[:count])
+            VitalRecordsRequest.objects.filter(pk__in=ids).update(bundle_claimed_until=now + lease)
+        return list(VitalRecordsRequest.objects.filter(pk__in=ids).order_by("sent_at"))
+
+    @staticmethod
+    def release_sent(request_ids: Sequence[UUID]) -> int:
+        """Release the claims on the requests with matching IDs, so they can be claimed again. Returns the number released."""
+        return VitalRecordsRequest.objects.filter(pk__in=request_ids).update(bundle_claimed_until=None)
+
+    @staticmethod
+    def complete_package_many(packages: dict[UUID, str]) -> int:
+        """
+        Move the `enqueued` requests with matching IDs to `packaged` with a single update, recording each request's
+        package hash. Returns the number updated.
+        """
+        if not packages:
+            return 0
+        package_hash = models.Case(*(models.When(pk=pk, then=models.Value(key)) for pk, key in packages.items()))
+        return VitalRecordsRequest.objects.filter(pk__in=packages.keys(), status="enqueued").update(
+            status="packaged", packaged_at=timezone.now(), package_hash=package_hash
+        )
+
+    @staticmethod
+    def get_exhausted(max_attempts: int) -> list[UUID]:
+        """
+        Return the IDs of the `enqueued` requests claimed `max_attempts` times by `claim_enqueued()`, whose last claim
+        has run out, e.g. because the task packaging them was stopped.
+        """
+        return list(
+            VitalRecordsRequest.objects.filter(status="enqueued", package_attempts__gte=max_attempts)
+            .filter(models.Q(package_claimed_until__isnull=True) | models.Q(package_claimed_until__lte=timezone.now()))
+            .values_list("id", flat=True)
+        )
+
+    @staticmethod
+    def fail_package_many(request_ids: Sequence[UUID]) -> int:
+        """
+        Move the `enqueued` requests with matching IDs to `failed` with a single update. Returns the number updated.
+        """
+        return VitalRecordsRequest.objects.filter(pk__in=request_ids, status="enqueued").update(status="failed")
+
+    @staticmethod
+    def finish_many(request_ids: Sequence[UUID]) -> int:
+        """
+        Move the `sent` requests with matching IDs to `finished` with a single update. Returns the number updated.
+        """
+        return VitalRecordsRequest.objects.filter(pk__in=request_ids, status="sent").update(status="finished")
+
     @property
     def already_submitted(self):
-        return self.status in ["submitted", "enqueued", "packaged", "sent", "finished"]
+        return self.status in ["submitted", "enqueued", "packaged", "sent", "finished", "failed"]
 
     # Transitions from state to state
     @transition(field=status, source="initialized", target="started")
@@ -122,3 +230,143 @@ class VitalRecordsRequestMetadata(models.Model):
     class Meta:
         verbose_name = "Request metadata"
         verbose_name_plural = "Request metadata"
+
+
+class OutboundEmail(models.Model):
+    """An email queued for delivery by the email dispatcher, see `web.vital_records.tasks.delivery`.
+
+    The dispatcher claims `queued` emails as `submitting` and submits them to the provider, then polls the provider
+    until each `submitted` email is `delivered`. A failed submission or delivery is queued again after a backoff, until
+    the retries run out and the email is `failed`.
+    """
+
+    STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("submitting", "Submitting"),
+        ("submitted", "Submitted"),
+        ("delivered", "Delivered"),
+        ("failed", "Failed"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    request_id = models.UUIDField(editable=False, db_index=True)
+    # who the email is for, e.g. "office" or "requestor"
+    recipient = models.CharField(max_length=20)
+    to_address = models.CharField(max_length=128)
+    subject = models.CharField(max_length=256)
+    text_content = models.TextField()
+    html_content = models.TextField()
+    # the attached package, a key in the package store; blank for no attachment
+    attachment_package = models.CharField(max_length=256, blank=True)
+    attachment_filename = models.CharField(max_length=256, blank=True)
+    status = FSMField(default="queued", choices=STATUS_CHOICES)
+    # the number of times the email was submitted, or failed to be
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # the provider's ID for the submitted email, used to poll its status
+    operation_id = models.CharField(max_length=64, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    @staticmethod
+    def claim_due(lease: timedelta) -> "OutboundEmail | None":
+        """
+        Claim the `queued` email that's been due the longest, moving it to `submitting`, or None if none are due.
+
+        The claim is committed before returning, so the row isn't locked while the email is submitted. An email left
+        `submitting` for longer than `lease`, e.g. by a dispatcher that stopped mid-submit, is due to be claimed again.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            # on databases that support it, rows already locked by a concurrent claim are skipped
+            email = (
+                OutboundEmail.objects.select_for_update(skip_locked=True)
+                .filter(status__in=["queued", "submitting"], next_attempt_at__lte=now)
+                .order_by("next_attempt_at")
+                .first()
+            )
+            if email is None:
+                return None
+            email.start_submit(now + lease)
+            email.save()
+        return email
+
+    @staticmethod
+    def claim_submitted(lease: timedelta) -> "OutboundEmail | None":
+        """
+        Claim the `submitted` email that's been due to be polled the longest, or None if none are due, committed like
+        `claim_due()`. The email isn't due again until `lease` has passed, unless it's saved with another time first.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            email = (
+                OutboundEmail.objects.select_for_update(skip_locked=True)
+                .filter(status="submitted", next_attempt_at__lte=now)
+                .order_by("next_attempt_at")
+                .first()
+            )
+            if email is None:
+                return None
+            email.next_attempt_at = now + lease
+            email.save(update_fields=["next_attempt_at"])
+        return email
+
+    # Transitions from state to state
+    @transition(field=status, source=["queued", "submitting"], target="submitting")
+    def start_submit(self, claimed_until):
+        self.attempts += 1
+        self.next_attempt_at = claimed_until
+
+    @transition(field=status, source="submitting", target="submitted")
+    def complete_submit(self, operation_id: str):
+        self.operation_id = operation_id
+        self.last_error = ""
+
+    @transition(field=status, source="submitted", target="delivered")
+    def complete_delivery(self):
+        self.delivered_at = timezone.now()
+
+    @transition(field=status, source=["submitting", "submitted"], target="queued")
+    def retry(self, error: str, next_attempt_at):
+        self.last_error = error
+        self.next_attempt_at = next_attempt_at
+
+    @transition(field=status, source=["submitting", "submitted"], target="failed")
+    def fail(self, error: str):
+        self.last_error = error
+
+
+class RequestSubmission(models.Model):
+    """A request waiting in the outbox to be queued for packaging, see `web.vital_records.tasks.outbox`.
+
+    Used with `VITAL_RECORDS_SUBMIT_OUTBOX`: saved in the same transaction as the request's move to `enqueued`, so an
+    enqueued request is always queued, however long the queue takes to get to.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    request_id = models.UUIDField(editable=False, unique=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    @staticmethod
+    def claim(count: int) -> list["RequestSubmission"]:
+        """
+        Return up to `count` of the oldest submissions.
+
+        Must be called inside a transaction: on databases that support it, the rows are locked until the transaction
+        ends, and rows already locked by another transaction are skipped.
+        """
+        return list(RequestSubmission.objects.select_for_update(skip_locked=True).order_by("id")[:count])
+
+
+class StoredPackage(models.Model):
+    """A rendered package, shared between task workers through the database, see `DatabasePackageStore`."""
+
+    # the package's key in the package store
+    key = models.CharField(max_length=64, primary_key=True)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
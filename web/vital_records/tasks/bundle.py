@@ -0,0 +1,148 @@
+import csv
+from datetime import timedelta
+from io import BytesIO, StringIO
+import logging
+import os
+import zipfile
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.utils import timezone
+
+from web.core.tasks import Task
+from web.vital_records.models import VitalRecordsRequest
+from web.vital_records.tasks.package import APPLICATIONS
+from web.vital_records.tasks.store import get_package_store
+from web.vital_records.tasks.utils import get_package_filename
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_SCHEDULE = "vital-records-bundle"
+MANIFEST_FILENAME = "manifest.csv"
+# room left in each archive for the manifest and the zip directory
+BUNDLE_OVERHEAD = 64 * 1024
+# the package file name and request ID, then every record type's application fields, in order of first appearance
+MANIFEST_FIELDS = tuple(
+    dict.fromkeys(("package", "package_id", *(name for schema in APPLICATIONS.values() for name in schema.names)))
+)
+
+
+def run_bundle_task():
+    """Submit a bundle task to the task queue for processing. Scheduled by the `schedule_bundles` command."""
+    logger.debug("Creating bundle task")
+    # create a new task instance
+    task = BundleTask()
+    # calling task.run() submits the task to the queue for processing
+    task.run()
+    # if callers want to interrogate the status, etc.
+    return task
+
+
+def build_bundle(requests: list[VitalRecordsRequest], max_bytes: int = None) -> tuple[bytes, list[VitalRecordsRequest]]:
+    """A zip archive of the packages for requests, along with a CSV manifest of their application fields, and the
+    requests in it.
+
+    With max_bytes, requests stop being added once the next package would take the archive over it, and are left for
+    the next bundle. A request whose package can't be read, or is too large for any bundle, is left out with its
+    `bundle_error` set.
+    """
+    manifest = StringIO()
+    writer = csv.DictWriter(manifest, fieldnames=MANIFEST_FIELDS)
+    writer.writeheader()
+    bundled = []
+
+    output_stream = BytesIO()
+    # PDF streams are already compressed, so packages are stored as-is
+    with zipfile.ZipFile(output_stream, "w", compression=zipfile.ZIP_STORED) as archive:
+        for request in requests:
+            filename = os.path.basename(get_package_filename(request))
+            try:
+                with get_package_store().local_file(request.package_hash) as package_filename:
+                    size = os.path.getsize(package_filename)
+                    if max_bytes and size + BUNDLE_OVERHEAD > max_bytes:
+                        request.bundle_error = f"Package is too large to bundle: {size} bytes"
+                        continue
+                    if max_bytes and output_stream.tell() + size + BUNDLE_OVERHEAD > max_bytes:
+                        break
+                    archive.write(package_filename, filename)
+            except OSError as ex:
+                request.bundle_error = f"Couldn't read package: {ex}"
+                continue
+            writer.writerow({"package": filename, "package_id": request.id, **APPLICATIONS[request.type].fill(request)})
+            bundled.append(request)
+        archive.writestr(MANIFEST_FILENAME, manifest.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+
+    return output_stream.getvalue(), bundled
+
+
+class BundleTask(Task):
+    """Deliver the packages of requests in the `sent` state to the office in bundles, rather than one email each.
+
+    Used when `VITAL_RECORDS_BUNDLE_MINUTES` is set: `EmailTask` then only sends the requestor's confirmation, and
+    moves the request to `sent`. Each bundle is a zip archive of up to `bundle_size` packages, and up to
+    `VITAL_RECORDS_BUNDLE_MAX_BYTES`, with a CSV manifest, emailed to `VITAL_RECORDS_EMAIL_TO`; its requests are then
+    moved to `finished`. Bundles are sent until no `sent` requests are left.
+
+    Requests are claimed for a bundle, and the claim committed, before the bundle is sent, so no rows are locked while
+    the email goes out. If sending fails, the requests are left `sent`, and bundled again once the claim runs out.
+
+    A request whose package can't be bundled doesn't fail its bundle: its `bundle_error` is logged as an error, and
+    it's finished without its package, rather than left `sent`, and its data kept, for good.
+    """
+
+    group = "vital-records"
+    name = "bundle"
+    queue = "maintenance"
+
+    def __init__(self, bundle_size: int = None):
+        super().__init__(bundle_size=bundle_size or settings.VITAL_RECORDS_BUNDLE_SIZE)
+
+    def send_bundle(self, requests: list[VitalRecordsRequest], bundle: bytes) -> int:
+        """Email a bundle of the packages for requests to the office. Returns the number of emails sent."""
+        now = timezone.localtime()
+        email = EmailMessage(
+            subject=f"Completed: {len(requests)} Vital Record Requests",
+            body=(
+                f"Attached are {len(requests)} completed vital record request packages, "
+                f"listed with their application details in {MANIFEST_FILENAME}."
+            ),
+            to=[settings.VITAL_RECORDS_EMAIL_TO],
+        )
+        email.attach(f"vital-records-{now.strftime("%Y-%m-%d-%H%M%S")}.zip", bundle, "application/zip")
+        return email.send()
+
+    def handler(self, bundle_size: int) -> int:
+        logger.info("Running bundle task")
+        bundled = 0
+
+        # claimed for as long as a task can run
+        lease = timedelta(seconds=settings.Q_CLUSTER["timeout"])
+
+        while True:
+            requests = VitalRecordsRequest.claim_sent(bundle_size, lease)
+            if not requests:
+                break
+            bundle, requests_bundled = build_bundle(requests, settings.VITAL_RECORDS_BUNDLE_MAX_BYTES)
+
+            flagged = [request for request in requests if request.bundle_error]
+            for request in flagged:
+                logger.error(f"Finishing request without bundling its package: {request.id}, {request.bundle_error}")
+                request.save(update_fields=["bundle_error"])
+            VitalRecordsRequest.finish_many([request.id for request in flagged])
+            # requests that didn't fit go in the next bundle
+            VitalRecordsRequest.release_sent(
+                [request.id for request in requests if request not in requests_bundled and not request.bundle_error]
+            )
+            if not requests_bundled:
+                if flagged:
+                    continue
+                break
+
+            self.send_bundle(requests_bundled, bundle)
+            VitalRecordsRequest.finish_many([request.id for request in requests_bundled])
+
+            logger.debug(f"Bundle of {len(requests_bundled)} request packages sent to CDPH")
+            bundled += len(requests_bundled)
+
+        logger.info(f"Bundle task sent {bundled} request packages")
+        return bundled
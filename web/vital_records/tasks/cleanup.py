@@ -4,7 +4,8 @@ from pathlib import Path
 from django.utils import timezone
 
 from web.core.tasks import Task
-from web.vital_records.models import VitalRecordsRequest, VitalRecordsRequestMetadata
+from web.vital_records.models import OutboundEmail, VitalRecordsRequest, VitalRecordsRequestMetadata
+from web.vital_records.tasks.store import get_package_store
 from web.vital_records.tasks.utils import get_package_filename
 
 logger = logging.getLogger(__name__)
@@ -30,12 +31,17 @@ class CleanupTask(Task):
 
     group = "vital-records"
     name = "cleanup"
+    queue = "maintenance"
 
     def clean_file(self, request: VitalRecordsRequest) -> bool:
         """Deletes the package file for this request."""
         # delete the package file
         success = True
-        filename = get_package_filename(request)
+        if request.package_hash:
+            filename = get_package_store().path(request.package_hash)
+        else:
+            # packaged before the package store existed
+            filename = get_package_filename(request)
         logger.debug(f"Deleting package file: {filename}")
         request_file = Path(filename)
 
@@ -50,18 +56,27 @@ class CleanupTask(Task):
                 success = False
                 logger.warning(f"Couldn't delete package file: {filename}")
 
+        if success and request.package_hash:
+            # and its shared copy, with VITAL_RECORDS_PACKAGE_STORE_SHARED
+            get_package_store().discard(request.package_hash)
+
         return success
 
     def clean_record(self, request: VitalRecordsRequest) -> bool:
         """Deletes the database record for this request."""
         # save the request.id for use later, after the record is deleted
-        logger.debug(f"Deleting record: {request.id}")
+        request_id = request.id
+        logger.debug(f"Deleting record: {request_id}")
         # delete the request record
         try:
             count, _ = request.delete()
         except ValueError:
             count = 0
 
+        if count == 1:
+            # and any emails queued for it with VITAL_RECORDS_EMAIL_DISPATCHER
+            OutboundEmail.objects.filter(request_id=request_id).delete()
+
         return count == 1
 
     def clean_request(self, request: VitalRecordsRequest) -> bool:
@@ -113,6 +128,10 @@ class CleanupTask(Task):
             if self.clean_request(request):
                 cleaned_count += 1
 
+        purged_count = get_package_store().purge()
+        if purged_count > 0:
+            logger.debug(f"Purged {purged_count} expired packages")
+
         result = True
         if batch_count > 0:
             if batch_count == cleaned_count:
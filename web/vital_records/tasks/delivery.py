@@ -0,0 +1,320 @@
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+import logging
+import random
+import threading
+import time
+from typing import Iterable, Iterator
+from uuid import UUID, uuid4
+
+from azure.core.rest import HttpRequest
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.utils import timezone
+
+from web.core.mail import EmailBackend, FileAttachment
+from web.vital_records.models import OutboundEmail, VitalRecordsRequest
+from web.vital_records.tasks.email import package_file
+
+logger = logging.getLogger(__name__)
+
+# the status of a submitted email, as reported by a delivery client
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# the number of emails submitted, or polled, in one go
+DISPATCH_BATCH_SIZE = 20
+# how long to wait before polling a submitted email's status (again)
+POLL_INTERVAL = timedelta(seconds=5)
+# how long an email stays claimed by a dispatcher that's submitting or polling it; if the dispatcher stops mid-call, the
+# email is claimed again after this
+CLAIM_LEASE = timedelta(minutes=10)
+# the longest wait between retries of an email
+MAX_BACKOFF_SECONDS = 60 * 60
+
+
+class DeliveryError(Exception):
+    """The email provider couldn't take, or report on, an email."""
+
+
+class AzureDeliveryClient:
+    """Submits emails to Azure Communication Email without waiting for them to be delivered, and polls their status.
+
+    https://learn.microsoft.com/en-us/rest/api/communication/dataplane/email/get-send-result
+    """
+
+    def __init__(self, backend: EmailBackend):
+        # converts Django messages to the provider's request bodies, streaming attachments where it can
+        self.backend = backend
+        self.client = backend.client
+
+    def submit(self, message: EmailMultiAlternatives) -> str:
+        """Submit message for delivery, and return its operation ID."""
+        operation_id = str(uuid4())
+        # no polling: just the request that accepts the email, not the wait for it to be delivered
+        self.client.begin_send(self.backend.convert_message(message), operation_id=operation_id, polling=False)
+        return operation_id
+
+    def status(self, operation_id: str) -> str:
+        """The delivery status of a submitted email: `RUNNING`, `SUCCEEDED` or `FAILED`."""
+        request = HttpRequest(
+            "GET", f"/emails/operations/{operation_id}", params={"api-version": self.client._config.api_version}
+        )
+        response = self.client.send_request(request)
+        if response.status_code != 200:
+            raise DeliveryError(f"Couldn't get the status of email operation: {operation_id} ({response.status_code})")
+
+        status = response.json().get("status")
+        if status == "Succeeded":
+            return SUCCEEDED
+        if status in ("Failed", "Canceled"):
+            return FAILED
+        return RUNNING
+
+
+class LocalDeliveryClient:
+    """Delivers emails through Django's email backend (e.g. to files in development), standing in for the provider.
+
+    Each call takes `latency` seconds, and fails with a `DeliveryError` for `error_rate` of calls, to exercise the
+    dispatcher's backoff and circuit breaker. `failure_rate` of the submitted emails are reported as failed deliveries.
+    """
+
+    def __init__(self, latency: float = 0, error_rate: float = 0, failure_rate: float = 0, rng: random.Random = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.failure_rate = failure_rate
+        self.rng = rng or random.Random()
+        self._statuses = {}
+
+    def _call(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.rng.random() < self.error_rate:
+            raise DeliveryError("Injected provider error")
+
+    def submit(self, message: EmailMultiAlternatives) -> str:
+        self._call()
+        operation_id = str(uuid4())
+        if self.rng.random() < self.failure_rate:
+            self._statuses[operation_id] = FAILED
+        else:
+            with get_connection() as connection:
+                connection.send_messages([message])
+            self._statuses[operation_id] = SUCCEEDED
+        return operation_id
+
+    def status(self, operation_id: str) -> str:
+        self._call()
+        # emails are delivered as they're submitted, so one submitted before a restart was delivered too
+        return self._statuses.get(operation_id, SUCCEEDED)
+
+
+def get_delivery_client():
+    if settings.AZURE_COMMUNICATION_CONNECTION_STRING or settings.AZURE_COMMUNICATION_ENDPOINT:
+        return AzureDeliveryClient(
+            EmailBackend(
+                connection_string=settings.AZURE_COMMUNICATION_CONNECTION_STRING,
+                endpoint=settings.AZURE_COMMUNICATION_ENDPOINT,
+                tenant_id=settings.AZURE_TENANT_ID,
+            )
+        )
+    return LocalDeliveryClient(settings.VITAL_RECORDS_EMAIL_STUB_LATENCY, settings.VITAL_RECORDS_EMAIL_STUB_ERROR_RATE)
+
+
+class CircuitBreaker:
+    """Pauses calls to the email provider while it's degraded.
+
+    The breaker starts closed, and calls go through. After `threshold` provider errors in a row it opens, and calls are
+    held back for `reset_seconds`. It's then half-open: the next call goes through as a trial, which closes the breaker
+    again on success, or re-opens it on error.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold: int, reset_seconds: float, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.errors = 0
+        self.opened_at = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_seconds:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        return self.state != self.OPEN
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Email provider recovered, resuming sending")
+        self.errors = 0
+        self.opened_at = None
+
+    def record_error(self):
+        self.errors += 1
+        if self.state == self.HALF_OPEN or (self.opened_at is None and self.errors >= self.threshold):
+            logger.warning(f"Email provider degraded, pausing sending for {self.reset_seconds} seconds")
+            self.opened_at = self.clock()
+
+
+def backoff(attempts: int) -> timedelta:
+    """How long to wait before retrying an email after `attempts` attempts: `VITAL_RECORDS_EMAIL_BACKOFF_SECONDS`,
+    doubling with each attempt up to an hour, and jittered so a burst of failed emails isn't retried all at once.
+    """
+    seconds = min(settings.VITAL_RECORDS_EMAIL_BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+    return timedelta(seconds=seconds * random.uniform(0.5, 1))
+
+
+@contextmanager
+def build_message(email: OutboundEmail) -> Iterator[EmailMultiAlternatives]:
+    """The message to submit for an outbound email, with its package file kept for as long as the context is open."""
+    message = EmailMultiAlternatives(subject=email.subject, body=email.text_content, to=[email.to_address])
+    message.attach_alternative(email.html_content, "text/html")
+    if not email.attachment_package:
+        yield message
+        return
+    with package_file(email.attachment_package) as filename:
+        message.attach(FileAttachment(filename, email.attachment_filename, "application/pdf"))
+        yield message
+
+
+class Dispatcher:
+    """Delivers the emails queued by `EmailTask` with `VITAL_RECORDS_EMAIL_DISPATCHER`, apart from the task workers.
+
+    Each tick submits the `queued` emails that are due, without waiting for them to be delivered, then polls the
+    provider for the status of `submitted` emails. An email that fails is queued again after a `backoff()`, up to
+    `VITAL_RECORDS_EMAIL_RETRIES` times. While the provider is degraded, the circuit breaker pauses submitting and
+    polling. Once all of a request's emails are delivered, the request is moved on, as `EmailTask` does after sending.
+
+    Usage:
+
+        dispatcher = Dispatcher()
+        dispatcher.run(interval=1)  # until stopped, see `python manage.py dispatch_emails`
+    """
+
+    def __init__(self, client=None, breaker: CircuitBreaker = None, batch_size: int = DISPATCH_BATCH_SIZE):
+        self.client = client or get_delivery_client()
+        self.breaker = breaker or CircuitBreaker(
+            settings.VITAL_RECORDS_EMAIL_BREAKER_THRESHOLD, settings.VITAL_RECORDS_EMAIL_BREAKER_SECONDS
+        )
+        self.batch_size = batch_size
+
+    def _retry(self, email: OutboundEmail, error: str):
+        """Queue email again after a backoff, or give up on it once its retries are used up."""
+        if email.attempts > settings.VITAL_RECORDS_EMAIL_RETRIES:
+            logger.error(f"Giving up on {email.recipient} email for: {email.request_id} after {email.attempts} attempts")
+            email.fail(error)
+        else:
+            email.retry(error, timezone.now() + backoff(email.attempts))
+        email.save()
+
+    def submit_due(self) -> int:
+        """Submit up to `batch_size` of the queued emails that are due. Returns the number submitted.
+
+        Each email is claimed, and its claim committed, before it's submitted, and its result is saved after: no rows
+        are locked while the provider is called.
+        """
+        submitted = 0
+        for _ in range(self.batch_size):
+            if not self.breaker.allow():
+                break
+            email = OutboundEmail.claim_due(CLAIM_LEASE)
+            if email is None:
+                break
+            with ExitStack() as stack:
+                try:
+                    message = stack.enter_context(build_message(email))
+                except OSError as ex:
+                    logger.exception(f"Couldn't build {email.recipient} email for: {email.request_id}")
+                    self._retry(email, str(ex))
+                    continue
+                try:
+                    operation_id = self.client.submit(message)
+                except Exception as ex:
+                    logger.warning(f"Couldn't submit {email.recipient} email for: {email.request_id}", exc_info=True)
+                    self.breaker.record_error()
+                    self._retry(email, str(ex) or type(ex).__name__)
+                    continue
+            self.breaker.record_success()
+            email.complete_submit(operation_id)
+            email.next_attempt_at = timezone.now() + POLL_INTERVAL
+            email.save()
+            submitted += 1
+        return submitted
+
+    def poll_submitted(self) -> list[UUID]:
+        """Poll the status of up to `batch_size` of the submitted emails that are due, claimed like `submit_due()`.
+        Returns the request ID of each delivered email."""
+        delivered = []
+        for _ in range(self.batch_size):
+            if not self.breaker.allow():
+                break
+            email = OutboundEmail.claim_submitted(CLAIM_LEASE)
+            if email is None:
+                break
+            try:
+                status = self.client.status(email.operation_id)
+            except Exception:
+                logger.warning(f"Couldn't poll {email.recipient} email for: {email.request_id}", exc_info=True)
+                self.breaker.record_error()
+                status = RUNNING
+            else:
+                self.breaker.record_success()
+
+            if status == SUCCEEDED:
+                email.complete_delivery()
+                delivered.append(email.request_id)
+            elif status == FAILED:
+                self._retry(email, f"Delivery failed for operation: {email.operation_id}")
+                continue
+            else:
+                email.next_attempt_at = timezone.now() + POLL_INTERVAL
+            email.save()
+        return delivered
+
+    def complete_requests(self, request_ids: Iterable[UUID]) -> int:
+        """Move each `packaged` request whose emails are all delivered on. Returns the number of requests moved."""
+        bundled = settings.VITAL_RECORDS_BUNDLE_MINUTES > 0
+        completed = 0
+        for request_id in set(request_ids):
+            if OutboundEmail.objects.filter(request_id=request_id).exclude(status="delivered").exists():
+                continue
+            request = VitalRecordsRequest.objects.filter(pk=request_id, status="packaged").first()
+            if request is None:
+                continue
+            request.complete_send()
+            if not bundled:
+                # otherwise the request is finished once its package is bundled
+                request.finish()
+            request.save()
+            logger.debug(f"Request emails delivered for: {request_id}")
+            completed += 1
+        return completed
+
+    def tick(self) -> tuple[int, int]:
+        """Submit due emails, and poll submitted ones. Returns the number of emails submitted and delivered."""
+        submitted = self.submit_due() if self.breaker.allow() else 0
+        delivered = self.poll_submitted() if self.breaker.allow() else []
+        self.complete_requests(delivered)
+        return submitted, len(delivered)
+
+    def run(self, interval: float, stop: threading.Event = None):
+        """Tick every `interval` seconds, until stop is set."""
+        stop = stop or threading.Event()
+        logger.info("Email dispatcher started")
+        while not stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                # e.g. the database is unavailable; the emails are still there for the next tick
+                logger.exception("Email dispatcher tick failed")
+            stop.wait(interval)
+        logger.info("Email dispatcher stopped")
@@ -1,38 +1,159 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 import logging
+import os
+import threading
+from typing import Iterator, Sequence
 from uuid import UUID
 
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
+from django.template import engines
+from django.template.loader import get_template, render_to_string
+from django.utils.html import escape
 
+from web.core.mail import FileAttachment
 from web.core.tasks import Task
-from web.vital_records.models import VitalRecordsRequest
+from web.vital_records.models import OutboundEmail, VitalRecordsRequest
+from web.vital_records.tasks.store import get_package_store
+from web.vital_records.tasks.utils import get_package_filename
 
 logger = logging.getLogger(__name__)
 
 EMAIL_HTML_TEMPLATE = "vital_records/email.html"
 EMAIL_TXT_TEMPLATE = EMAIL_HTML_TEMPLATE.replace(".html", ".txt")
 
+# the recipients of a request's emails
+OFFICE = "office"
+REQUESTOR = "requestor"
+
+LOGO_URL = "https://webstandards.ca.gov/wp-content/uploads/sites/8/2024/10/cagov-logo-coastal-flat.png"
+# the record types, as named in the email
+RECORD_TYPES = {
+    "birth": "Birth",
+    "marriage": "Marriage",
+    "death": "Death",
+}
+# rendered in place of the requestor's email address, which is substituted for each message
+EMAIL_ADDRESS_PLACEHOLDER = "__email_address__"
+
+
+class EmailBodies:
+    """The rendered text and HTML bodies of the request email, for each record type and number of copies.
+
+    Apart from the requestor's email address, the bodies only depend on those two, so the templates are rendered once
+    for each combination with a placeholder for the address, and the (escaped) address is substituted for each
+    message. When a template file changes, every body is rendered again from the new template.
+
+    Usage:
+
+        text_content, html_content = email_bodies.get("Birth", 1, "jane@example.com")
+    """
+
+    def __init__(self, *template_names: str):
+        self.template_names = template_names
+        # (request_type, number_of_copies) -> for each template, its body split on the placeholder
+        self._bodies: dict[tuple[str, int], tuple[list[str], ...]] = {}
+        self._mtimes = None
+        self._lock = threading.Lock()
+
+    def _template_mtimes(self) -> tuple[int, ...]:
+        return tuple(os.stat(get_template(name).origin.name).st_mtime_ns for name in self.template_names)
+
+    def _render(self, request_type: str, number_of_copies: int) -> tuple[list[str], ...]:
+        context = {
+            "number_of_copies": number_of_copies,
+            "logo_url": LOGO_URL,
+            "email_address": EMAIL_ADDRESS_PLACEHOLDER,
+            "request_type": request_type,
+        }
+        return tuple(render_to_string(name, context).split(EMAIL_ADDRESS_PLACEHOLDER) for name in self.template_names)
+
+    def _check_templates(self):
+        """Clear the rendered bodies if a template file changed since they were rendered."""
+        mtimes = self._template_mtimes()
+        if mtimes == self._mtimes:
+            return
+        if self._mtimes is not None:
+            logger.debug("Email templates changed, rendering them again")
+            # the cached template loaders still hold the old templates
+            for engine in engines.all():
+                for loader in getattr(getattr(engine, "engine", None), "template_loaders", ()):
+                    if hasattr(loader, "reset"):
+                        loader.reset()
+        self._bodies.clear()
+        self._mtimes = mtimes
+
+    def preload(self, request_types=RECORD_TYPES.values(), copies=(1,)):
+        """Render the bodies for each of request_types and copies ahead of the first email, e.g. at worker startup."""
+        with self._lock:
+            self._check_templates()
+            for request_type in request_types:
+                for number_of_copies in copies:
+                    self._bodies[request_type, number_of_copies] = self._render(request_type, number_of_copies)
+
+    def get(self, request_type: str, number_of_copies: int, email_address: str) -> tuple[str, ...]:
+        """Each template's body for request_type and number_of_copies, addressed to email_address."""
+        key = (request_type, number_of_copies)
+        with self._lock:
+            self._check_templates()
+            bodies = self._bodies.get(key)
+            if bodies is None:
+                bodies = self._bodies[key] = self._render(*key)
+        address = escape(email_address)
+        return tuple(address.join(parts) for parts in bodies)
+
+    def clear(self):
+        """Forget every rendered body."""
+        with self._lock:
+            self._bodies.clear()
+            self._mtimes = None
+
+
+email_bodies = EmailBodies(EMAIL_TXT_TEMPLATE, EMAIL_HTML_TEMPLATE)
+
+
+@contextmanager
+def package_file(package: str) -> Iterator[str]:
+    """The file for package, for as long as the context is open: a key in the package store, or the path of a package
+    written before the store existed.
+    """
+    if os.path.isabs(package):
+        yield package
+        return
+    with get_package_store().local_file(package) as filename:
+        yield filename
+
 
 class EmailTask(Task):
+    """Email the request package to the office, and a confirmation to the requestor.
+
+    Both messages go through a single backend connection, or with `VITAL_RECORDS_EMAIL_CONCURRENT`, are sent at the
+    same time, each through its own connection. The result is the number of messages sent to each recipient. When
+    one of them fails, a new task is queued to send just that one again (up to `VITAL_RECORDS_EMAIL_RETRIES` times);
+    the request moves on once every message is sent.
+
+    With `VITAL_RECORDS_EMAIL_DISPATCHER`, the messages are queued for the email dispatcher instead, and the result is
+    the ID of each queued `OutboundEmail`.
+    """
+
     group = "vital-records"
     name = "email"
+    queue = "requests"
+    dedup_key = "email:{request_id}"
 
-    def __init__(self, request_id: UUID, package: str):
-        super().__init__(request_id=request_id, package=package)
+    def __init__(self, request_id: UUID, package: str, recipients: Sequence[str] = None, attempt: int = 1):
+        super().__init__(request_id=request_id, package=package, recipients=recipients, attempt=attempt)
 
     def _format_record_type(self, record_type: str) -> str:
         """
         Checks the value of the record type and returns a
         string formatted for the email template.
         """
-        type_format = {
-            "birth": "Birth",
-            "marriage": "Marriage",
-            "death": "Death",
-        }
+        return RECORD_TYPES.get(record_type)
 
-        return type_format.get(record_type)
+    def _package_file(self, package: str):
+        return package_file(package)
 
     def _create_base_email(
         self, subject: str, to_address: list[str], text_content: str, html_content: str
@@ -46,43 +167,133 @@ class EmailTask(Task):
         email.attach_alternative(html_content, "text/html")
         return email
 
-    def handler(self, request_id: UUID, package: str):
+    def _send_message(self, recipient: str, message: EmailMessage, connection=None) -> int:
+        """Send message, through connection or a new one. Returns the number sent: 0 if sending failed."""
+        try:
+            if connection is None:
+                with get_connection() as connection:
+                    return connection.send_messages([message])
+            return connection.send_messages([message])
+        except Exception:
+            logger.exception(f"Couldn't send email to the {recipient}")
+            return 0
+
+    def _queue(
+        self,
+        request: VitalRecordsRequest,
+        package: str,
+        recipients: Sequence[str],
+        subject: str,
+        text_content: str,
+        html_content: str,
+    ) -> dict[str, int]:
+        """Queue each recipient's email for the email dispatcher, and return the ID of each queued email."""
+        addresses = {OFFICE: settings.VITAL_RECORDS_EMAIL_TO, REQUESTOR: request.email_address}
+        emails = [
+            OutboundEmail(
+                request_id=request.id,
+                recipient=recipient,
+                to_address=addresses[recipient],
+                subject=subject,
+                text_content=text_content,
+                html_content=html_content,
+            )
+            for recipient in recipients
+        ]
+        for email in emails:
+            if email.recipient == OFFICE:
+                email.attachment_package = package
+                email.attachment_filename = os.path.basename(get_package_filename(request))
+        OutboundEmail.objects.bulk_create(emails)
+        return {email.recipient: email.id for email in emails}
+
+    def _send(self, messages: dict[str, EmailMessage]) -> dict[str, int]:
+        """Send each recipient's message, and return the number sent to each."""
+        if settings.VITAL_RECORDS_EMAIL_CONCURRENT and len(messages) > 1:
+            # backend connections aren't thread-safe, so each message gets its own
+            with ThreadPoolExecutor(max_workers=len(messages)) as pool:
+                futures = {recipient: pool.submit(self._send_message, recipient, m) for recipient, m in messages.items()}
+                return {recipient: future.result() for recipient, future in futures.items()}
+
+        with get_connection() as connection:
+            return {recipient: self._send_message(recipient, m, connection) for recipient, m in messages.items()}
+
+    def handler(self, request_id: UUID, package: str, recipients: Sequence[str] = None, attempt: int = 1):
         logger.debug(f"Sending request package for: {request_id}")
         request = VitalRecordsRequest.get_with_status(request_id, "packaged")
         request_type = self._format_record_type(request.type)
         requestor_email_address = request.email_address
 
-        context = {
-            "number_of_copies": request.number_of_records,
-            "logo_url": "https://webstandards.ca.gov/wp-content/uploads/sites/8/2024/10/cagov-logo-coastal-flat.png",
-            "email_address": requestor_email_address,
-            "request_type": request_type,
-        }
-        text_content = render_to_string(EMAIL_TXT_TEMPLATE, context)
-        html_content = render_to_string(EMAIL_HTML_TEMPLATE, context)
-
-        email_office = self._create_base_email(
-            subject=f"Completed: {request_type} Record Request",
-            to_address=[settings.VITAL_RECORDS_EMAIL_TO],
-            text_content=text_content,
-            html_content=html_content,
-        )
-        email_office.attach_file(package, "application/pdf")
-        result_office = email_office.send()  # returns number of successfully sent emails
-
-        email_requestor = self._create_base_email(
-            subject=f"Completed: {request_type} Record Request",
-            to_address=[requestor_email_address],
-            text_content=text_content,
-            html_content=html_content,
-        )
-        result_requestor = email_requestor.send()  # returns number of successfully sent emails
+        text_content, html_content = email_bodies.get(request_type, request.number_of_records, requestor_email_address)
+
+        bundled = settings.VITAL_RECORDS_BUNDLE_MINUTES > 0
+        if recipients is None:
+            # bundle mode: the package goes to the office in the next bundle, see `web.vital_records.tasks.bundle`
+            recipients = (REQUESTOR,) if bundled else (OFFICE, REQUESTOR)
+        subject = f"Completed: {request_type} Record Request"
+
+        if settings.VITAL_RECORDS_EMAIL_DISPATCHER:
+            # delivered by the email dispatcher, which moves the request on once they're delivered, see
+            # `web.vital_records.tasks.delivery`
+            results = self._queue(request, package, recipients, subject, text_content, html_content)
+            logger.debug(f"Request emails queued for: {request_id}")
+            return results
+
+        # with a shared package store, the package file is a temporary copy, deleted once the messages are sent
+        with self._package_file(package) if OFFICE in recipients else nullcontext() as package_filename:
+            messages = {}
+            if OFFICE in recipients:
+                email_office = self._create_base_email(
+                    subject=subject,
+                    to_address=[settings.VITAL_RECORDS_EMAIL_TO],
+                    text_content=text_content,
+                    html_content=html_content,
+                )
+                # attach the package under its request-specific name, rather than the name it's stored under; it's read
+                # from the package file as the message is sent
+                email_office.attach(
+                    FileAttachment(package_filename, os.path.basename(get_package_filename(request)), "application/pdf")
+                )
+                messages[OFFICE] = email_office
+            if REQUESTOR in recipients:
+                messages[REQUESTOR] = self._create_base_email(
+                    subject=subject,
+                    to_address=[requestor_email_address],
+                    text_content=text_content,
+                    html_content=html_content,
+                )
+
+            results = self._send(messages)  # the number of successfully sent emails, for each recipient
+
+        for recipient, result in results.items():
+            logger.debug(f"Request package sent to {recipient} for: {request_id} with response {result}")
+
+        if all(results.values()):
+            request.complete_send()
+            if not bundled:
+                # otherwise the request is finished once its package is bundled
+                request.finish()
+            request.save()
+        else:
+            failed = [recipient for recipient, result in results.items() if not result]
+            logger.error(f"Request package emails failed for: {request_id} to {', '.join(failed)}")
+
+        return results  # {"office": 1, "requestor": 1} is a successful task run
+
+    def post_handler(self, email_task):
+        if not email_task.success:
+            logger.error(f"Sending emails failed for: {email_task.kwargs.get('request_id')}")
+            return
 
-        request.complete_send()
-        request.finish()
-        request.save()
+        failed = [recipient for recipient, result in email_task.result.items() if not result]
+        if not failed:
+            return
 
-        logger.debug(f"Request package sent to CDPH for: {request_id} with response {result_office}")
-        logger.debug(f"Request package sent to requestor for: {request_id} with response {result_requestor}")
+        request_id, attempt = email_task.kwargs.get("request_id"), email_task.kwargs.get("attempt", 1)
+        if attempt > settings.VITAL_RECORDS_EMAIL_RETRIES:
+            logger.error(f"Giving up sending emails for: {request_id} to {', '.join(failed)} after {attempt} attempts")
+            return
 
-        return (result_office, result_requestor)  # (1,1) is a successful task run
+        logger.debug(f"Retrying emails for: {request_id} to {', '.join(failed)}")
+        email_task = EmailTask(request_id, email_task.kwargs.get("package"), recipients=failed, attempt=attempt + 1)
+        email_task.run()
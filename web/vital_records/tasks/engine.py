@@ -0,0 +1,143 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import threading
+from typing import Iterable, Sequence
+
+from web.vital_records.tasks import pdf
+
+logger = logging.getLogger(__name__)
+
+
+def _warm_up(template_paths: Sequence[str]):
+    """Pool process initializer: parse the templates before accepting any render."""
+    for path in template_paths:
+        pdf.templates.get(path)
+
+
+class RenderEngine:
+    """Renders filled PDF packages in a pool of worker processes, separate from the task queue worker.
+
+    Each pool process parses the templates once at startup. Renders take the template paths and a field dict for
+    each page, and return the PDF bytes, shrunk to the `optimization` level (see `pdf.optimize()`) or, with
+    `incremental`, written as an incremental update of the template where possible (see `pdf.IncrementalUpdate`).
+    With 0 processes, renders run synchronously in the calling process.
+
+    A render that times out stops the pool's processes, including the one stuck in that render. The other renders in
+    progress are started again in a new pool, so they don't fail along with it.
+
+    Usage:
+
+        engine = RenderEngine(processes=2, timeout=60, template_paths=["application.pdf"])
+
+        # blocks until the PDF is rendered, or raises TimeoutError after `timeout` seconds
+        data = engine.render(["application.pdf"], {"Field": "value"})
+
+        # or, to render several packages at once
+        futures = [engine.submit(["application.pdf"], fields) for fields in many_fields]
+        data = [engine.result(future) for future in futures]
+    """
+
+    def __init__(
+        self,
+        processes: int = 0,
+        timeout: int = None,
+        template_paths: Iterable[str] = (),
+        optimization: int = pdf.OPTIMIZE_NONE,
+        incremental: bool = False,
+    ):
+        self.processes = processes
+        self.timeout = timeout
+        self.template_paths = tuple(template_paths)
+        self.optimization = optimization
+        self.incremental = incremental
+        self._pool = None
+        # the args of each render in progress in the pool, by the future returned for it
+        self._rendering = {}
+        self._lock = threading.RLock()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            logger.debug(f"Starting render pool with {self.processes} processes")
+            self._pool = ProcessPoolExecutor(max_workers=self.processes, initializer=_warm_up, initargs=(self.template_paths,))
+        return self._pool
+
+    def _start(self, future: Future, args: tuple):
+        """Start rendering args in the pool, setting future's result once it's rendered."""
+        with self._lock:
+            pool = self.pool
+            self._rendering[future] = args
+            pool.submit(pdf.render, *args).add_done_callback(lambda rendered: self._done(future, pool, rendered))
+
+    def _done(self, future: Future, pool: ProcessPoolExecutor, rendered: Future):
+        with self._lock:
+            if pool is not self._pool:
+                # the pool was stopped: the render was started again in a new pool, or given up on
+                return
+            self._rendering.pop(future, None)
+            try:
+                future.set_result(rendered.result())
+            except Exception as ex:
+                future.set_exception(ex)
+
+    def submit(self, template_paths: Sequence[str], *pages: dict) -> Future:
+        """Start rendering the templates, filling each page from the field dict at the same index."""
+        args = (tuple(template_paths), pages, self.optimization, self.incremental)
+        future = Future()
+        if self.processes > 0:
+            self._start(future, args)
+            return future
+
+        try:
+            future.set_result(pdf.render(*args))
+        except Exception as ex:
+            future.set_exception(ex)
+        return future
+
+    def result(self, future: Future) -> bytes:
+        """Wait for a render started with `submit()`, for up to `timeout` seconds."""
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            logger.error(f"Render did not complete within {self.timeout} seconds, restarting the render pool")
+            self.restart(timed_out=future)
+            raise
+        except BrokenProcessPool:
+            logger.error("A render pool process exited unexpectedly, restarting the render pool")
+            self.shutdown()
+            raise
+
+    def render(self, template_paths: Sequence[str], *pages: dict) -> bytes:
+        return self.result(self.submit(template_paths, *pages))
+
+    def _stop(self) -> dict[Future, tuple]:
+        """Stop the pool processes. Returns the renders that were in progress."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+            rendering, self._rendering = self._rendering, {}
+        if pool is not None:
+            if hasattr(pool, "terminate_workers"):
+                # Python 3.14+
+                pool.terminate_workers()
+            else:
+                # shutting down the pool doesn't stop a process stuck in a render, and before 3.14 there's no public
+                # API to stop it
+                for process in list((pool._processes or {}).values()):
+                    process.terminate()
+                pool.shutdown(wait=False, cancel_futures=True)
+        return {future: args for future, args in rendering.items() if not future.done()}
+
+    def restart(self, timed_out: Future = None):
+        """Stop the pool processes, and start the renders in progress again in a new pool, except for timed_out."""
+        rendering = self._stop()
+        rendering.pop(timed_out, None)
+        if timed_out is not None and not timed_out.done():
+            timed_out.set_exception(TimeoutError(f"Render did not complete within {self.timeout} seconds"))
+        for future, args in rendering.items():
+            self._start(future, args)
+
+    def shutdown(self):
+        """Stop the pool processes, failing the renders in progress; the next render starts a new pool."""
+        for future in self._stop():
+            future.set_exception(BrokenProcessPool("The render pool was shut down"))
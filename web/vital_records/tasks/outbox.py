@@ -0,0 +1,60 @@
+import logging
+import threading
+
+from django.db import transaction
+
+from web.vital_records.models import RequestSubmission
+from web.vital_records.tasks.package import submit_requests
+
+logger = logging.getLogger(__name__)
+
+# the number of submissions queued in one go
+OUTBOX_BATCH_SIZE = 100
+
+
+class OutboxDispatcher:
+    """Queues the requests submitted with `VITAL_RECORDS_SUBMIT_OUTBOX` for packaging, apart from the web process.
+
+    Each tick claims batches of submissions from the outbox, and queues their tasks with a bulk insert; the
+    submissions are deleted in the same transaction, so each one is queued exactly once with the ORM broker. If
+    queuing fails, the submissions are left in the outbox for the next tick.
+
+    Usage:
+
+        dispatcher = OutboxDispatcher()
+        dispatcher.run(interval=1)  # until stopped, see `python manage.py drain_outbox`
+    """
+
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE):
+        self.batch_size = batch_size
+
+    def drain_batch(self) -> int:
+        """Queue a batch of submissions. Returns the number queued."""
+        with transaction.atomic():
+            submissions = RequestSubmission.claim(self.batch_size)
+            if not submissions:
+                return 0
+            submit_requests([submission.request_id for submission in submissions])
+            RequestSubmission.objects.filter(pk__in=[submission.pk for submission in submissions]).delete()
+        logger.debug(f"Queued {len(submissions)} submitted requests")
+        return len(submissions)
+
+    def tick(self) -> int:
+        """Queue every submission in the outbox. Returns the number queued."""
+        drained = 0
+        while count := self.drain_batch():
+            drained += count
+        return drained
+
+    def run(self, interval: float, stop: threading.Event = None):
+        """Tick every `interval` seconds, until stop is set."""
+        stop = stop or threading.Event()
+        logger.info("Outbox dispatcher started")
+        while not stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                # e.g. the database is unavailable; the submissions are still there for the next tick
+                logger.exception("Outbox dispatcher tick failed")
+            stop.wait(interval)
+        logger.info("Outbox dispatcher stopped")
@@ -1,272 +1,338 @@
-from dataclasses import asdict, dataclass
+from concurrent.futures import Future
+from datetime import timedelta
+from functools import cache
 import logging
+import math
 import os
-from typing import Optional
-from uuid import UUID, uuid4
+from typing import Sequence
+from uuid import UUID
 
 from django.conf import settings
 from django.utils import timezone
-from pypdf import PdfReader, PdfWriter
 
-from web.core.tasks import Task
+from web.core.tasks import Pipeline, Task
 from web.settings import _filter_empty
 from web.vital_records.models import VitalRecordsRequest
 from web.vital_records.tasks.email import EmailTask
-from web.vital_records.tasks.utils import get_package_filename
+from web.vital_records.tasks.engine import RenderEngine
+from web.vital_records.tasks.pdf import OPTIMIZE_COMPACT, optimize, templates
+from web.vital_records.tasks.schema import Schema, Source, const, date, join
+from web.vital_records.tasks.store import PackageStore, get_package_store
 
 logger = logging.getLogger(__name__)
 
 
 APPLICATION_FOLDER = os.path.join(settings.BASE_DIR, "web", "vital_records", "templates", "package")
 SWORNSTATEMENT_TEMPLATE = os.path.join(APPLICATION_FOLDER, "sworn-statement.pdf")
+PACKAGE_TYPES = ("birth", "death", "marriage")
+BATCH_SCHEDULE = "vital-records-package-batch"
+
+
+def get_application_template(request_type: str) -> str:
+    return os.path.join(APPLICATION_FOLDER, f"application_{request_type}.pdf")
+
+
+def get_base_package_filename(request_type: str) -> str:
+    return os.path.join(settings.VITAL_RECORDS_PACKAGE_DIR, f"package_{request_type}.pdf")
+
+
+def build_base_package(request_type: str) -> str:
+    """Merge the application and sworn statement templates for this record type into a single base package file."""
+    filename = get_base_package_filename(request_type)
+    logger.debug(f"Building base package: {filename}")
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+    writer = templates.writer(get_application_template(request_type), SWORNSTATEMENT_TEMPLATE)
+    # built once, so always fully optimized: packages filled from it only need their new field appearances compressed
+    saved = optimize(writer, OPTIMIZE_COMPACT)
+    logger.info(f"Optimized base package, saved {saved} bytes: {filename}")
+    # write to a temporary file and swap it in, so a running worker never reads a partial file
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, "wb") as output_stream:
+        writer.write(output_stream)
+    os.replace(tmp_filename, filename)
+
+    return filename
+
+
+def get_package_templates(request_type: str) -> tuple[str, ...]:
+    """
+    Return the template file(s) a package for this record type is built from.
+
+    Uses the pre-merged base package (see the `build_packages` command) when it exists and is newer than its
+    source templates, otherwise falls back to the application and sworn statement templates.
+    """
+    sources = (get_application_template(request_type), SWORNSTATEMENT_TEMPLATE)
+    base = get_base_package_filename(request_type)
+
+    try:
+        base_mtime = os.stat(base).st_mtime_ns
+    except FileNotFoundError:
+        return sources
+
+    if all(os.stat(source).st_mtime_ns <= base_mtime for source in sources):
+        return (base,)
+
+    logger.warning(f"Base package is older than its templates, rebuild with the build_packages command: {base}")
+    return sources
+
+
+def check_package_fields():
+    """Log the application and sworn statement fields that don't exist in each record type's package templates.
+
+    Values for these fields would otherwise be silently dropped when the package is filled.
+    """
+    for request_type in PACKAGE_TYPES:
+        indexes = templates.indexes(*get_package_templates(request_type))
+        for index, schema in zip(indexes, (APPLICATIONS[request_type], SWORN_STATEMENTS[request_type])):
+            unknown = index.unknown(schema.names)
+            if unknown:
+                logger.warning(
+                    f"{schema.name} fields not in the {request_type} package template: {', '.join(sorted(unknown))}"
+                )
+
+
+@cache
+def get_render_engine() -> RenderEngine:
+    """The render engine for this (worker) process, with every record type's package templates preloaded."""
+    # loads (and indexes) the templates in this process, so pool processes forked from it start with them parsed
+    check_package_fields()
+    template_paths = {path for request_type in PACKAGE_TYPES for path in get_package_templates(request_type)}
+    return RenderEngine(
+        processes=settings.VITAL_RECORDS_RENDER_PROCESSES,
+        timeout=settings.VITAL_RECORDS_RENDER_TIMEOUT,
+        template_paths=sorted(template_paths),
+        optimization=settings.VITAL_RECORDS_PACKAGE_OPTIMIZATION,
+        incremental=settings.VITAL_RECORDS_PACKAGE_INCREMENTAL,
+    )
+
+
+def run_batch_package_task():
+    """Submit a batch package task to the task queue for processing. Scheduled by the `schedule_package_batches`
+    command."""
+    logger.debug("Creating scheduled batch package task")
+    task = BatchPackageTask()
+    task.run()
+    return task
 
 
 def submit_request(request_id: UUID):
     """Submit a user request to the task queue for processing."""
-    logger.debug(f"Creating package task for: {request_id}")
-    # create a new task instance
-    task = PackageTask(request_id)
+    if settings.VITAL_RECORDS_PACKAGE_BATCH_SIZE > 0:
+        # batch mode: the next batch task claims this request, along with any others waiting to be packaged
+        logger.debug(f"Creating batch package task for: {request_id}")
+        task = BatchPackageTask()
+    elif settings.VITAL_RECORDS_PACKAGE_PIPELINE:
+        logger.debug(f"Creating package pipeline for: {request_id}")
+        task = PackagePipeline(request_id)
+    else:
+        logger.debug(f"Creating package task for: {request_id}")
+        # create a new task instance
+        task = PackageTask(request_id)
     # calling task.run() submits the task to the queue for processing
     task.run()
     # if callers want to interrogate the status, etc.
     return task
 
 
-@dataclass
-class BaseApplication:
-    """A base class for shared application fields."""
-
-    CDPH_VR_FORMTYPE: str = None
-    EventType: str = None
-
-    package_id: str = str(uuid4())
-    WildfireName: Optional[str] = None
-    CopyType: Optional[str] = "/WLDFREAUTH"
-    RelationshipToRegistrant: Optional[str] = "/1"
-    NumberOfCopies: Optional[int] = 1
-    County: Optional[str] = None
-    RegDOE: Optional[str] = None
-    RequestorFirstName: Optional[str] = None
-    RequestorLastName: Optional[str] = None
-    RequestorMailingAddress: Optional[str] = None
-    RequestorCity: Optional[str] = None
-    RequestorZipCode: Optional[str] = None
-    RequestorCountry: Optional[str] = None
-    RequestorTelephone: Optional[str] = None
-    RequestorEmail: Optional[str] = None
-    RequestorStateProvince: Optional[str] = None
-    Comments: Optional[str] = None
-    CDPH_VR_APP_ID: str = None
-
-    def dict(self):
-        d = asdict(self)
-        return {k: v for k, v in d.items() if v}
-
-
-@dataclass
-class BirthApplication(BaseApplication):
-    CDPH_VR_FORMTYPE: str = "WILDFIRE_CDPH_VR_B0A6353F1"
-    EventType: Optional[str] = "Birth"
-
-    RegFirstName: Optional[str] = None
-    RegMiddleName: Optional[str] = None
-    RegLastName: Optional[str] = None
-    Parent1FirstName: Optional[str] = None
-    Parent2FirstName: Optional[str] = None
-    Parent1LastName: Optional[str] = None
-    Parent2LastName: Optional[str] = None
-
-    @staticmethod
-    def create(request: VitalRecordsRequest) -> "BirthApplication":
-        return BirthApplication(
-            package_id=request.id,
-            WildfireName=request.fire.capitalize(),
-            NumberOfCopies=request.number_of_records,
-            RegFirstName=request.first_name,
-            RegMiddleName=request.middle_name,
-            RegLastName=request.last_name,
-            County=request.county_of_event,
-            RegDOE=request.date_of_birth.strftime("%m/%d/%Y"),
-            Parent1FirstName=request.person_1_first_name,
-            Parent1LastName=request.person_1_last_name,
-            Parent2FirstName=request.person_2_first_name,
-            Parent2LastName=request.person_2_last_name,
-            RequestorFirstName=request.order_first_name,
-            RequestorLastName=request.order_last_name,
-            RequestorMailingAddress=" ".join(_filter_empty((request.address, request.address_2))),
-            RequestorCity=request.city,
-            RequestorStateProvince=request.state,
-            RequestorZipCode=request.zip_code,
-            RequestorCountry="United States",
-            RequestorEmail=request.email_address,
-            RequestorTelephone=request.phone_number,
-        )
-
-
-@dataclass
-class DeathApplication(BaseApplication):
-    CDPH_VR_FORMTYPE: str = "WILDFIRE_CDPH_VR_D52594BE"
-    EventType: Optional[str] = "Death"
-
-    RelationshipToRegistrant: Optional[str] = None
-    RegFirstName: Optional[str] = None
-    RegMiddleName: Optional[str] = None
-    RegLastName: Optional[str] = None
-    RegDOB: Optional[str] = None
-    RegPartnerFirstName: Optional[str] = None
-    RegPartnerLastName: Optional[str] = None
-    Parent1FirstName: Optional[str] = None
-    Parent1LastName: Optional[str] = None
-
-    @staticmethod
-    def create(request: VitalRecordsRequest) -> "DeathApplication":
-        if request.relationship == "surviving_next_of_kin":
-            relationship = "/6"
-        else:
-            relationship = "/1"
-
-        return DeathApplication(
-            package_id=request.id,
-            WildfireName=request.fire.capitalize(),
-            NumberOfCopies=request.number_of_records,
-            RelationshipToRegistrant=relationship,
-            RegFirstName=request.first_name,
-            RegMiddleName=request.middle_name,
-            RegLastName=request.last_name,
-            County=request.county_of_event,
-            RegDOE=request.date_of_event.strftime("%m/%d/%Y"),
-            RegDOB=request.date_of_birth.strftime("%m/%d/%Y"),
-            RegPartnerFirstName=request.person_2_first_name,
-            RegPartnerLastName=request.person_2_last_name,
-            Parent1FirstName=request.person_1_first_name,
-            Parent1LastName=request.person_1_last_name,
-            RequestorFirstName=request.order_first_name,
-            RequestorLastName=request.order_last_name,
-            RequestorMailingAddress=" ".join(_filter_empty((request.address, request.address_2))),
-            RequestorCity=request.city,
-            RequestorStateProvince=request.state,
-            RequestorZipCode=request.zip_code,
-            RequestorCountry="United States",
-            RequestorEmail=request.email_address,
-            RequestorTelephone=request.phone_number,
-        )
-
-
-@dataclass
-class MarriageApplication(BaseApplication):
-    CDPH_VR_FORMTYPE: str = "WILDFIRE_CDPH_VR_M27FFEAFF"
-    EventType: Optional[str] = "Marriage"
-
-    Spouse1FirstName: Optional[str] = None
-    Spouse1MiddleName: Optional[str] = None
-    Spouse1LastName: Optional[str] = None
-    Spouse1BirthLastName: Optional[str] = None
-    Spouse2FirstName: Optional[str] = None
-    Spouse2MiddleName: Optional[str] = None
-    Spouse2LastName: Optional[str] = None
-    Spouse2BirthLastName: Optional[str] = None
-
-    @staticmethod
-    def create(request: VitalRecordsRequest) -> "MarriageApplication":
-        return MarriageApplication(
-            package_id=request.id,
-            WildfireName=request.fire.capitalize(),
-            NumberOfCopies=request.number_of_records,
-            Spouse1FirstName=request.person_1_first_name,
-            Spouse1MiddleName=request.person_1_middle_name,
-            Spouse1LastName=request.person_1_last_name,
-            Spouse1BirthLastName=request.person_1_birth_last_name,
-            Spouse2FirstName=request.person_2_first_name,
-            Spouse2MiddleName=request.person_2_middle_name,
-            Spouse2LastName=request.person_2_last_name,
-            Spouse2BirthLastName=request.person_2_birth_last_name,
-            County=request.county_of_event,
-            RegDOE=request.date_of_event.strftime("%m/%d/%Y"),
-            RequestorFirstName=request.order_first_name,
-            RequestorLastName=request.order_last_name,
-            RequestorMailingAddress=" ".join(_filter_empty((request.address, request.address_2))),
-            RequestorCity=request.city,
-            RequestorStateProvince=request.state,
-            RequestorZipCode=request.zip_code,
-            RequestorCountry="United States",
-            RequestorEmail=request.email_address,
-            RequestorTelephone=request.phone_number,
-        )
-
-
-@dataclass
-class SwornStatement:
-    registrantNameRow1: Optional[str] = None
-    registrantNameRow2: Optional[str] = None
-    registrantNameRow3: Optional[str] = None
-    applicantRelationToRegistrantRow1: Optional[str] = None
-    applicantRelationToRegistrantRow2: Optional[str] = None
-    applicantRelationToRegistrantRow3: Optional[str] = None
-    day: Optional[str] = None
-    month: Optional[str] = None
-    year: Optional[str] = None
-    city: Optional[str] = None
-    state: Optional[str] = None
-    applicantSignature1: Optional[str] = None
-    applicantSignature2: Optional[str] = None
-    stateOfNotarization: Optional[str] = None
-    countyOfNotarization: Optional[str] = None
-    dateOfNotarization: Optional[str] = None
-    notarySignature: Optional[str] = None
-    notaryNameAndTitle: Optional[str] = None
-    applicantName: Optional[str] = None
-    registrantName: Optional[str] = None
-
-    def dict(self):
-        d = asdict(self)
-        return {k: v for k, v in d.items() if v}
-
-    @staticmethod
-    def create_sworn_statement(request: VitalRecordsRequest, registrant_fields: dict) -> "SwornStatement":
-        """A SwornStatement factory"""
-
-        # use request.started_at, which is the time just after successful auth through the gateway
-        # convert to the local timezone and format for display
-        auth_time = request.started_at.astimezone(timezone.get_default_timezone()).strftime("%Y-%m-%d %H:%M:%S")
-
-        base_fields = {
-            "applicantName": request.legal_attestation,
-            "applicantSignature1": request.legal_attestation,
-            "applicantSignature2": f"Authorized via California Identity Gateway {auth_time}",
-        }
-        all_fields = {**base_fields, **registrant_fields}
-        return SwornStatement(**all_fields)
-
-    @staticmethod
-    def create_birth_sworn_statement(request: VitalRecordsRequest) -> "SwornStatement":
-        registrant_fields = {
-            "registrantNameRow1": " ".join(_filter_empty((request.first_name, request.middle_name, request.last_name))),
-            "applicantRelationToRegistrantRow1": request.relationship,
-        }
-        return SwornStatement.create_sworn_statement(request, registrant_fields)
-
-    @staticmethod
-    def create_death_sworn_statement(request: VitalRecordsRequest) -> "SwornStatement":
-        registrant_fields = {
-            "registrantNameRow1": " ".join(_filter_empty((request.first_name, request.middle_name, request.last_name))),
-            "applicantRelationToRegistrantRow1": request.relationship,
-        }
-        return SwornStatement.create_sworn_statement(request, registrant_fields)
-
-    @staticmethod
-    def create_marriage_sworn_statement(request: VitalRecordsRequest) -> "SwornStatement":
-        registrant_1 = " ".join((f"{request.person_1_first_name[0]}.", request.person_1_last_name))
-        registrant_2 = " ".join((f"{request.person_2_first_name[0]}.", request.person_2_last_name))
-        registrant_fields = {
-            "registrantNameRow1": f"{registrant_1} / {registrant_2}",
-            "applicantRelationToRegistrantRow1": request.relationship,
-        }
-        return SwornStatement.create_sworn_statement(request, registrant_fields)
+def submit_requests(request_ids: Sequence[UUID]) -> list[Task]:
+    """Submit user requests to the task queue in bulk, as `submit_request()` would one by one."""
+    if not request_ids:
+        return []
+    if settings.VITAL_RECORDS_PACKAGE_BATCH_SIZE > 0:
+        # enough batch tasks to claim them all
+        count = math.ceil(len(request_ids) / settings.VITAL_RECORDS_PACKAGE_BATCH_SIZE)
+        logger.debug(f"Creating {count} batch package tasks for {len(request_ids)} requests")
+        return BatchPackageTask.run_many({} for _ in range(count))
+    task_class = PackagePipeline if settings.VITAL_RECORDS_PACKAGE_PIPELINE else PackageTask
+    logger.debug(f"Creating {task_class.name} tasks for {len(request_ids)} requests")
+    return task_class.run_many({"request_id": request_id} for request_id in request_ids)
+
+
+def _capitalize(value: str) -> str:
+    return value.capitalize() if value else value
+
+
+def _death_relationship(relationship: str) -> str:
+    return "/6" if relationship == "surviving_next_of_kin" else "/1"
+
+
+def _authorized(started_at) -> str:
+    # use request.started_at, which is the time just after successful auth through the gateway
+    # convert to the local timezone and format for display
+    if not started_at:
+        return None
+    auth_time = started_at.astimezone(timezone.get_default_timezone()).strftime("%Y-%m-%d %H:%M:%S")
+    return f"Authorized via California Identity Gateway {auth_time}"
+
+
+def _initial(first_name: str, last_name: str) -> str:
+    return " ".join(_filter_empty((f"{first_name[0]}." if first_name else None, last_name)))
+
+
+def _spouses(person_1_first_name: str, person_1_last_name: str, person_2_first_name: str, person_2_last_name: str) -> str:
+    return " / ".join(
+        _filter_empty((_initial(person_1_first_name, person_1_last_name), _initial(person_2_first_name, person_2_last_name)))
+    )
+
+
+# fields shared by the application for every record type
+BASE_APPLICATION = {
+    "WildfireName": Source("fire", func=_capitalize),
+    "CopyType": const("/WLDFREAUTH"),
+    "RelationshipToRegistrant": const("/1"),
+    "NumberOfCopies": "number_of_records",
+    "County": "county_of_event",
+    "RequestorFirstName": "order_first_name",
+    "RequestorLastName": "order_last_name",
+    "RequestorMailingAddress": join("address", "address_2"),
+    "RequestorCity": "city",
+    "RequestorStateProvince": "state",
+    "RequestorZipCode": "zip_code",
+    "RequestorCountry": const("United States"),
+    "RequestorEmail": "email_address",
+    "RequestorTelephone": "phone_number",
+}
+
+APPLICATIONS = {
+    "birth": Schema(
+        "BirthApplication",
+        {
+            "CDPH_VR_FORMTYPE": const("WILDFIRE_CDPH_VR_B0A6353F1"),
+            "EventType": const("Birth"),
+            **BASE_APPLICATION,
+            "RegFirstName": "first_name",
+            "RegMiddleName": "middle_name",
+            "RegLastName": "last_name",
+            "RegDOE": date("date_of_birth"),
+            "Parent1FirstName": "person_1_first_name",
+            "Parent1LastName": "person_1_last_name",
+            "Parent2FirstName": "person_2_first_name",
+            "Parent2LastName": "person_2_last_name",
+        },
+    ),
+    "death": Schema(
+        "DeathApplication",
+        {
+            "CDPH_VR_FORMTYPE": const("WILDFIRE_CDPH_VR_D52594BE"),
+            "EventType": const("Death"),
+            **BASE_APPLICATION,
+            "RelationshipToRegistrant": Source("relationship", func=_death_relationship),
+            "RegFirstName": "first_name",
+            "RegMiddleName": "middle_name",
+            "RegLastName": "last_name",
+            "RegDOE": date("date_of_event"),
+            "RegDOB": date("date_of_birth"),
+            "RegPartnerFirstName": "person_2_first_name",
+            "RegPartnerLastName": "person_2_last_name",
+            "Parent1FirstName": "person_1_first_name",
+            "Parent1LastName": "person_1_last_name",
+        },
+    ),
+    "marriage": Schema(
+        "MarriageApplication",
+        {
+            "CDPH_VR_FORMTYPE": const("WILDFIRE_CDPH_VR_M27FFEAFF"),
+            "EventType": const("Marriage"),
+            **BASE_APPLICATION,
+            "Spouse1FirstName": "person_1_first_name",
+            "Spouse1MiddleName": "person_1_middle_name",
+            "Spouse1LastName": "person_1_last_name",
+            "Spouse1BirthLastName": "person_1_birth_last_name",
+            "Spouse2FirstName": "person_2_first_name",
+            "Spouse2MiddleName": "person_2_middle_name",
+            "Spouse2LastName": "person_2_last_name",
+            "Spouse2BirthLastName": "person_2_birth_last_name",
+            "RegDOE": date("date_of_event"),
+        },
+    ),
+}
+
+# fields shared by the sworn statement for every record type
+BASE_SWORN_STATEMENT = {
+    "applicantName": "legal_attestation",
+    "applicantSignature1": "legal_attestation",
+    "applicantSignature2": Source("started_at", func=_authorized),
+    "applicantRelationToRegistrantRow1": "relationship",
+}
+
+REGISTRANT_SWORN_STATEMENT = Schema(
+    "SwornStatement",
+    {**BASE_SWORN_STATEMENT, "registrantNameRow1": join("first_name", "middle_name", "last_name")},
+)
+
+SWORN_STATEMENTS = {
+    "birth": REGISTRANT_SWORN_STATEMENT,
+    "death": REGISTRANT_SWORN_STATEMENT,
+    "marriage": Schema(
+        "SwornStatement",
+        {
+            **BASE_SWORN_STATEMENT,
+            "registrantNameRow1": Source(
+                "person_1_first_name",
+                "person_1_last_name",
+                "person_2_first_name",
+                "person_2_last_name",
+                func=_spouses,
+            ),
+        },
+    ),
+}
+
+# every request field read to fill a package, e.g. for `.values()` rows
+PACKAGE_FIELDS = tuple(
+    dict.fromkeys(
+        field for schema in (*APPLICATIONS.values(), *SWORN_STATEMENTS.values()) for field in ("id", "type", *schema.fields)
+    )
+)
+
+
+def create_documents(request_type: str, request) -> tuple[dict, dict]:
+    """The application and sworn statement field values for this request, a model instance or a `.values()` row."""
+    return APPLICATIONS[request_type].fill(request), SWORN_STATEMENTS[request_type].fill(request)
+
+
+def get_package_key(request_type: str, request_id: UUID, application: dict, sworn_statement: dict) -> str:
+    """The key of this request's package in the package store: a hash of the templates, field values and render options.
+
+    The key includes the request's ID, so no two requests share a key (or a package file).
+    """
+    engine = get_render_engine()
+    digests = [templates.get(path).digest for path in get_package_templates(request_type)]
+    pages = (application, sworn_statement)
+    return PackageStore.key(digests, pages, engine.optimization, engine.incremental, request_id=request_id)
+
+
+def render_package(request_type: str, application: dict, sworn_statement: dict) -> Future:
+    """Start rendering the package for this request: the application fills page 0, the sworn statement fills page 1."""
+    return get_render_engine().submit(get_package_templates(request_type), application, sworn_statement)
+
+
+def save_package(key: str, rendered: Future) -> str:
+    """Wait for the rendered package, and store it under key. Returns the key."""
+    data = get_render_engine().result(rendered)
+    get_package_store().put(key, data)
+    return key
+
+
+def write_package(request_type: str, request_id: UUID, application: dict, sworn_statement: dict) -> str:
+    """Fill the package templates with the application and sworn statement, and store the package.
+
+    Returns the package's key in the package store. A package that is already stored (e.g. the task is retried)
+    isn't rendered again.
+    """
+    key = get_package_key(request_type, request_id, application, sworn_statement)
+    if get_package_store().exists(key):
+        logger.debug(f"Package already stored: {key}")
+        return key
+    return save_package(key, render_package(request_type, application, sworn_statement))
 
 
 class PackageTask(Task):
     group = "vital-records"
     name = "package"
+    queue = "requests"
+    dedup_key = "package:{request_id}"
 
     def __init__(self, request_id: UUID):
         super().__init__(request_id=request_id)
@@ -275,35 +341,15 @@ class PackageTask(Task):
         logger.debug(f"Creating request package for: {request_id}")
         request = VitalRecordsRequest.get_with_status(request_id, "enqueued")
 
-        if request.type == "birth":
-            application = BirthApplication.create(request)
-            sworn_statement = SwornStatement.create_birth_sworn_statement(request)
-        elif request.type == "marriage":
-            application = MarriageApplication.create(request)
-            sworn_statement = SwornStatement.create_marriage_sworn_statement(request)
-        elif request.type == "death":
-            application = DeathApplication.create(request)
-            sworn_statement = SwornStatement.create_death_sworn_statement(request)
-
-        app_template = os.path.join(APPLICATION_FOLDER, f"application_{request.type}.pdf")
-        app_reader = PdfReader(app_template)
-        writer = PdfWriter()
-        writer.append(app_reader)
-        writer.update_page_form_field_values(writer.pages[0], application.dict(), auto_regenerate=False)
-
-        ss_reader = PdfReader(SWORNSTATEMENT_TEMPLATE)
-        writer.append(ss_reader)
-        writer.update_page_form_field_values(writer.pages[1], sworn_statement.dict(), auto_regenerate=False)
-
-        filename = get_package_filename(request)
-        with open(filename, "wb") as output_stream:
-            writer.write(output_stream)
+        application, sworn_statement = create_documents(request.type, request)
+        package = write_package(request.type, request.id, application, sworn_statement)
 
+        request.package_hash = package
         request.complete_package()
         request.save()
 
         logger.debug(f"Request package created for: {request_id}")
-        return filename
+        return package
 
     def post_handler(self, package_task):
         request_id = package_task.kwargs.get("request_id")
@@ -313,3 +359,143 @@ class PackageTask(Task):
             email_task.run()
         else:
             logger.error(f"Package creation failed for: {request_id}")
+
+
+class PackagePipeline(Pipeline):
+    """Package a request and email it in a single task, rather than the package task queuing an email task.
+
+    Used when `VITAL_RECORDS_PACKAGE_PIPELINE` is set, so emailing doesn't wait for the next broker poll. The request's
+    status is the checkpoint: a request that's already `packaged` (e.g. the pipeline is run again after the email stage
+    failed) is emailed with its stored package, rather than packaged again. Emails that fail to send are retried by
+    `EmailTask`, as if the email stage had been an `EmailTask` of its own.
+    """
+
+    group = "vital-records"
+    name = "package-pipeline"
+    queue = "requests"
+    # packages the request, as a `PackageTask` would
+    dedup_key = PackageTask.dedup_key
+    stages = ("package", "email")
+
+    def __init__(self, request_id: UUID):
+        super().__init__(request_id=request_id)
+
+    def load_checkpoint(self, request_id: UUID) -> dict:
+        request = VitalRecordsRequest.objects.filter(pk=request_id, status="packaged").only("package_hash").first()
+        return {"package": request.package_hash} if request else {}
+
+    def save_checkpoint(self, results: dict, request_id: UUID):
+        # each stage saves the request in its next status
+        pass
+
+    def clear_checkpoint(self, request_id: UUID):
+        pass
+
+    def package(self, results: dict, request_id: UUID) -> str:
+        return PackageTask(request_id).handler(request_id)
+
+    def email(self, results: dict, request_id: UUID) -> dict[str, int]:
+        return EmailTask(request_id, results["package"]).handler(request_id, results["package"])
+
+    def post_handler(self, pipeline_task):
+        request_id = pipeline_task.kwargs.get("request_id")
+        if not pipeline_task.success:
+            logger.error(f"Package pipeline failed for: {request_id}")
+            return
+
+        failed = [recipient for recipient, result in pipeline_task.result["email"].items() if not result]
+        if not failed:
+            return
+        if settings.VITAL_RECORDS_EMAIL_RETRIES < 1:
+            logger.error(f"Giving up sending emails for: {request_id} to {', '.join(failed)} after 1 attempts")
+            return
+
+        logger.debug(f"Retrying emails for: {request_id} to {', '.join(failed)}")
+        email_task = EmailTask(request_id, pipeline_task.result["package"], recipients=failed, attempt=2)
+        email_task.run()
+
+
+class BatchPackageTask(Task):
+    """Package up to `batch_size` requests in the `enqueued` state in a single task.
+
+    Requests are claimed with one query, as rows of just the fields filled into packages, and rendered against the
+    same parsed templates. Each request is packaged independently: a request that fails is logged and left `enqueued`,
+    without affecting the rest of the batch, to be claimed again by a later batch, up to
+    `VITAL_RECORDS_PACKAGE_ATTEMPTS` times, after which it's moved to `failed`. Packaged requests are moved to
+    `packaged` with a single bulk update.
+
+    Besides the batches queued as requests are submitted, a batch runs every `VITAL_RECORDS_PACKAGE_BATCH_MINUTES`
+    (see the `schedule_package_batches` command), so requests whose claim ran out are claimed again, or failed.
+    """
+
+    group = "vital-records"
+    name = "package-batch"
+    queue = "requests"
+
+    def __init__(self, batch_size: int = None):
+        super().__init__(batch_size=batch_size or settings.VITAL_RECORDS_PACKAGE_BATCH_SIZE)
+
+    def handler(self, batch_size: int) -> list[tuple[UUID, str]]:
+        logger.debug(f"Creating request packages for up to {batch_size} requests")
+        packages = []
+
+        # out of attempts, with none in progress: e.g. the task on the last attempt was stopped
+        exhausted = VitalRecordsRequest.get_exhausted(settings.VITAL_RECORDS_PACKAGE_ATTEMPTS)
+        for request_id in exhausted:
+            logger.error(f"Giving up packaging: {request_id} after {settings.VITAL_RECORDS_PACKAGE_ATTEMPTS} attempts")
+        VitalRecordsRequest.fail_package_many(exhausted)
+
+        # the claim is committed before rendering, and holds each request for as long as this task may run
+        batch = VitalRecordsRequest.claim_enqueued(
+            batch_size,
+            # only the fields filled into packages, as `.values()` rows rather than model instances
+            fields=PACKAGE_FIELDS,
+            max_attempts=settings.VITAL_RECORDS_PACKAGE_ATTEMPTS,
+            lease=timedelta(seconds=settings.Q_CLUSTER["timeout"]),
+        )
+
+        # start every render first, so a render pool (if configured) works on the batch in parallel
+        rendering = []
+        for row in batch:
+            request_id, request_type = row["id"], row["type"]
+            try:
+                application, sworn_statement = create_documents(request_type, row)
+                key = get_package_key(request_type, request_id, application, sworn_statement)
+                if get_package_store().exists(key):
+                    logger.debug(f"Package already stored for: {request_id}")
+                    packages.append((request_id, key))
+                else:
+                    rendering.append((request_id, key, render_package(request_type, application, sworn_statement)))
+            except Exception:
+                logger.exception(f"Package creation failed for: {request_id}")
+
+        for request_id, key, rendered in rendering:
+            try:
+                packages.append((request_id, save_package(key, rendered)))
+            except Exception:
+                logger.exception(f"Package creation failed for: {request_id}")
+
+        VitalRecordsRequest.complete_package_many(dict(packages))
+
+        packaged = {request_id for request_id, _ in packages}
+        failed = []
+        for row in batch:
+            if row["id"] not in packaged and row["package_attempts"] >= settings.VITAL_RECORDS_PACKAGE_ATTEMPTS:
+                logger.error(f"Giving up packaging: {row['id']} after {row['package_attempts']} attempts")
+                failed.append(row["id"])
+        VitalRecordsRequest.fail_package_many(failed)
+
+        if len(packages) < len(batch):
+            logger.warning(f"Some requests were not packaged ({len(batch) - len(packages)} of {len(batch)} failed)")
+        logger.debug(f"Request packages created for {len(packages)} requests")
+
+        return packages
+
+    def post_handler(self, batch_task):
+        if batch_task.success:
+            for request_id, package in batch_task.result:
+                logger.debug(f"Creating email task for: {request_id}")
+                email_task = EmailTask(request_id, package)
+                email_task.run()
+        else:
+            logger.error("Batch package creation failed")
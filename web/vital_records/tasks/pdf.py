@@ -0,0 +1,440 @@
+from dataclasses import dataclass
+import hashlib
+from io import BytesIO
+import logging
+import mmap
+import os
+import threading
+import weakref
+from typing import BinaryIO, Iterable, Mapping, Sequence
+
+from pypdf import PageObject, PdfReader, PdfWriter
+from pypdf.generic import (
+    ArrayObject,
+    BooleanObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    PdfObject,
+    StreamObject,
+    TextStringObject,
+)
+
+# pypdf has no public API to generate a text field's appearance stream on its own, or to list or replace a writer's
+# objects. These internals can change in any release: pypdf is pinned in pyproject.toml, and test_pypdf_internals
+# (tests/web/vital_records/tasks/test_pdf.py) fails if an upgrade changes them
+from pypdf.generic._appearance_stream import TextStreamAppearance
+
+logger = logging.getLogger(__name__)
+
+# output optimization levels, each including the ones before it
+OPTIMIZE_NONE = 0
+# flate-compress any uncompressed streams, e.g. the field appearances generated while filling
+OPTIMIZE_COMPRESS = 1
+# merge identical objects (fonts, images shared by the application and sworn statement) and drop unreferenced ones
+OPTIMIZE_COMPACT = 2
+# the share of a package's size an optimization has to save to be logged at INFO, rather than DEBUG
+OPTIMIZE_LOG_RATIO = 0.05
+
+
+def _field_name(annotation: DictionaryObject) -> str | None:
+    """The name of the form field a widget annotation belongs to: its own /T, or its parent's (e.g. radio buttons)."""
+    if "/T" in annotation:
+        return annotation["/T"]
+    parent = annotation.get("/Parent")
+    return parent.get_object().get("/T") if parent else None
+
+
+class FieldIndex:
+    """Maps each form field name on a page to the position(s) of its widget annotation(s) in the page's /Annots.
+
+    Built once per template page, so filling a copy of the page goes straight to the annotations for the given fields,
+    rather than matching every annotation on the page against every field name.
+    """
+
+    def __init__(self, page: PageObject):
+        annotations = page.get("/Annots", None)
+        annotations = annotations.get_object() if annotations else []
+        fields: dict[str, list[int]] = {}
+        for position, annotation in enumerate(annotations):
+            annotation = annotation.get_object()
+            if annotation.get("/Subtype") != "/Widget":
+                continue
+            name = _field_name(annotation)
+            if name:
+                fields.setdefault(name, []).append(position)
+
+        self.fields: dict[str, tuple[int, ...]] = {name: tuple(positions) for name, positions in fields.items()}
+        self.count = len(annotations)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.fields
+
+    def unknown(self, names: Iterable[str]) -> set[str]:
+        """Return the names that aren't fields on this page."""
+        return {name for name in names if name not in self.fields}
+
+    @staticmethod
+    def _matches(annotations: ArrayObject, name: str, positions: tuple[int, ...]) -> bool:
+        return all(_field_name(annotations[position].get_object()) == name for position in positions)
+
+    def fill(self, writer: PdfWriter, page: PageObject, values: Mapping):
+        """Fill the form fields on page, a copy of this index's page in writer, with values. Unknown names are ignored."""
+        annotations = page.get("/Annots", None)
+        annotations = annotations.get_object() if annotations else ArrayObject()
+        # a copy made by `writer.append()` has the template's annotations in the same order. Guard against one that
+        # doesn't, without walking every field on the page: the count is checked up front, and each filled field's
+        # annotations as they're filled, falling back to indexing the copy itself
+        index = self if len(annotations) == self.count else FieldIndex(page)
+
+        for name, value in values.items():
+            positions = index.fields.get(name)
+            if positions and index is self and not self._matches(annotations, name, positions):
+                index = FieldIndex(page)
+                positions = index.fields.get(name)
+            if not positions:
+                continue
+            # a stand-in page holding just this field's annotations, for pypdf to update (and generate appearances)
+            field_page = DictionaryObject({NameObject("/Annots"): ArrayObject(annotations[p] for p in positions)})
+            writer.update_page_form_field_values(field_page, {name: value}, auto_regenerate=False)
+
+
+@dataclass
+class PdfTemplate:
+    """A parsed PDF template, along with the file state it was parsed from."""
+
+    path: str
+    mtime_ns: int
+    size: int
+    digest: str
+    reader: PdfReader
+    indexes: tuple[FieldIndex, ...] = ()
+    # the file contents the reader parsed, the start of an incremental update; mapped read-only from the file
+    data: bytes | mmap.mmap = b""
+
+
+class TemplateCache:
+    """Parses PDF templates once per process and hands out independent copies for filling.
+
+    Template files are memory-mapped read-only, and parsed straight from the mapping. Their bytes then live in the OS
+    page cache, shared by every process using the template (and by pool processes forked from them), rather than
+    copied onto the heap of each one. A template's mapping is closed once the template is let go of, so hold on to the
+    template, rather than just its reader, while reading from it.
+
+    A cached template is invalidated when its file's mtime or size changes and the file's contents
+    no longer match the cached hash. A changed mtime with identical contents (e.g. a fresh checkout)
+    keeps the parsed template.
+
+    Usage:
+
+        from web.vital_records.tasks.pdf import templates
+
+        # a new PdfWriter, with each template's pages appended in order
+        writer = templates.writer("application.pdf", "statement.pdf")
+    """
+
+    def __init__(self):
+        self._templates: dict[str, PdfTemplate] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _map(path: str) -> bytes | mmap.mmap:
+        """The contents of the file at path, mapped read-only."""
+        with open(path, "rb") as f:
+            try:
+                # the mapping stays valid after the file is closed, and after it's replaced (e.g. by build_packages)
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files can't be mapped
+                return f.read()
+
+    def _load(self, path: str, stat: os.stat_result) -> PdfTemplate:
+        data = self._map(path)
+        digest = hashlib.sha256(data).hexdigest()
+
+        cached = self._templates.get(path)
+        if cached and cached.digest == digest:
+            logger.debug(f"Template unchanged, keeping parsed copy: {path}")
+            cached.mtime_ns, cached.size = stat.st_mtime_ns, stat.st_size
+            if isinstance(data, mmap.mmap):
+                data.close()
+            return cached
+
+        logger.debug(f"Parsing template: {path}")
+        # the mapping is a seekable, readable stream, so the reader doesn't need a copy of it
+        reader = PdfReader(data if isinstance(data, mmap.mmap) else BytesIO(data))
+        indexes = tuple(FieldIndex(page) for page in reader.pages)
+        template = PdfTemplate(
+            path=path,
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+            digest=digest,
+            reader=reader,
+            indexes=indexes,
+            data=data,
+        )
+        if isinstance(data, mmap.mmap):
+            # unmapped, and its file descriptor closed, as soon as the template is let go of: once it's replaced in the
+            # cache, and no render still holds it. Not left to the reader, whose parsed objects refer back to it, and so
+            # are only collected by the cycle collector, keeping the mapping open until then
+            weakref.finalize(template, data.close)
+        return template
+
+    def get(self, path: str) -> PdfTemplate:
+        """Return the parsed template for path, (re)parsing it if the file changed."""
+        path = str(path)
+        stat = os.stat(path)
+
+        with self._lock:
+            cached = self._templates.get(path)
+            if cached and (cached.mtime_ns, cached.size) == (stat.st_mtime_ns, stat.st_size):
+                return cached
+
+            template = self._load(path, stat)
+            self._templates[path] = template
+            return template
+
+    def writer(self, *paths: str) -> PdfWriter:
+        """Return a new PdfWriter containing a copy of each template, in order.
+
+        The parsed templates are never modified; filling the writer's form fields only touches the copy.
+        """
+        writer = PdfWriter()
+        for path in paths:
+            # held while its reader is read from, see `_load()`
+            template = self.get(path)
+            writer.append(template.reader)
+        return writer
+
+    def indexes(self, *paths: str) -> tuple[FieldIndex, ...]:
+        """Return the field index of every page of each template, in the same order as `writer()` appends them."""
+        return tuple(index for path in paths for index in self.get(path).indexes)
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+
+# templates are parsed at most once per (worker) process
+templates = TemplateCache()
+
+
+class IncrementalUpdate:
+    """Fills a single template's form fields as a PDF incremental update.
+
+    The template's bytes are written unchanged, followed by only the objects filling changes: field dictionaries
+    with their new value, widget annotations pointing to their new appearance stream, the appearance streams, and a
+    cross-reference section for them. Writing a package then takes time and memory in proportion to the filled fields,
+    rather than to the size of the template.
+
+    Only templates with a cross-reference table (rather than a stream), whose widget annotations and fields are
+    indirect objects, can be updated this way; e.g. base packages, written by pypdf. See `supports()`.
+
+    Usage:
+
+        update = IncrementalUpdate(templates.get("package_birth.pdf"))
+        update.fill(0, {"Field": "value"})
+        with open("filled.pdf", "wb") as f:
+            update.write(f)
+    """
+
+    def __init__(self, template: PdfTemplate, optimization: int = OPTIMIZE_NONE):
+        self.template = template
+        self.optimization = optimization
+        self.reader = template.reader
+        self.acro_form = self.reader.trailer["/Root"]["/AcroForm"].get_object()
+        self.size = int(self.reader.trailer["/Size"])
+        # object number: (generation, object) for every new or changed object
+        self.objects: dict[int, tuple[int, PdfObject]] = {}
+
+    @staticmethod
+    def supports(template: PdfTemplate) -> bool:
+        """Whether template can be filled as an incremental update."""
+        offset = _startxref(template.data)
+        if template.data.find(b"xref", offset, offset + 4) != offset:
+            return False
+        if "/AcroForm" not in template.reader.trailer["/Root"]:
+            return False
+        for page in template.reader.pages:
+            if not all(isinstance(a, IndirectObject) for a in page.get("/Annots", None) or []):
+                return False
+        return True
+
+    def _get(self, reference: IndirectObject) -> DictionaryObject:
+        """The current version of the object at reference, copied from the template the first time it's changed."""
+        if reference.idnum not in self.objects:
+            self.objects[reference.idnum] = (reference.generation, DictionaryObject(reference.get_object()))
+        return self.objects[reference.idnum][1]
+
+    def _add(self, obj: PdfObject) -> IndirectObject:
+        idnum = self.size
+        self.size += 1
+        self.objects[idnum] = (0, obj)
+        return IndirectObject(idnum, 0, None)
+
+    def fill(self, page_number: int, values: Mapping):
+        """Fill the form fields on the template's page with values. Unknown names are ignored."""
+        annotations = self.reader.pages[page_number]["/Annots"]
+        index = self.template.indexes[page_number]
+
+        for name, value in values.items():
+            for position in index.fields.get(name, ()):
+                widget_ref = annotations[position]
+                widget = self._get(widget_ref)
+                field_ref = widget_ref if "/T" in widget else widget.raw_get("/Parent")
+                field = self._get(field_ref)
+
+                if field.get("/FT") == "/Btn":
+                    # checkboxes and radio buttons: pick the widget's existing appearance for value
+                    value = NameObject(value)
+                    field[NameObject("/V")] = value
+                    appearances = widget["/AP"]["/N"]
+                    widget[NameObject("/AS")] = value if value in appearances else NameObject("/Off")
+                else:
+                    field[NameObject("/V")] = TextStringObject(value)
+                    appearance = TextStreamAppearance.from_text_annotation(self.acro_form, field, widget)
+                    if self.optimization >= OPTIMIZE_COMPRESS:
+                        appearance = appearance.flate_encode(level=9)
+                    widget[NameObject("/AP")] = DictionaryObject({NameObject("/N"): self._add(appearance)})
+
+        if self.acro_form.get("/NeedAppearances"):
+            # appearances are generated here, viewers shouldn't regenerate them
+            acro_form = self._get(self.reader.trailer["/Root"].raw_get("/AcroForm"))
+            acro_form[NameObject("/NeedAppearances")] = BooleanObject(False)
+
+    def write(self, stream: BinaryIO):
+        """Write the template, followed by the incremental update, to stream (a buffer or file)."""
+        data = self.template.data
+        stream.write(data)
+        if data[-1:] != b"\n":
+            stream.write(b"\n")
+
+        offsets = {}
+        for idnum, (generation, obj) in sorted(self.objects.items()):
+            offsets[idnum] = (stream.tell(), generation)
+            stream.write(f"{idnum} {generation} obj\n".encode())
+            obj.write_to_stream(stream)
+            stream.write(b"\nendobj\n")
+
+        xref = stream.tell()
+        # start with the head of the free list: some readers (e.g. pypdf) expect a table's first section to start at 0
+        stream.write(b"xref\n0 1\n0000000000 65535 f \n")
+        for section in _consecutive(sorted(offsets)):
+            stream.write(f"{section[0]} {len(section)}\n".encode())
+            for idnum in section:
+                offset, generation = offsets[idnum]
+                stream.write(f"{offset:010} {generation:05} n \n".encode())
+
+        trailer = DictionaryObject({NameObject("/Size"): NumberObject(self.size)})
+        for key in ("/Root", "/Info", "/ID"):
+            if key in self.reader.trailer:
+                trailer[NameObject(key)] = self.reader.trailer.raw_get(key)
+        trailer[NameObject("/Prev")] = NumberObject(_startxref(data))
+        stream.write(b"trailer\n")
+        trailer.write_to_stream(stream)
+        stream.write(f"\nstartxref\n{xref}\n%%EOF\n".encode())
+
+
+def _startxref(data: bytes | mmap.mmap) -> int:
+    """The offset of the last cross-reference section in a PDF file's data."""
+    offset = data.rfind(b"startxref")
+    return int(data[offset:].split()[1])
+
+
+def _consecutive(numbers: list[int]) -> list[list[int]]:
+    """Split sorted numbers into runs of consecutive numbers."""
+    runs = []
+    for number in numbers:
+        if runs and runs[-1][-1] == number - 1:
+            runs[-1].append(number)
+        else:
+            runs.append([number])
+    return runs
+
+
+def _objects(writer: PdfWriter) -> list[PdfObject | None]:
+    """Every object in writer, at the index of its object number - 1; None for an object that's been removed."""
+    return writer._objects
+
+
+def _replace_object(writer: PdfWriter, obj: PdfObject, replacement: PdfObject):
+    """Replace obj in writer, so references to it are to replacement instead."""
+    writer._replace_object(obj.indirect_reference, replacement)
+
+
+def _size(obj: PdfObject) -> int:
+    """The number of bytes obj takes up when written out."""
+    stream = BytesIO()
+    obj.write_to_stream(stream)
+    return stream.tell()
+
+
+def optimize(writer: PdfWriter, level: int = OPTIMIZE_COMPACT) -> int:
+    """Shrink the PDF in writer before it is written, up to the given optimization level.
+
+    Returns the number of bytes saved, not counting the (small) cross-reference table entries of removed objects.
+    """
+    saved = 0
+
+    if level >= OPTIMIZE_COMPRESS:
+        for page in writer.pages:
+            contents = page.get("/Contents")
+            if contents is None:
+                continue
+            contents = contents.get_object()
+            before = sum(_size(c.get_object()) for c in contents) if isinstance(contents, ArrayObject) else _size(contents)
+            # merges the page's content streams into a single, compressed one
+            page.compress_content_streams(level=9)
+            saved += before - _size(page["/Contents"].get_object())
+
+        for obj in list(_objects(writer)):
+            if isinstance(obj, StreamObject) and "/Filter" not in obj:
+                encoded = obj.flate_encode(level=9)
+                # short streams can come out larger, once the /Filter entry is added
+                if _size(encoded) < _size(obj):
+                    saved += _size(obj) - _size(encoded)
+                    _replace_object(writer, obj, encoded)
+
+    if level >= OPTIMIZE_COMPACT:
+        objects = list(_objects(writer))
+        writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+        saved += sum(_size(obj) for obj, kept in zip(objects, _objects(writer)) if obj is not None and kept is None)
+
+    return saved
+
+
+def render(
+    template_paths: Sequence[str], pages: Sequence[Mapping], optimization: int = OPTIMIZE_NONE, incremental: bool = False
+) -> bytes:
+    """Fill a copy of the templates, using the field values in pages for the page at the same index, and return the PDF.
+
+    The PDF is shrunk according to the optimization level, see `optimize()`. With incremental, a single template
+    that supports it is filled as an incremental update instead, see `IncrementalUpdate`.
+    """
+    output_stream = BytesIO()
+
+    if incremental and len(template_paths) == 1:
+        template = templates.get(template_paths[0])
+        if IncrementalUpdate.supports(template):
+            update = IncrementalUpdate(template, optimization)
+            for page_number, fields in enumerate(pages[: len(template.indexes)]):
+                update.fill(page_number, fields)
+            update.write(output_stream)
+            return output_stream.getvalue()
+        logger.warning(f"Template doesn't support incremental updates, writing it in full: {template.path}")
+
+    writer = templates.writer(*template_paths)
+    for page, index, fields in zip(writer.pages, templates.indexes(*template_paths), pages):
+        index.fill(writer, page, fields)
+
+    saved = optimize(writer, optimization) if optimization > OPTIMIZE_NONE else 0
+
+    writer.write(output_stream)
+    if saved:
+        size = output_stream.tell()
+        # the saving on a package filled from an optimized base package is usually a fraction of a percent, not worth a
+        # line for every package
+        level = logging.INFO if saved >= (size + saved) * OPTIMIZE_LOG_RATIO else logging.DEBUG
+        logger.log(level, f"Optimized package at level {optimization}, saved {saved} of {size + saved} bytes")
+    return output_stream.getvalue()
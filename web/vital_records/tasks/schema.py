@@ -0,0 +1,83 @@
+from operator import attrgetter, itemgetter
+from typing import Any, Callable, Mapping
+
+from web.settings import _filter_empty
+
+
+class Source:
+    """Where a PDF field's value comes from: func applied to the values of these request fields, or with no func, the
+    value of the single request field as-is. With no request fields, func is called with no arguments.
+    """
+
+    __slots__ = ("fields", "func")
+
+    def __init__(self, *fields: str, func: Callable = None):
+        if func is None and len(fields) != 1:
+            raise ValueError("A source without a func must read exactly one field")
+        self.fields = fields
+        self.func = func
+
+    def compile(self, getter: Callable) -> Callable[[Any], Any]:
+        """A function that gets this value from a row, reading its request fields with getter: attrgetter for model
+        instances, or itemgetter for `.values()` rows.
+        """
+        func = self.func
+        if not self.fields:
+            return lambda row: func()
+        get = getter(*self.fields)
+        if func is None:
+            return get
+        if len(self.fields) == 1:
+            return lambda row: func(get(row))
+        return lambda row: func(*get(row))
+
+
+def const(value) -> Source:
+    """The same value for every request."""
+    return Source(func=lambda: value)
+
+
+def join(*fields: str, sep: str = " ") -> Source:
+    """The non-empty values of these request fields, joined by sep."""
+    return Source(*fields, func=lambda *values: sep.join(_filter_empty(values)))
+
+
+def date(field: str, fmt: str = "%m/%d/%Y") -> Source:
+    """The value of this date request field, formatted."""
+    return Source(field, func=lambda value: value.strftime(fmt) if value else None)
+
+
+class Schema:
+    """A declarative mapping from `VitalRecordsRequest` fields to the PDF field names of a package page.
+
+    Each PDF field name maps to a request field name, or a `Source` for values computed from request fields. The
+    mapping is compiled once into a tuple of getters, so filling a page is a single pass over them. Rows are either
+    model instances or `.values()` rows, which only need the request fields in `fields`.
+
+    Usage:
+
+        schema = Schema("Application", {"RegFirstName": "first_name", "RegDOE": date("date_of_event")})
+
+        schema.fill(request)  # {"RegFirstName": "Jane", "RegDOE": "01/07/2025"}
+        schema.fill(VitalRecordsRequest.objects.values(*schema.fields).get(pk=request.id))  # the same
+
+    Empty values are left out of the filled dict, so those PDF fields keep their defaults.
+    """
+
+    __slots__ = ("name", "names", "fields", "_attr_getters", "_item_getters")
+
+    def __init__(self, name: str, sources: Mapping[str, str | Source]):
+        sources = {name: source if isinstance(source, Source) else Source(source) for name, source in sources.items()}
+
+        self.name = name
+        # the PDF field names
+        self.names = tuple(sources)
+        # the request field names read, in order of first use
+        self.fields = tuple(dict.fromkeys(field for source in sources.values() for field in source.fields))
+        self._attr_getters = tuple((name, source.compile(attrgetter)) for name, source in sources.items())
+        self._item_getters = tuple((name, source.compile(itemgetter)) for name, source in sources.items())
+
+    def fill(self, row) -> dict:
+        """The PDF field values for this request, a model instance or a `.values()` row, leaving out empty values."""
+        getters = self._item_getters if isinstance(row, dict) else self._attr_getters
+        return {name: value for name, get in getters if (value := get(row))}
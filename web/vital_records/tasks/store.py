@@ -0,0 +1,144 @@
+from contextlib import contextmanager
+from datetime import timedelta
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Iterable, Iterator, Sequence
+from uuid import UUID
+
+from django.conf import settings
+from django.utils import timezone
+
+from web.vital_records.models import StoredPackage
+
+logger = logging.getLogger(__name__)
+
+
+class PackageStore:
+    """Rendered packages, stored in a directory by the hash of what they were rendered from.
+
+    A package's key covers the template versions, the field values filled into each page, and any render options that
+    change the output. Rendering the same request again (e.g. on a retry) gives the same key, so the stored package
+    can be used as-is.
+
+    Usage:
+
+        store = PackageStore("/path/to/packages")
+        key = store.key(template_digests, pages)
+        if not store.exists(key):
+            store.put(key, render(...))
+        with store.local_file(key) as filename:
+            send(filename)
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    @staticmethod
+    def key(template_digests: Iterable[str], pages: Sequence[dict], *options, request_id: UUID = None) -> str:
+        """The content hash of a package rendered from templates with these digests, filling pages with options.
+
+        With request_id, the key is the request's own, even if another request fills in the same values.
+        """
+        content = json.dumps(
+            {"templates": list(template_digests), "pages": list(pages), "options": list(options), "request": request_id},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path(key))
+
+    def put(self, key: str, data: bytes):
+        """Store the package data under key."""
+        filename = self.path(key)
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a temporary file and swap it in, so a package is never seen partially written
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, "wb") as output_stream:
+            output_stream.write(data)
+        os.replace(tmp_filename, filename)
+        logger.debug(f"Stored package: {filename}")
+
+    @contextmanager
+    def local_file(self, key: str) -> Iterator[str]:
+        """The filename of the package stored under key, on this node, for as long as the context is open."""
+        yield self.path(key)
+
+    def discard(self, key: str):
+        """Forget the package stored under key, apart from its file, which is deleted by the caller."""
+        pass
+
+    def purge(self) -> int:
+        """Forget the packages that have expired. Returns the number forgotten."""
+        return 0
+
+
+class DatabasePackageStore(PackageStore):
+    """Rendered packages, shared between nodes through the database for `ttl` seconds after they're stored.
+
+    A package stored by the package task on one node can be attached by the email task on another, by key. Packages
+    are only kept in the database, where the cleanup task deletes them: a node that reads one writes it to a temporary
+    file for as long as it's needed, so the email attachment is still streamed from a file, and deletes it after.
+
+    Usage:
+
+        store = DatabasePackageStore("/path/to/packages", ttl=24 * 60 * 60)
+        store.put(key, render(...))
+        # on any node
+        with store.local_file(key) as filename:
+            send(filename)
+    """
+
+    def __init__(self, directory: str, ttl: int):
+        super().__init__(directory)
+        self.ttl = ttl
+
+    def _stored(self):
+        return StoredPackage.objects.filter(expires_at__gt=timezone.now())
+
+    def exists(self, key: str) -> bool:
+        return self._stored().filter(key=key).exists()
+
+    def put(self, key: str, data: bytes):
+        StoredPackage.objects.update_or_create(
+            key=key, defaults={"data": data, "expires_at": timezone.now() + timedelta(seconds=self.ttl)}
+        )
+        logger.debug(f"Stored package: {key}")
+
+    @contextmanager
+    def local_file(self, key: str) -> Iterator[str]:
+        """The filename of a temporary copy of the package stored under key, deleted when the context closes.
+
+        Raises `FileNotFoundError` if the package isn't stored, or has expired.
+        """
+        data = self._stored().filter(key=key).values_list("data", flat=True).first()
+        if data is None:
+            raise FileNotFoundError(f"Package isn't stored, or has expired: {key}")
+        # readable by this user only
+        fd, filename = tempfile.mkstemp(prefix="package-", suffix=".pdf")
+        try:
+            with os.fdopen(fd, "wb") as output_stream:
+                output_stream.write(data)
+            yield filename
+        finally:
+            os.remove(filename)
+
+    def discard(self, key: str):
+        StoredPackage.objects.filter(key=key).delete()
+
+    def purge(self) -> int:
+        count, _ = StoredPackage.objects.filter(expires_at__lte=timezone.now()).delete()
+        return count
+
+
+def get_package_store() -> PackageStore:
+    if settings.VITAL_RECORDS_PACKAGE_STORE_SHARED:
+        return DatabasePackageStore(settings.VITAL_RECORDS_PACKAGE_STORE_DIR, settings.VITAL_RECORDS_PACKAGE_STORE_TTL)
+    return PackageStore(settings.VITAL_RECORDS_PACKAGE_STORE_DIR)
@@ -0,0 +1,61 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+from opentelemetry import metrics
+
+from web.vital_records.tasks.email import email_bodies
+from web.vital_records.tasks.package import (
+    PACKAGE_FIELDS,
+    PACKAGE_TYPES,
+    create_documents,
+    get_package_templates,
+    get_render_engine,
+)
+
+logger = logging.getLogger(__name__)
+
+meter = metrics.get_meter(__name__)
+warm_up_duration = meter.create_histogram(
+    "vital_records.worker.warm_up.duration",
+    unit="s",
+    description="Time taken by a task queue worker to get ready before accepting its first task",
+)
+
+
+def warm_up():
+    """Get this (worker) process ready to package requests, so the first task doesn't pay for it.
+
+    Opens the database connection, renders the email bodies, loads the package templates, and renders one throwaway
+    package. Returns the number of seconds taken.
+    """
+    start = time.perf_counter()
+
+    connection.ensure_connection()
+
+    # renders the email bodies for each record type
+    email_bodies.preload()
+
+    # loads every record type's package templates, and starts the render pool
+    engine = get_render_engine()
+    request_type = PACKAGE_TYPES[0]
+    # an empty request: just the fields that are the same for every package
+    application, sworn_statement = create_documents(request_type, dict.fromkeys(PACKAGE_FIELDS))
+    engine.render(get_package_templates(request_type), application, sworn_statement)
+
+    duration = time.perf_counter() - start
+    warm_up_duration.record(duration)
+    logger.info(f"Worker warmed up in {duration * 1000:.0f} ms")
+    return duration
+
+
+def on_worker_spawn(sender, proc_name: str, **kwargs):
+    """django-q `post_spawn` receiver: warm up each cluster worker before it takes tasks from the queue."""
+    if not settings.VITAL_RECORDS_WORKER_WARM_UP:
+        return
+    try:
+        warm_up()
+    except Exception:
+        # the worker can still take tasks, they just pay for whatever didn't warm up
+        logger.exception(f"Warm up failed for worker: {proc_name}")
@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.db import transaction
 from django.http import HttpRequest
 from django.shortcuts import redirect
 from django.urls import reverse
@@ -20,7 +22,7 @@ from web.vital_records.forms.common import (
     COUNTY_CHOICES,
 )
 from web.vital_records.mixins import Steps, StepsMixin, ValidateRequestIdMixin
-from web.vital_records.models import VitalRecordsRequest
+from web.vital_records.models import RequestSubmission, VitalRecordsRequest
 from web.vital_records.session import Session
 
 
@@ -249,6 +251,14 @@ class SubmittedView(EligibilityMixin, ValidateRequestIdMixin, DetailView):
         response = super().get(request, *args, **kwargs)
         # only enque a task if the request is in the correct state
         if self.object.status == "submitted":
+            if settings.VITAL_RECORDS_SUBMIT_OUTBOX:
+                # Save the state update and the outbox submission together;
+                # the outbox dispatcher puts the task on the queue
+                with transaction.atomic():
+                    self.object.complete_enqueue()
+                    self.object.save()
+                    RequestSubmission.objects.create(request_id=self.object.pk)
+                return response
             # Move to next state *before* putting task on the queue
             # Want to avoid race condition where the task is processed
             # off the queue before the state update is saved in DB!